@@ -0,0 +1,325 @@
+# app/backtest.py
+# Offline replay engine.
+# Streams stored OHLCV bar by bar through the same pieces the live loop uses:
+#   IncrementalPivotTracker -> structure source -> strategy.handle_report -> ExchangeEngine
+# with a simulated ccxt-like exchange (SimExchange) instead of a live client.
+#
+# Per closed bar i, mirroring main.main:
+#   1. SimExchange.on_candle(i): resting LIMIT orders fill if the bar trades through them
+#   2. engine.poll(bar i): PENDING_ENTRY -> OPEN, TP/SL closes with MARKET orders
+#   3. structure report on the last `tail` bars -> strategy.handle_report -> engine.open
+#      (LIMIT), with the live throttle and spot SHORT skip; no journal / notify
+#
+# MARKET closes fill at the TP/SL trigger price by default (market_fill="trigger"),
+# or at the bar close (market_fill="close").
+# With exit_mode="bracket" the exits rest on SimExchange as STOP_MARKET /
+# TAKE_PROFIT_MARKET (or OCO) orders and trigger from the next bar on
+# (stops first, at the trigger price or at the open if the bar gaps through it).
+#
+# With the rule-based engine (or a warm LLM cache) a month of 5m bars replays in seconds:
+#     python backtest.py --db ./data/candles.db --symbol BTC/USDT --timeframe 5m --days 30
+
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+from loguru import logger
+from execution import ExchangeEngine
+from position_book import PositionBook
+from strategy import FIB_LEVEL, handle_report
+from structure_rules import detect_structure_with_rules
+from utils import IncrementalPivotTracker, iso_minutes, ts_to_ms
+
+
+class SimExchange:
+    """Exchange simulado con la interfaz ccxt que usa ExchangeEngine; cuenta cada llamada"""
+    has = {"fetchOpenOrders": True, "fetchOrders": True, "fetchClosedOrders": False}
+    _TRIGGER_ORDER = {"limit": 0, "stop_market": 1, "stop_loss_limit": 1}  # SL antes que TP
+
+    def __init__(self, price_prec: int = 2, amount_prec: int = 6, market_fill: str = "trigger"):
+        self.price_prec = price_prec
+        self.amount_prec = amount_prec
+        self.market_fill = market_fill
+        self.calls: Counter = Counter()
+        self.orders: Dict[str, dict] = {}
+        self._open: Dict[str, dict] = {}
+        self._seq = 0
+        self.last_candle: Optional[dict] = None
+
+    # ---------- Metadata ----------
+    def market(self, symbol):
+        self.calls["market"] += 1
+        return {"precision": {"price": self.price_prec, "amount": self.amount_prec}, "contract": True}
+
+    def market_id(self, symbol):
+        return symbol.replace("/", "")
+
+    def price_to_precision(self, symbol, price):
+        return f"{round(float(price), self.price_prec):.{self.price_prec}f}"
+
+    def amount_to_precision(self, symbol, amount):
+        q = 10 ** self.amount_prec
+        return f"{int(float(amount) * q) / q:.{self.amount_prec}f}"
+
+    def milliseconds(self):
+        return self.last_candle["ts_ms"] if self.last_candle else 0
+
+    # ---------- Orders ----------
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        self.calls["create_order"] += 1
+        return dict(self._new_order(symbol, type, side, amount, price, params))
+
+    def _new_order(self, symbol, type, side, amount, price=None, params=None, list_id=None) -> dict:
+        self._seq += 1
+        params = dict(params or {})
+        od = {
+            "id": str(self._seq), "symbol": symbol, "type": type.lower(), "side": side.lower(),
+            "amount": float(amount), "price": float(price) if price is not None else None,
+            "stopPrice": float(params["stopPrice"]) if "stopPrice" in params else None,
+            "status": "open", "average": None, "filled": 0.0, "orderListId": list_id,
+            "timestamp": self.milliseconds(), "params": params,
+        }
+        self.orders[od["id"]] = od
+        if od["type"] == "market":
+            avg = self.last_candle["close"] if (self.market_fill == "close" and self.last_candle) else None
+            self._fill(od, avg)
+        else:
+            self._open[od["id"]] = od
+        return od
+
+    def private_post_order_oco(self, params: dict):
+        """OCO de Binance spot: LIMIT_MAKER en `price` + STOP_LOSS_LIMIT en `stopPrice`"""
+        self.calls["private_post_order_oco"] += 1
+        self._seq += 1
+        list_id = str(self._seq)
+        side, qty = params["side"].lower(), params["quantity"]
+        tp = self._new_order(params["symbol"], "limit_maker", side, qty, params["price"], list_id=list_id)
+        sl = self._new_order(params["symbol"], "stop_loss_limit", side, qty, params["stopLimitPrice"],
+                             {"stopPrice": params["stopPrice"]}, list_id=list_id)
+        return {"orderListId": list_id,
+                "orderReports": [{"orderId": tp["id"], "type": "LIMIT_MAKER"},
+                                 {"orderId": sl["id"], "type": "STOP_LOSS_LIMIT"}]}
+
+    def _fill(self, od: dict, price: Optional[float]):
+        od["status"] = "closed"
+        od["average"] = price
+        od["filled"] = od["amount"]
+        od["lastTradeTimestamp"] = self.milliseconds()
+        self._open.pop(od["id"], None)
+        if od.get("orderListId"):  # OCO: se cancela la otra pata
+            for sib in list(self._open.values()):
+                if sib.get("orderListId") == od["orderListId"]:
+                    sib["status"] = "canceled"
+                    self._open.pop(sib["id"], None)
+
+    def cancel_order(self, id, symbol=None, params=None):
+        self.calls["cancel_order"] += 1
+        od = self.orders[id]
+        if od["status"] == "open":
+            od["status"] = "canceled"
+            self._open.pop(id, None)
+        return dict(od)
+
+    def fetch_order(self, id, symbol=None, params=None):
+        self.calls["fetch_order"] += 1
+        return dict(self.orders[id])
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params=None):
+        self.calls["fetch_open_orders"] += 1
+        return [dict(o) for o in self._open.values()]
+
+    def fetch_orders(self, symbol=None, since=None, limit=None, params=None):
+        self.calls["fetch_orders"] += 1
+        since = since or 0
+        return [dict(o) for o in self.orders.values()
+                if max(o["timestamp"], o.get("lastTradeTimestamp") or 0) >= since]
+
+    # ---------- Simulation ----------
+    def on_candle(self, candle: dict):
+        """
+        Llena órdenes LIMIT que la vela cruza (con gap: al open, si es mejor precio)
+        y dispara stops / take-profits (stops primero; con gap: al open, si es peor precio).
+        """
+        self.last_candle = candle
+        lo, hi, op = candle["low"], candle["high"], candle["open"]
+        for od in sorted(self._open.values(), key=lambda o: self._TRIGGER_ORDER.get(o["type"], 9)):
+            if od["id"] not in self._open:
+                continue  # pata OCO cancelada en esta misma vela
+            if od["type"] in ("limit", "limit_maker"):
+                px = od["price"]
+                if od["side"] == "buy" and lo <= px:
+                    self._fill(od, min(px, op))
+                elif od["side"] == "sell" and hi >= px:
+                    self._fill(od, max(px, op))
+            elif od["type"] in ("stop_market", "stop_loss_limit"):
+                px = od["stopPrice"]
+                if od["side"] == "sell" and lo <= px:
+                    self._fill(od, min(px, op))
+                elif od["side"] == "buy" and hi >= px:
+                    self._fill(od, max(px, op))
+            elif od["type"] == "take_profit_market":
+                px = od["stopPrice"]
+                if od["side"] == "sell" and hi >= px:
+                    self._fill(od, max(px, op))
+                elif od["side"] == "buy" and lo <= px:
+                    self._fill(od, min(px, op))
+
+
+@dataclass
+class BacktestConfig:
+    """Parámetros del replay (los mismos que se ajustan a mano en main.py)"""
+    symbol: str = "BTC/USDT"
+    K: int = 2
+    tail: int = 30
+    max_pivots: int = 14
+    fib: float = FIB_LEVEL
+    min_confidence: float = 0.60
+    max_open_pos: int = 1
+    size: float = 0.001
+    initial_equity: float = 10_000.0
+    warmup: int = 60
+    tz: str = "America/Santiago"
+    derivatives: bool = True
+    market_fill: str = "trigger"
+    exit_mode: str = "market"
+
+
+@dataclass
+class BacktestResult:
+    trades: List[dict]
+    equity: np.ndarray
+    stats: dict
+    config: BacktestConfig = field(default_factory=BacktestConfig)
+
+
+def _columns(candles) -> Dict[str, np.ndarray]:
+    if isinstance(candles, pd.DataFrame):
+        return {"ts": ts_to_ms(candles["ts"]), **{k: candles[k].to_numpy(dtype=np.float64)
+                                                  for k in ("open", "high", "low", "close")}}
+    return {"ts": np.asarray(candles["ts"], dtype=np.int64),
+            **{k: np.asarray(candles[k], dtype=np.float64) for k in ("open", "high", "low", "close")}}
+
+
+def _structure_source(structure: Union[str, Callable]) -> Callable:
+    if callable(structure):
+        return structure
+    if structure == "rules":
+        return detect_structure_with_rules
+    if structure in ("llm", "cached"):
+        from structure_oracle import detect_structure_with_llm  # usa LLM_CACHE_DB
+        return detect_structure_with_llm
+    raise ValueError(f"structure desconocido: {structure}")
+
+
+def run_backtest(candles, structure: Union[str, Callable] = "rules",
+                 config: Optional[BacktestConfig] = None) -> BacktestResult:
+    """
+    Replay bar a bar. `candles`: DataFrame (ts, open, high, low, close) o dict de arrays
+    con ts en epoch ms. Todas las velas se consideran cerradas.
+    """
+    cfg = config or BacktestConfig()
+    col = _columns(candles)
+    ts_ms, o, h, l, c = col["ts"], col["open"], col["high"], col["low"], col["close"]
+    n = len(ts_ms)
+    iso = iso_minutes(ts_ms, cfg.tz)
+    o2, h2, l2, c2 = (np.round(a, 2).tolist() for a in (o, h, l, c))
+    detect = _structure_source(structure)
+
+    sim = SimExchange(market_fill=cfg.market_fill)
+    engine = ExchangeEngine(exchange=sim, symbol=cfg.symbol, is_derivatives=cfg.derivatives,
+                            max_open_positions=cfg.max_open_pos, min_confidence=cfg.min_confidence,
+                            exit_mode=cfg.exit_mode, book=PositionBook(keep_closed=None))
+    tracker = IncrementalPivotTracker(K=cfg.K, maxlen=2 * cfg.tail + 4)
+    equity = np.empty(n, dtype=np.float64)
+    last_signal_ts = None
+    signals = 0
+
+    t0 = time.perf_counter()
+    logger.disable("execution")
+    logger.disable("strategy")
+    try:
+        for i in range(n):
+            tracker.update(i, h[i], l[i])
+            bar = {"ts": iso[i], "ts_ms": int(ts_ms[i]), "open": o[i], "high": h[i], "low": l[i], "close": c[i]}
+            sim.on_candle(bar)
+            engine.poll(bar)
+
+            if i + 1 >= cfg.warmup:
+                start = max(0, i - cfg.tail + 1)
+                window = [[iso[j], o2[j], h2[j], l2[j], c2[j]] for j in range(start, i + 1)]
+                pivots = [{"type": p["type"], "ts": iso[p["ts"]][:16], "price": round(p["price"], 2)}
+                          for p in tracker.pivots if p["ts"] >= start][-cfg.max_pivots:]
+                report = detect(window, pivots, cfg.K)
+                acted = handle_report(report, engine, last_signal_ts, cfg.symbol, cfg.min_confidence,
+                                      cfg.size, fib=cfg.fib)
+                if acted != last_signal_ts:
+                    last_signal_ts = acted
+                    signals += 1
+
+            unrealized = sum((c[i] - p.entry) * (1 if p.side == "LONG" else -1) * p.size
+                             for p in engine.book.with_status("OPEN"))
+            equity[i] = cfg.initial_equity + engine.total_realized_pnl() + unrealized
+    finally:
+        logger.enable("execution")
+        logger.enable("strategy")
+    elapsed = time.perf_counter() - t0
+
+    trades = [
+        {"side": p.side, "entry": p.entry, "stop": p.stop, "tp": p.tp, "size": p.size,
+         "opened_ts": p.opened_ts, "closed_ts": p.closed_ts, "close_price": p.close_price,
+         "status": p.status, "pnl": p.pnl}
+        for p in engine.book.closed if p.close_price is not None
+    ]
+    return BacktestResult(trades=trades, equity=equity, stats=_summary(engine, trades, equity, n, signals, elapsed, sim),
+                          config=cfg)
+
+
+def _summary(engine: ExchangeEngine, trades: List[dict], equity: np.ndarray, bars: int,
+             signals: int, elapsed: float, sim: SimExchange) -> dict:
+    stats = engine.get_stats()
+    wins = sum(1 for t in trades if t["pnl"] > 0)
+    peak = np.maximum.accumulate(equity) if len(equity) else equity
+    max_dd = float((peak - equity).max()) if len(equity) else 0.0
+    stats.update({
+        "bars": bars,
+        "signals": signals,
+        "trades": len(trades),
+        "win_rate": wins / len(trades) if trades else 0.0,
+        "final_equity": float(equity[-1]) if len(equity) else 0.0,
+        "max_drawdown": max_dd,
+        "exchange_calls": sum(sim.calls.values()),
+        "elapsed_s": round(elapsed, 3),
+    })
+    return stats
+
+
+def load_candles(db_path: str, exchange: str, symbol: str, timeframe: str,
+                 since: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Lee velas del CandleStore como dict de arrays (ts en epoch ms)"""
+    from candle_store import CandleStore
+    rows = CandleStore(db_path).load(exchange, symbol, timeframe, limit=-1, since=since or 0)
+    arr = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+    return {"ts": arr[:, 0].astype(np.int64), "open": arr[:, 1], "high": arr[:, 2],
+            "low": arr[:, 3], "close": arr[:, 4], "volume": arr[:, 5]}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Replay de la estrategia sobre velas guardadas")
+    ap.add_argument("--db", default="./data/candles.db")
+    ap.add_argument("--exchange", default="binance")
+    ap.add_argument("--symbol", default="BTC/USDT")
+    ap.add_argument("--timeframe", default="5m")
+    ap.add_argument("--days", type=float, default=30)
+    ap.add_argument("--engine", default="rules", choices=["rules", "llm", "cached"])
+    ap.add_argument("--exit-mode", default="market", choices=["market", "bracket"])
+    args = ap.parse_args()
+
+    since = int((time.time() - args.days * 86400) * 1000)
+    data = load_candles(args.db, args.exchange, args.symbol, args.timeframe, since=since)
+    res = run_backtest(data, structure=args.engine, config=BacktestConfig(symbol=args.symbol, exit_mode=args.exit_mode))
+    for k, v in res.stats.items():
+        print(f"{k:20s} {v}")
@@ -0,0 +1,134 @@
+# app/candle_store.py
+# Persistent OHLCV cache (SQLite) keyed by (exchange, symbol, timeframe, ts).
+# - sync() only downloads candles newer than the last stored one (ccxt `since`),
+#   re-fetching the last stored bar because it may have been the forming candle.
+# - On the first sync of each key in the process (i.e. after a restart) it also
+#   checks the requested window for holes and re-downloads from the first gap;
+#   the check is only marked done once that download completes.
+# - load() returns rows in ccxt format: [ts_ms, open, high, low, close, volume].
+#
+# A loop that finds no new closed candle costs a single small request
+# (1-2 candles) instead of downloading the full 300-candle window.
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+FETCH_PAGE = 1000  # máximo de velas por request (Binance)
+
+
+class CandleStore:
+    """Caché local de velas OHLCV con descargas incrementales"""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ohlcv (
+                   exchange TEXT NOT NULL,
+                   symbol TEXT NOT NULL,
+                   timeframe TEXT NOT NULL,
+                   ts INTEGER NOT NULL,
+                   open REAL, high REAL, low REAL, close REAL, volume REAL,
+                   PRIMARY KEY (exchange, symbol, timeframe, ts)
+               ) WITHOUT ROWID"""
+        )
+        self._conn.commit()
+        self._gap_checked: Dict[Tuple[str, str, str], bool] = {}
+
+    # ---------- Storage ----------
+    def last_ts(self, exchange: str, symbol: str, timeframe: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM ohlcv WHERE exchange=? AND symbol=? AND timeframe=?",
+                (exchange, symbol, timeframe),
+            ).fetchone()
+        return row[0] if row else None
+
+    def upsert(self, exchange: str, symbol: str, timeframe: str, rows: List[List]):
+        """Inserta o reemplaza velas (la vela en formación se sobreescribe en cada sync)"""
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ohlcv VALUES (?,?,?,?,?,?,?,?,?)",
+                [(exchange, symbol, timeframe, int(r[0]), r[1], r[2], r[3], r[4], r[5]) for r in rows],
+            )
+            self._conn.commit()
+
+    def load(self, exchange: str, symbol: str, timeframe: str, limit: int = 300,
+             since: Optional[int] = None) -> List[List]:
+        """Últimas `limit` velas (desde `since` si se indica), en orden ascendente"""
+        with self._lock:
+            if since is None:
+                rows = self._conn.execute(
+                    "SELECT ts, open, high, low, close, volume FROM ohlcv "
+                    "WHERE exchange=? AND symbol=? AND timeframe=? ORDER BY ts DESC LIMIT ?",
+                    (exchange, symbol, timeframe, limit),
+                ).fetchall()
+                rows.reverse()
+            else:
+                rows = self._conn.execute(
+                    "SELECT ts, open, high, low, close, volume FROM ohlcv "
+                    "WHERE exchange=? AND symbol=? AND timeframe=? AND ts>=? ORDER BY ts ASC LIMIT ?",
+                    (exchange, symbol, timeframe, since, limit),
+                ).fetchall()
+        return [list(r) for r in rows]
+
+    def _first_gap(self, exchange: str, symbol: str, timeframe: str,
+                   start: int, end: int, tf_ms: int) -> Optional[int]:
+        """Primer ts faltante en [start, end], o None si la ventana está completa"""
+        with self._lock:
+            have = [r[0] for r in self._conn.execute(
+                "SELECT ts FROM ohlcv WHERE exchange=? AND symbol=? AND timeframe=? AND ts BETWEEN ? AND ? "
+                "ORDER BY ts ASC",
+                (exchange, symbol, timeframe, start, end),
+            )]
+        expected = start
+        for ts in have:
+            if ts != expected:
+                return expected
+            expected += tf_ms
+        return expected if expected <= end else None
+
+    # ---------- Sync ----------
+    def sync(self, client, exchange: str, symbol: str, timeframe: str, limit: int = 300) -> List[List]:
+        """
+        Descarga solo lo que falta y retorna las últimas `limit` velas
+        (la última puede estar en formación, igual que client.fetch_ohlcv).
+        """
+        key = (exchange, symbol, timeframe)
+        tf_ms = client.parse_timeframe(timeframe) * 1000
+        now = client.milliseconds()
+        window_start = (now // tf_ms) * tf_ms - (limit - 1) * tf_ms
+
+        last = self.last_ts(*key)
+        if last is None or last < window_start:
+            since = window_start
+        else:
+            since = last
+            if not self._gap_checked.get(key):
+                gap = self._first_gap(*key, window_start, last, tf_ms)
+                if gap is not None:
+                    logger.info("CandleStore: reparando hueco {} {} desde ts={}", symbol, timeframe, gap)
+                    since = gap
+
+        while True:
+            batch = client.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=FETCH_PAGE)
+            self.upsert(*key, batch)
+            if len(batch) < FETCH_PAGE:
+                break
+            since = batch[-1][0] + tf_ms
+            if since > now:
+                break
+        # solo tras una descarga completa: si falla, el próximo sync vuelve a buscar huecos
+        self._gap_checked[key] = True
+
+        return self.load(*key, limit=limit)
@@ -0,0 +1,100 @@
+# app/exchange_pool.py
+# Process-wide pool of ccxt clients.
+# - One client per (exchange, sandbox) pair, shared by data fetching and order execution.
+#   ccxt clients are not thread-safe: code that calls the exchange from several
+#   threads asks for one client per thread with `tag` (e.g. the thread name).
+#   Tagged clients get their own requests.Session and start from the markets the
+#   untagged client already loaded.
+# - Untagged clients share a single requests.Session (keep-alive: no TLS handshake per loop).
+# - Markets are loaded once and refreshed only when older than `markets_ttl`.
+#   A failed load is not retried on every get(): the next attempt waits
+#   `retry_backoff` seconds, doubling per consecutive failure (capped at the TTL).
+#   ExchangeEngine re-reads its market info whenever the client's markets change.
+# - Every HTTP request made through a pooled client is counted (`calls`), so the
+#   main loop can log how many network round-trips each iteration costs, and
+#   timed into metrics (exchange_request_seconds, by HTTP method).
+
+import threading
+import time
+from typing import Dict, Tuple
+import ccxt
+import requests
+from loguru import logger
+from metrics import metrics
+
+
+class ClientPool:
+    """Pool de clientes ccxt autenticados con markets cacheados"""
+
+    def __init__(self, markets_ttl: float = 3600.0, retry_backoff: float = 30.0):
+        self.markets_ttl = markets_ttl
+        self.retry_backoff = retry_backoff
+        self.session = requests.Session()
+        self.calls = 0
+        self._clients: Dict[Tuple[str, bool, str], object] = {}
+        self._markets_at: Dict[Tuple[str, bool, str], float] = {}
+        self._retry_at: Dict[Tuple[str, bool, str], Tuple[float, int]] = {}  # key -> (próximo intento, fallos)
+        self._lock = threading.Lock()
+
+    def _count(self, client):
+        """Envuelve client.fetch (capa HTTP de ccxt) para contar y medir requests"""
+        raw_fetch = client.fetch
+        latency = metrics.histogram("exchange_request_seconds")
+
+        def fetch(*args, **kwargs):
+            self.calls += 1
+            method = args[1] if len(args) > 1 else kwargs.get("method", "GET")
+            t0 = time.perf_counter()
+            try:
+                return raw_fetch(*args, **kwargs)
+            finally:
+                latency.observe(time.perf_counter() - t0, method=method)
+
+        client.fetch = fetch
+
+    def get(self, exchange: str, sandbox: bool = False, api_key: str = "", secret: str = "", tag: str = ""):
+        """
+        Retorna el cliente para (exchange, sandbox, tag), creándolo si no existe.
+        tag separa clientes usados desde hilos distintos (ccxt no es thread-safe).
+        """
+        key = (exchange.lower(), sandbox, tag)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                klass = getattr(ccxt, exchange)
+                client = klass({
+                    "enableRateLimit": True,
+                    "apiKey": api_key,
+                    "secret": secret,
+                    "session": requests.Session() if tag else self.session,
+                })
+                if sandbox:
+                    client.set_sandbox_mode(True)
+                self._count(client)
+                self._clients[key] = client
+                base = self._clients.get(key[:2] + ("",))
+                if tag and key[:2] + ("",) in self._markets_at and base.markets:
+                    client.set_markets(base.markets, base.currencies)
+                    self._markets_at[key] = self._markets_at[key[:2] + ("",)]
+                logger.info("ClientPool: nuevo cliente {} (sandbox={}{})", exchange, sandbox,
+                            f", tag={tag}" if tag else "")
+
+            loaded_at = self._markets_at.get(key)
+            now = time.monotonic()
+            retry_at, failures = self._retry_at.get(key, (0.0, 0))
+            if (loaded_at is None or now - loaded_at > self.markets_ttl) and now >= retry_at:
+                try:
+                    client.load_markets(reload=loaded_at is not None)
+                    self._markets_at[key] = time.monotonic()
+                    self._retry_at.pop(key, None)
+                except Exception as e:
+                    # Sin markets el cliente sigue sirviendo OHLCV; se reintenta tras el backoff
+                    failures += 1
+                    wait = min(self.markets_ttl, self.retry_backoff * 2 ** (failures - 1))
+                    self._retry_at[key] = (time.monotonic() + wait, failures)
+                    logger.warning("ClientPool: load_markets falló para {} ({} seguidos, reintento en {:.0f}s): {}",
+                                   exchange, failures, wait, str(e)[:160])
+        return client
+
+
+pool = ClientPool()
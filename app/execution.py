@@ -12,6 +12,25 @@
 # - You should call engine.poll(candle_dict) once per CLOSED 5m candle to:
 #     * transition entry orders to OPEN when filled,
 #     * close OPEN positions by TP/SL with a MARKET reduce order.
+# - Entry orders are reconciled in bulk: one fetch_open_orders (+ at most one
+#   fetch_orders for the ones no longer open) per poll, indexed by order id,
+#   so a poll costs O(1) requests regardless of how many entries are pending.
+# - close_position() is the single, lock-protected exit path: the candle-based
+#   poll and the intrabar price watcher (price_watcher.py) can both call it and
+#   only the first call on an OPEN position sends the MARKET order.
+# - Position transitions (PENDING_ENTRY / OPEN / CLOSED_*) are published to `listeners`.
+# - exit_mode="bracket" (opt-in): once the entry fills, the exits are resting on the
+#   exchange instead of in this process:
+#     * derivatives: reduce-only STOP_MARKET (stop) + TAKE_PROFIT_MARKET (tp)
+#     * spot: one OCO sell (LIMIT_MAKER at tp + STOP_LOSS_LIMIT at stop)
+#   poll() reconciles them in the same bulk snapshot as the entries, books the
+#   fill and cancels the sibling (OCO cancels its own). If the bracket cannot be
+#   placed, that position falls back to the MARKET-on-candle path above.
+# - recover() re-adopts positions replayed from state_journal.py after a restart
+#   and reconciles them with one bulk snapshot.
+# - Positions live in a PositionBook (position_book.py): indexed by status and
+#   order id, with running counts / realized PnL; closed positions are archived
+#   and dropped from the live indexes, so per-bar cost depends only on live ones.
 #
 # Env best practices (outside this file):
 #   - For Binance Testnet (spot): client.set_sandbox_mode(True)
@@ -19,9 +38,11 @@
 #   - Provide API keys via env to the ccxt client in your factory.
 
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from loguru import logger
 import math
+import threading
+from position_book import PositionBook
 
 
 @dataclass
@@ -35,6 +56,11 @@ class Position:
     opened_ts: str
     status: str = "PENDING_ENTRY"  # PENDING_ENTRY -> OPEN -> CLOSED_TP|CLOSED_SL
     entry_order_id: Optional[str] = None
+    entry_order_ms: Optional[int] = None   # timestamp de creación de la orden (exchange)
+    sl_order_id: Optional[str] = None      # exit_mode="bracket": órdenes de salida en el exchange
+    tp_order_id: Optional[str] = None
+    oco_list_id: Optional[str] = None      # spot: orderListId del OCO
+    exit_order_ms: Optional[int] = None
     tp_hit: bool = False
     sl_hit: bool = False
     closed_ts: Optional[str] = None
@@ -50,17 +76,27 @@ class ExchangeEngine:
     is_derivatives: bool     # True para binanceusdm; False para spot binance
     max_open_positions: int = 1
     min_confidence: float = 0.60
-    positions: List[Position] = field(default_factory=list)
+    exit_mode: str = "market"            # "market" (cierre por vela) o "bracket" (SL/TP en el exchange)
+    stop_limit_offset: float = 0.002     # spot OCO: stopLimitPrice = stop * (1 - offset)
+    book: PositionBook = field(default_factory=PositionBook)
+    listeners: List[Callable[[Position], None]] = field(default_factory=list, repr=False)
+    _market: Optional[dict] = field(default=None, init=False, repr=False)
+    _market_src: any = field(default=None, init=False, repr=False)  # client.markets del que salió _market
+    _lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
 
     # ---------- Helpers ----------
     def _market_info(self):
-        """Obtiene información de precisión del mercado"""
-        m = self.exchange.market(self.symbol)
-        return {
-            "price_prec": m.get("precision", {}).get("price", None),
-            "amount_prec": m.get("precision", {}).get("amount", None),
-            "contract": m.get("contract", False),
-        }
+        """Información de precisión del mercado; se relee cuando el pool recarga los markets del cliente"""
+        src = getattr(self.exchange, "markets", None)
+        if self._market is None or src is not self._market_src:
+            m = self.exchange.market(self.symbol)
+            self._market_src = src
+            self._market = {
+                "price_prec": m.get("precision", {}).get("price", None),
+                "amount_prec": m.get("precision", {}).get("amount", None),
+                "contract": m.get("contract", False),
+            }
+        return self._market
 
     def _p(self, price: float) -> float:
         """Redondea precio a la precisión del exchange"""
@@ -99,10 +135,149 @@ class ExchangeEngine:
         """Parámetros para reducir posición (derivados)"""
         return {"reduceOnly": True} if self.is_derivatives else {}
 
+    def _has(self, feature: str) -> bool:
+        has = getattr(self.exchange, "has", None) or {}
+        return bool(has.get(feature))
+
+    def _order_snapshot(self, orders: Dict[str, Optional[int]]) -> Dict[str, dict]:
+        """
+        Estado de las órdenes seguidas ({id: ms de creación}), indexado por id, con requests en bloque:
+        1) fetch_open_orders: las que siguen abiertas
+        2) fetch_orders desde la creación de la más antigua: llenadas/canceladas
+        Solo si el exchange no soporta los endpoints en bloque se cae a fetch_order por orden.
+        """
+        snap: Dict[str, dict] = {}
+        if self._has("fetchOpenOrders"):
+            for od in self.exchange.fetch_open_orders(self.symbol):
+                snap[str(od.get("id"))] = od
+
+        missing = [oid for oid in orders if oid not in snap]
+        if missing and (self._has("fetchOrders") or self._has("fetchClosedOrders")):
+            stamps = [orders[oid] for oid in missing if orders[oid]]
+            since = min(stamps) - 1000 if len(stamps) == len(missing) else None
+            fetch = self.exchange.fetch_orders if self._has("fetchOrders") else self.exchange.fetch_closed_orders
+            for od in fetch(self.symbol, since=since):
+                oid = str(od.get("id"))
+                if oid in orders:
+                    snap[oid] = od
+
+        for oid in orders:
+            if oid not in snap:
+                try:
+                    snap[oid] = self.exchange.fetch_order(oid, self.symbol)
+                except Exception as e:
+                    logger.warning("EX fetch_order error id={}: {}", oid, str(e)[:160])
+        return snap
+
+    def _place_bracket(self, p: Position) -> bool:
+        """Coloca SL/TP en el exchange para una posición recién llenada"""
+        opp = self._opposite(p.side)
+        qty = self._a(p.size)
+        try:
+            if self.is_derivatives:
+                sl = self.exchange.create_order(
+                    symbol=self.symbol, type="STOP_MARKET", side=opp, amount=qty,
+                    params={"stopPrice": p.stop, "reduceOnly": True},
+                )
+                try:
+                    tp = self.exchange.create_order(
+                        symbol=self.symbol, type="TAKE_PROFIT_MARKET", side=opp, amount=qty,
+                        params={"stopPrice": p.tp, "reduceOnly": True},
+                    )
+                except Exception:
+                    self.exchange.cancel_order(sl.get("id"), self.symbol)
+                    raise
+                p.sl_order_id, p.tp_order_id = str(sl.get("id")), str(tp.get("id"))
+            else:
+                # Spot (solo LONG): un OCO, el exchange cancela la pata hermana
+                res = self.exchange.private_post_order_oco({
+                    "symbol": self.exchange.market_id(self.symbol),
+                    "side": opp.upper(),
+                    "quantity": self.exchange.amount_to_precision(self.symbol, qty),
+                    "price": self.exchange.price_to_precision(self.symbol, p.tp),
+                    "stopPrice": self.exchange.price_to_precision(self.symbol, p.stop),
+                    "stopLimitPrice": self.exchange.price_to_precision(
+                        self.symbol, p.stop * (1 - self.stop_limit_offset)),
+                    "stopLimitTimeInForce": "GTC",
+                })
+                for r in res.get("orderReports") or []:
+                    if "STOP" in str(r.get("type")).upper():
+                        p.sl_order_id = str(r.get("orderId"))
+                    else:
+                        p.tp_order_id = str(r.get("orderId"))
+                p.oco_list_id = str(res.get("orderListId"))
+            p.exit_order_ms = self.exchange.milliseconds()
+            logger.info("EX BRACKET PLACED | {} sl_id={} tp_id={} oco={}",
+                       p.side, p.sl_order_id, p.tp_order_id, p.oco_list_id)
+            return True
+        except Exception as e:
+            p.sl_order_id = p.tp_order_id = p.oco_list_id = None
+            logger.error("EX BRACKET ERROR (cierre por vela como respaldo): {}", str(e)[:200])
+            return False
+
+    def _cancel_bracket(self, p: Position, client=None) -> bool:
+        """Retira SL/TP del exchange (antes de un cierre manual)"""
+        ids = [p.sl_order_id] if p.oco_list_id else [p.sl_order_id, p.tp_order_id]
+        for oid in ids:
+            try:
+                (client or self.exchange).cancel_order(oid, self.symbol)
+            except Exception as e:
+                logger.warning("EX cancel bracket error id={}: {}", oid, str(e)[:160])
+                return False
+        p.sl_order_id = p.tp_order_id = p.oco_list_id = None
+        return True
+
+    def _sync_bracket(self, p: Position, snap: Dict[str, dict], ts: str):
+        """Registra el cierre si una pata del bracket se llenó y cancela la hermana"""
+        legs = (("SL", p.sl_order_id, p.tp_order_id, p.stop), ("TP", p.tp_order_id, p.sl_order_id, p.tp))
+        for reason, oid, sibling, level in legs:
+            od = snap.get(str(oid))
+            if od is None or (od.get("status") or "").lower() not in ("closed", "filled"):
+                continue
+            with self._lock:
+                if p.status != "OPEN":
+                    return
+                filled = od.get("average") or od.get("stopPrice") or od.get("triggerPrice") or level
+                p.close_price = float(filled)
+                p.closed_ts = ts
+                p.status = f"CLOSED_{reason}"
+                sign = 1 if p.side == "LONG" else -1
+                p.pnl = (p.close_price - p.entry) * sign * p.size
+                logger.info("EX {} CLOSED {} (bracket) | close={:.2f} pnl={:.2f}",
+                           p.side, reason, p.close_price, p.pnl)
+            if sibling and not p.oco_list_id:
+                try:
+                    self.exchange.cancel_order(sibling, self.symbol)
+                except Exception as e:
+                    logger.warning("EX cancel sibling error id={}: {}", sibling, str(e)[:160])
+            self._notify(p)
+            return
+
+        gone = ("canceled", "cancelled", "rejected", "expired")
+        if all((snap.get(str(oid)) or {}).get("status", "").lower() in gone
+               for oid in (p.sl_order_id, p.tp_order_id)):
+            logger.warning("EX BRACKET cancelado fuera del bot | {}: vuelve a cierre por vela", p.side)
+            p.sl_order_id = p.tp_order_id = p.oco_list_id = None
+            self._notify(p)  # el journal debe ver que ya no hay bracket
+
+    def _notify(self, p: Position):
+        """Reindexa la posición en el libro y publica la transición a los listeners"""
+        self.book.update(p)
+        for cb in self.listeners:
+            try:
+                cb(p)
+            except Exception as e:
+                logger.warning("EX listener error: {}", str(e)[:160])
+
     # ---------- Public API ----------
+    @property
+    def positions(self) -> List[Position]:
+        """Posiciones vivas (PENDING_ENTRY / OPEN); las cerradas están en book.closed"""
+        return self.book.live()
+
     def can_open(self) -> bool:
         """Verifica si hay espacio para nueva posición"""
-        return sum(1 for p in self.positions if p.status in ("PENDING_ENTRY", "OPEN")) < self.max_open_positions
+        return self.book.live_count() < self.max_open_positions
 
     def open(self, side: str, entry: float, stop: float, tp: float, size: float, ts: str, confidence: float = 1.0) -> Optional[Position]:
         """
@@ -151,10 +326,12 @@ class ExchangeEngine:
                 opened_ts=ts,
                 status="PENDING_ENTRY",
                 entry_order_id=order.get("id"),
+                entry_order_ms=order.get("timestamp"),
             )
-            self.positions.append(pos)
+            self.book.add(pos)
             logger.info("EX ORDER PLACED | id={} side={} entry={:.2f} sl={:.2f} tp={:.2f}",
                        pos.entry_order_id, side_u, pos.entry, pos.stop, pos.tp)
+            self._notify(pos)
             return pos
 
         except Exception as e:
@@ -171,32 +348,11 @@ class ExchangeEngine:
         high = float(last_candle["high"])
         low  = float(last_candle["low"])
 
-        # 1) Transicionar PENDING_ENTRY -> OPEN cuando se llena
-        for p in self.positions:
-            if p.status != "PENDING_ENTRY":
-                continue
-            if not p.entry_order_id:
-                continue
-            try:
-                od = self.exchange.fetch_order(p.entry_order_id, self.symbol)
-                st = (od.get("status") or "").lower()
-                if st in ("closed", "filled"):
-                    p.status = "OPEN"
-                    filled_price = od.get("average") or od.get("price") or p.entry
-                    logger.info("EX ENTRY FILLED | {} id={} price={:.2f}",
-                               p.side, p.entry_order_id, float(filled_price))
-                elif st in ("canceled", "rejected"):
-                    p.status = "CLOSED_SL"
-                    p.closed_ts = ts
-                    p.close_price = None
-                    p.pnl = 0.0
-                    logger.warning("EX ENTRY CANCELED | id={} status={}", p.entry_order_id, st)
-            except Exception as e:
-                logger.warning("EX fetch_order error id={}: {}", p.entry_order_id, str(e)[:160])
+        self._sync_orders(ts)
 
-        # 2) Para posiciones OPEN, cierra por TP/SL con MARKET reduce
-        for p in self.positions:
-            if p.status != "OPEN":
+        # 2) Para posiciones OPEN sin bracket, cierra por TP/SL con MARKET reduce
+        for p in self.book.with_status("OPEN"):
+            if p.sl_order_id:
                 continue
 
             # Detectar hits
@@ -208,67 +364,142 @@ class ExchangeEngine:
                 hit_sl = high >= p.stop
 
             # SL tiene prioridad si ambos se tocan en la misma vela
-            reason = None
-            close_px = None
             if hit_sl:
-                reason = "SL"
-                close_px = p.stop
+                self.close_position(p, "SL", p.stop, ts)
             elif hit_tp:
-                reason = "TP"
-                close_px = p.tp
+                self.close_position(p, "TP", p.tp, ts)
 
-            if reason:
-                try:
-                    opp = self._opposite(p.side)
-                    params = self._reduce_params()
-                    qty = self._a(p.size)
-
-                    logger.info("EX CLOSING {} | reason={} price={:.2f}",
-                               p.side, reason, close_px)
-
-                    # Cierre MARKET
-                    od = self.exchange.create_order(
-                        symbol=self.symbol,
-                        type="market",
-                        side=opp,
-                        amount=qty,
-                        params=params,
-                    )
+    def recover(self, positions: List[Position], ts: str):
+        """
+        Reincorpora posiciones PENDING_ENTRY / OPEN de un journal tras un reinicio y las
+        reconcilia con el exchange en bloque (mismo snapshot que poll()).
+        Las órdenes abiertas del símbolo que ninguna posición conoce se reportan.
+        """
+        for p in positions:
+            self.book.add(p)
+        snap = self._sync_orders(ts, force=True)
+        orphans = [oid for oid, od in snap.items()
+                   if self.book.by_order(oid) is None and (od.get("status") or "").lower() == "open"]
+        logger.info("EX RECOVER | {} posiciones ({} OPEN, {} PENDING_ENTRY)", len(positions),
+                    self.book.counts["OPEN"], self.book.counts["PENDING_ENTRY"])
+        if orphans:
+            logger.warning("EX RECOVER | órdenes abiertas sin posición conocida: {}", orphans)
+
+    def _sync_orders(self, ts: str, force: bool = False) -> Dict[str, dict]:
+        """
+        Pasos 1 y 1b de poll(): entradas pendientes y brackets contra un snapshot en bloque.
+        force=True consulta el exchange aunque no haya órdenes seguidas (recover).
+        """
+        # 1) Transicionar PENDING_ENTRY -> OPEN cuando se llena (reconciliación en bloque,
+        #    junto con las órdenes de salida de las posiciones con bracket)
+        pending = [p for p in self.book.with_status("PENDING_ENTRY") if p.entry_order_id]
+        bracketed = [p for p in self.book.with_status("OPEN") if p.sl_order_id]
+        tracked: Dict[str, Optional[int]] = {str(p.entry_order_id): p.entry_order_ms for p in pending}
+        for p in bracketed:
+            tracked.update({str(oid): p.exit_order_ms for oid in (p.sl_order_id, p.tp_order_id) if oid})
+        snap: Dict[str, dict] = {}
+        if tracked or force:
+            try:
+                snap = self._order_snapshot(tracked)
+            except Exception as e:
+                logger.warning("EX order sync error: {}", str(e)[:160])
 
-                    # Usar precio de llenado si el exchange lo retorna
-                    filled = None
-                    if od and isinstance(od, dict):
-                        filled = od.get("average") or od.get("price")
-                    p.close_price = float(filled) if filled else float(close_px)
+        for p in pending:
+            od = snap.get(str(p.entry_order_id))
+            if od is None:
+                continue
+            st = (od.get("status") or "").lower()
+            with self._lock:
+                if p.status != "PENDING_ENTRY":
+                    continue
+                if st in ("closed", "filled"):
+                    p.status = "OPEN"
+                    filled_price = od.get("average") or od.get("price") or p.entry
+                    logger.info("EX ENTRY FILLED | {} id={} price={:.2f}",
+                               p.side, p.entry_order_id, float(filled_price))
+                    if self.exit_mode == "bracket":
+                        self._place_bracket(p)
+                elif st in ("canceled", "rejected", "expired"):
+                    p.status = "CLOSED_SL"
                     p.closed_ts = ts
-                    p.status = f"CLOSED_{reason}"
+                    p.close_price = None
+                    p.pnl = 0.0
+                    logger.warning("EX ENTRY CANCELED | id={} status={}", p.entry_order_id, st)
+                else:
+                    continue
+            self._notify(p)
 
-                    # PnL en moneda quote (aprox): (close - entry) * size (sign por side)
-                    sign = 1 if p.side == "LONG" else -1
-                    p.pnl = (p.close_price - p.entry) * sign * p.size
+        # 1b) Brackets: el exchange ya cerró; solo se registra el llenado
+        for p in bracketed:
+            self._sync_bracket(p, snap, ts)
+        return snap
 
-                    logger.info("EX {} CLOSED {} | close={:.2f} pnl={:.2f}",
-                               p.side, reason, p.close_price, p.pnl)
+    def close_position(self, p: Position, reason: str, close_px: float, ts: str, client=None) -> bool:
+        """
+        Cierra una posición OPEN con una orden MARKET reduce.
+        Idempotente: solo la primera llamada sobre una posición OPEN envía la orden.
+        Con bracket activo, primero retira el SL/TP del exchange.
+        client: cliente ccxt propio del hilo que llama (ccxt no es thread-safe); por defecto self.exchange.
+        Retorna True si esta llamada cerró la posición.
+        """
+        with self._lock:
+            if p.status != "OPEN":
+                return False
+            had_bracket = bool(p.sl_order_id)
+            if had_bracket and not self._cancel_bracket(p, client):
+                return False
+            try:
+                opp = self._opposite(p.side)
+                params = self._reduce_params()
+                qty = self._a(p.size)
+
+                logger.info("EX CLOSING {} | reason={} price={:.2f}",
+                           p.side, reason, close_px)
+
+                # Cierre MARKET
+                od = (client or self.exchange).create_order(
+                    symbol=self.symbol,
+                    type="market",
+                    side=opp,
+                    amount=qty,
+                    params=params,
+                )
+
+                # Usar precio de llenado si el exchange lo retorna
+                filled = None
+                if od and isinstance(od, dict):
+                    filled = od.get("average") or od.get("price")
+                p.close_price = float(filled) if filled else float(close_px)
+                p.closed_ts = ts
+                p.status = f"CLOSED_{reason}"
+
+                # PnL en moneda quote (aprox): (close - entry) * size (sign por side)
+                sign = 1 if p.side == "LONG" else -1
+                p.pnl = (p.close_price - p.entry) * sign * p.size
+
+                logger.info("EX {} CLOSED {} | close={:.2f} pnl={:.2f}",
+                           p.side, reason, p.close_price, p.pnl)
 
-                except Exception as e:
-                    logger.error("EX close market error ({}): {}", reason, str(e)[:200])
+            except Exception as e:
+                logger.error("EX close market error ({}): {}", reason, str(e)[:200])
+                closed = False
+            else:
+                closed = True
+        if closed or had_bracket:
+            self._notify(p)  # sin cierre, igual publica que el bracket fue retirado
+        return closed
 
     def total_realized_pnl(self) -> float:
-        """Retorna PnL realizado total de posiciones cerradas"""
-        return sum(p.pnl for p in self.positions if p.status in ("CLOSED_TP", "CLOSED_SL"))
+        """Retorna PnL realizado total de posiciones cerradas (agregado incremental)"""
+        return self.book.realized_pnl
 
     def get_stats(self) -> dict:
         """Retorna estadísticas de posiciones"""
-        pending = sum(1 for p in self.positions if p.status == "PENDING_ENTRY")
-        open_pos = sum(1 for p in self.positions if p.status == "OPEN")
-        closed_tp = sum(1 for p in self.positions if p.status == "CLOSED_TP")
-        closed_sl = sum(1 for p in self.positions if p.status == "CLOSED_SL")
-        total_pnl = self.total_realized_pnl()
-
+        counts = self.book.counts
         return {
-            "pending_entry": pending,
-            "open": open_pos,
-            "closed_tp": closed_tp,
-            "closed_sl": closed_sl,
-            "total_realized_pnl": total_pnl,
+            "pending_entry": counts["PENDING_ENTRY"],
+            "open": counts["OPEN"],
+            "closed_tp": counts["CLOSED_TP"],
+            "closed_sl": counts["CLOSED_SL"],
+            "total_realized_pnl": self.book.realized_pnl,
         }
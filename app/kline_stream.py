@@ -0,0 +1,157 @@
+# app/kline_stream.py
+# Event-driven OHLCV source over Binance kline WebSocket streams.
+# - A background thread consumes <symbol>@kline_<tf> and records every bar
+#   the moment the exchange marks it closed (k.x == true).
+# - wait_for_close() lets the main loop start analysis right at candle close
+#   instead of discovering it up to LOOP_SECONDS later.
+# - candles(limit) returns rows in ccxt format, the last one being the forming
+#   candle, so callers can keep using df.iloc[:-1] exactly as with fetch_ohlcv.
+# - The history is seeded from REST (seed()); if the stream drops, goes stale or
+#   skips a bar, candles() returns None and the caller falls back to REST polling.
+#
+# Requires the optional `websocket-client` package.
+
+import json
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+import ccxt
+from loguru import logger
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - dependencia opcional
+    websocket = None
+
+WS_URLS = {
+    ("binance", False): "wss://stream.binance.com:9443/ws",
+    ("binance", True): "wss://testnet.binance.vision/ws",
+    ("binanceusdm", False): "wss://fstream.binance.com/ws",
+    ("binanceusdm", True): "wss://stream.binancefuture.com/ws",
+}
+
+
+class KlineStream:
+    """Stream de velas por WebSocket con historial sembrado desde REST"""
+
+    def __init__(self, exchange: str, symbol: str, timeframe: str, sandbox: bool = False,
+                 url: Optional[str] = None, store=None, maxlen: int = 1000, stale_after: float = 30.0):
+        if websocket is None:
+            raise RuntimeError("KlineStream requiere el paquete 'websocket-client'")
+        self.exchange = exchange
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.tf_ms = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        base = url or WS_URLS.get((exchange.lower(), sandbox))
+        if base is None:
+            raise ValueError(f"KlineStream: exchange no soportado: {exchange}")
+        self.url = base if url else f"{base}/{symbol.replace('/', '').lower()}@kline_{timeframe}"
+        self.store = store                 # CandleStore opcional: persiste cada vela cerrada
+        self.stale_after = stale_after     # Binance envía updates cada ~2s; sin mensajes = stream caído
+
+        self._bars: deque = deque(maxlen=maxlen)   # velas CERRADAS [ts,o,h,l,c,v]
+        self._forming: Optional[list] = None
+        self._seeded = False
+        self._lock = threading.Lock()
+        self._closed = threading.Condition(self._lock)
+        self._closed_seq = 0
+        self._served_seq = 0               # _closed_seq en el último candles()
+        self._last_msg_at = 0.0
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="kline-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._ws is not None:
+            self._ws.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._ws = websocket.WebSocketApp(self.url, on_message=self._on_message)
+            try:
+                self._ws.run_forever(ping_interval=20, ping_timeout=10)
+            except Exception as e:
+                logger.warning("KlineStream error: {}", str(e)[:160])
+            if not self._stop.is_set():
+                logger.warning("KlineStream desconectado, reintentando en 5s")
+                self._stop.wait(5)
+
+    # ---------- Messages ----------
+    def _on_message(self, _ws, message: str):
+        try:
+            data = json.loads(message)
+            k = data.get("k") or data.get("data", {}).get("k")
+            if not k:
+                return
+            row = [int(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"])]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("KlineStream mensaje inválido: {}", str(e)[:120])
+            return
+
+        with self._lock:
+            self._last_msg_at = time.monotonic()
+            if not k.get("x"):
+                self._forming = row
+                return
+            if self._bars and row[0] <= self._bars[-1][0]:
+                return  # duplicado
+            if self._bars and row[0] != self._bars[-1][0] + self.tf_ms:
+                logger.warning("KlineStream: salto de velas, se re-sembrará desde REST")
+                self._seeded = False
+            self._bars.append(row)
+            self._forming = None
+            self._closed_seq += 1
+            self._closed.notify_all()
+
+        if self.store is not None:
+            self.store.upsert(self.exchange, self.symbol, self.timeframe, [row])
+
+    # ---------- Public API ----------
+    def healthy(self) -> bool:
+        """True si el stream recibió mensajes recientemente"""
+        return time.monotonic() - self._last_msg_at < self.stale_after
+
+    def seed(self, rows: List[List]):
+        """Siembra el historial con velas REST (la última se asume en formación)"""
+        with self._lock:
+            closed = [list(r) for r in rows[:-1]]
+            if self._bars and closed and self._bars[-1][0] > closed[-1][0]:
+                # el stream ya cerró velas más nuevas que el snapshot REST
+                newer = [b for b in self._bars if b[0] > closed[-1][0]]
+                closed.extend(newer)
+            self._bars.clear()
+            self._bars.extend(closed)
+            self._seeded = True
+
+    def candles(self, limit: int = 300) -> Optional[List[List]]:
+        """
+        Últimas `limit` velas (cerradas + la vela en formación al final),
+        o None si el stream no está sano o no sembrado (usar REST).
+        """
+        with self._lock:
+            if not self._seeded or not self._bars or not self.healthy():
+                return None
+            self._served_seq = self._closed_seq
+            rows = list(self._bars)[-(limit - 1):]
+            last_ts = rows[-1][0]
+            forming = self._forming
+            if forming is None or forming[0] != last_ts + self.tf_ms:
+                c = rows[-1][4]
+                forming = [last_ts + self.tf_ms, c, c, c, c, 0.0]
+            return rows + [list(forming)]
+
+    def wait_for_close(self, timeout: float) -> bool:
+        """
+        Bloquea hasta que haya una vela cerrada aún no servida por candles() (True)
+        o venza el timeout (False). Retorna de inmediato si cerró mientras se procesaba.
+        """
+        with self._lock:
+            return self._closed.wait_for(lambda: self._closed_seq != self._served_seq, timeout=timeout)
@@ -0,0 +1,94 @@
+# app/llm_cache.py
+# Content-addressed cache of validated StructureReport JSON (SQLite).
+# - Key: sha256 of (model, temperature, options, prompt, request) -> identical
+#   payloads (restarts, retries after a loop error, backtest replays) skip the
+#   LLM. `request` holds the other settings that change the answer or how it is
+#   decoded (API, output format, prompt codec).
+# - Entries expire after `ttl` seconds; beyond `max_entries` the least recently
+#   used ones are evicted.
+# - hits/misses counters are kept in memory, logged on every lookup and
+#   exported as metrics (llm_cache_total{result}).
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from loguru import logger
+from metrics import metrics
+
+
+def cache_key(model: str, temperature: float, options: dict, prompt: str,
+              request: Optional[dict] = None) -> str:
+    """Hash estable del request al LLM (request: API, format, codec...)"""
+    blob = json.dumps(
+        {"model": model, "temperature": temperature, "options": options, "prompt": prompt,
+         "request": request or {}},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Caché persistente de reportes del LLM con TTL y desalojo LRU"""
+
+    def __init__(self, path: str, max_entries: int = 5000, ttl: float = 7 * 24 * 3600):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS reports (
+                   key TEXT PRIMARY KEY,
+                   report TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   accessed_at REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS reports_accessed ON reports(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """JSON del reporte cacheado, o None si no existe o expiró"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT report, created_at FROM reports WHERE key=?", (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._conn.execute("UPDATE reports SET accessed_at=? WHERE key=?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                report = row[0]
+            else:
+                if row:
+                    self._conn.execute("DELETE FROM reports WHERE key=?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                report = None
+        metrics.inc("llm_cache_total", result="hit" if report else "miss")
+        logger.info("LLM cache {} | hits={} misses={}", "HIT" if report else "MISS", self.hits, self.misses)
+        return report
+
+    def put(self, key: str, report_json: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports VALUES (?,?,?,?)", (key, report_json, now, now)
+            )
+            self._conn.execute("DELETE FROM reports WHERE created_at < ?", (now - self.ttl,))
+            n = self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+            if n > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM reports WHERE key IN "
+                    "(SELECT key FROM reports ORDER BY accessed_at ASC LIMIT ?)",
+                    (n - self.max_entries,),
+                )
+            self._conn.commit()
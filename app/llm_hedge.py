@@ -0,0 +1,169 @@
+# app/llm_hedge.py
+# Hedged and voted LLM requests across several Ollama backends / models.
+# - LLM_BACKENDS lists "url|model" pairs in preference order, e.g.
+#     http://ollama:11434|llama3.2:1b-instruct-q4_0,http://ollama-2:11434|llama3.2:3b-instruct-q4_0
+# - race(): the request goes to the first backend; if no valid result arrives
+#   within the hedge delay (a quantile, p90 by default, of that backend's recent
+#   latencies) the next backend is started as well, and so on. A backend that
+#   fails or returns an invalid result starts the next one immediately. The first
+#   valid result wins and the others are cancelled: attempts see the cancel event
+#   and close their connection (Ollama stops generating). structure_oracle always
+#   streams race/vote attempts for this reason. The race fails only once every
+#   backend has been started and has failed.
+# - vote(): self-consistency. N samples in parallel (round-robin over backends,
+#   one seed per sample); results are grouped by a caller-supplied key and the
+#   largest group wins. Stops as soon as a group holds a strict majority of N.
+#
+# Attempts are plain callables fn(backend, cancel, seed) -> result that raise on
+# failure, so the logic can be exercised against stub HTTP servers.
+
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from loguru import logger
+from metrics import metrics
+
+T = TypeVar("T")
+Attempt = Callable[["Backend", threading.Event, Optional[int]], T]
+
+
+class Cancelled(Exception):
+    """El intento perdió la carrera (otro backend ya respondió)"""
+
+
+@dataclass(frozen=True)
+class Backend:
+    url: str
+    model: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.url}"
+
+
+def parse_backends(spec: str, url: str, model: str) -> List[Backend]:
+    """"url|model,url|model" -> [Backend]; url o model vacíos toman LLM_URL / LLM_MODEL"""
+    out = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if item:
+            u, _, m = item.partition("|")
+            out.append(Backend((u.strip() or url).rstrip("/"), m.strip() or model))
+    return out or [Backend(url.rstrip("/"), model)]
+
+
+class LatencyWindow:
+    """Latencias recientes (respuestas válidas) por backend; el delay de hedge es su cuantil q"""
+
+    def __init__(self, default: float, q: float = 0.9, maxlen: int = 50, min_samples: int = 5):
+        self.default = default
+        self.q = q
+        self.min_samples = min_samples
+        self._samples: Dict[Backend, deque] = defaultdict(lambda: deque(maxlen=maxlen))
+        self._lock = threading.Lock()
+
+    def add(self, backend: Backend, seconds: float):
+        with self._lock:
+            self._samples[backend].append(seconds)
+
+    def delay(self, backend: Backend) -> float:
+        with self._lock:
+            s = sorted(self._samples[backend])
+        if len(s) < self.min_samples:
+            return self.default
+        return s[min(len(s) - 1, int(self.q * len(s)))]
+
+
+def _launch(fn: Attempt, backend: Backend, cancel: threading.Event, seed: Optional[int],
+            results: queue.Queue, latency: Optional[LatencyWindow]):
+    def run():
+        t0 = time.perf_counter()
+        try:
+            out = fn(backend, cancel, seed)
+        except Exception as e:
+            results.put((backend, None, e))
+            return
+        if cancel.is_set():
+            return  # perdedor: no cuenta para la latencia del backend
+        if latency is not None:
+            latency.add(backend, time.perf_counter() - t0)
+        results.put((backend, out, None))
+
+    threading.Thread(target=run, name=f"llm-{backend.model}", daemon=True).start()
+
+
+def race(fn: Attempt, backends: List[Backend], latency: LatencyWindow) -> T:
+    """Primer resultado válido entre backends escalonados por el delay de hedge"""
+    results: queue.Queue = queue.Queue()
+    cancel = threading.Event()
+    launched = failed = 0
+    last_error: Optional[Exception] = None
+    next_at = 0.0
+
+    def start():
+        nonlocal launched, next_at
+        b = backends[launched]
+        launched += 1
+        next_at = time.monotonic() + latency.delay(b)
+        _launch(fn, b, cancel, None, results, latency)
+
+    start()
+    while True:
+        timeout = max(0.0, next_at - time.monotonic()) if launched < len(backends) else None
+        try:
+            backend, out, err = results.get(timeout=timeout)
+        except queue.Empty:
+            metrics.inc("llm_hedge_total", event="hedged")
+            logger.info("LLM hedge: sin respuesta de {} tras {:.1f}s, se lanza {}",
+                        backends[launched - 1].name, latency.delay(backends[launched - 1]),
+                        backends[launched].name)
+            start()
+            continue
+        if err is None:
+            cancel.set()
+            metrics.inc("llm_race_wins_total", backend=backend.model)
+            return out
+        failed += 1
+        last_error = err
+        reason = str(err).splitlines()[0][:120] if str(err) else type(err).__name__
+        logger.warning("LLM {} falló: {}", backend.name, reason)
+        if failed == len(backends):
+            raise last_error
+        if launched < len(backends):
+            metrics.inc("llm_hedge_total", event="failover")
+            start()
+
+
+def vote(fn: Attempt, backends: List[Backend], n: int,
+         key: Callable[[T], Hashable]) -> Tuple[List[T], int]:
+    """
+    n muestras en paralelo agrupadas por key(resultado).
+    Retorna (grupo ganador, cantidad de resultados válidos); error si ninguno fue válido.
+    """
+    results: queue.Queue = queue.Queue()
+    cancel = threading.Event()
+    for i in range(n):
+        _launch(fn, backends[i % len(backends)], cancel, i, results, None)
+
+    groups: Dict[Hashable, List[T]] = defaultdict(list)
+    valid = 0
+    last_error: Optional[Exception] = None
+    for _ in range(n):
+        _, out, err = results.get()
+        if err is not None:
+            last_error = err
+            continue
+        valid += 1
+        group = groups[key(out)]
+        group.append(out)
+        if 2 * len(group) > n:
+            cancel.set()
+            metrics.inc("llm_vote_total", result="majority")
+            return group, valid
+    if not groups:
+        raise last_error
+    metrics.inc("llm_vote_total", result="plurality")
+    return max(groups.values(), key=len), valid
@@ -1,12 +1,22 @@
 import os
 import time
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import ccxt
+import pandas as pd
 from loguru import logger
 from dotenv import load_dotenv
-from structure_oracle import detect_structure_with_llm
-from utils import fractal_pivot_candidates, telegram
+from structure_oracle import detect_structure, start_heartbeat
+from utils import IncrementalPivotTracker, llm_payload, ohlcv_frame, telegram
 from execution import ExchangeEngine
+from position_book import PositionBook
+from strategy import handle_report
+from candle_store import CandleStore
+from exchange_pool import pool as client_pool
+from kline_stream import KlineStream
+from price_watcher import PriceWatcher
+from state_journal import StateJournal
+from trade_tracker import TradeTracker
+from metrics import metrics
 
 load_dotenv()
 TZ = os.getenv("TZ", "America/Santiago")
@@ -19,33 +29,86 @@ PAPER = os.getenv("PAPER", "true").lower() == "true"
 MIN_CONFIDENCE = float(os.getenv("MIN_CONFIDENCE", "0.60"))
 DEFAULT_SIZE = float(os.getenv("DEFAULT_SIZE", "0.001"))  # ej: 0.001 BTC
 MAX_OPEN_POS = int(os.getenv("MAX_OPEN_POS", "1"))
+CANDLE_DB = os.getenv("CANDLE_DB", "./data/candles.db")  # vacío = sin caché local
+DATA_SOURCE = os.getenv("DATA_SOURCE", "rest").lower()   # "rest" (polling) o "ws" (kline stream)
+STRUCTURE_DEADLINE = float(os.getenv("STRUCTURE_DEADLINE", "45"))  # seg. de espera por el reporte en cada vela
+STATE_JOURNAL = os.getenv("STATE_JOURNAL", "./data/state.jsonl")  # vacío = estado solo en memoria
+POSITION_ARCHIVE = os.getenv("POSITION_ARCHIVE", "./data/closed_positions.csv")  # vacío = sin archivo de cerradas
+EXIT_MODE = os.getenv("EXIT_MODE", "market").lower()   # "market" (cierre por vela) o "bracket" (SL/TP en el exchange)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # GET /metrics (0 = deshabilitado)
+PRICE_WATCH = os.getenv("PRICE_WATCH", "false").lower() == "true"   # TP/SL intravela por websocket
+PRICE_WATCH_CHANNEL = os.getenv("PRICE_WATCH_CHANNEL", "aggTrade")   # "aggTrade" o "bookTicker"
 
 os.makedirs("./logs", exist_ok=True)
 logger.add("./logs/run.log", rotation="10 MB", retention=5)
 
-def ex():
-    klass = getattr(ccxt, EXCHANGE)
-    client = klass({
-        "enableRateLimit": True,
-        "apiKey": os.getenv("BINANCE_API_KEY", ""),
-        "secret": os.getenv("BINANCE_API_SECRET", ""),
-    })
-    # Testnet opcional
-    if EXCHANGE.lower() in ("binance", "binanceusdm") and os.getenv("BINANCE_TESTNET", "false").lower() == "true":
-        client.set_sandbox_mode(True)
-    return client
+candle_store = CandleStore(CANDLE_DB) if CANDLE_DB else None
+state_journal = StateJournal(STATE_JOURNAL) if STATE_JOURNAL else None
+trade_tracker = TradeTracker()
+
+# Testnet opcional
+SANDBOX = (EXCHANGE.lower() in ("binance", "binanceusdm")
+           and os.getenv("BINANCE_TESTNET", "false").lower() == "true")
+
+kline_stream = None
+if DATA_SOURCE == "ws":
+    try:
+        kline_stream = KlineStream(EXCHANGE, SYMBOL, TIMEFRAME, sandbox=SANDBOX, store=candle_store).start()
+    except (RuntimeError, ValueError) as e:
+        logger.warning("DATA_SOURCE=ws no disponible ({}); usando polling REST", e)
+
+# El oráculo corre en su propio hilo: poll/TP/SL nunca esperan al LLM
+oracle_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="oracle")
+
+def ex(tag: str = ""):
+    """Cliente ccxt del pool (markets cacheados); tag="" es el del hilo principal (datos + ejecución)"""
+    return client_pool.get(
+        EXCHANGE,
+        sandbox=SANDBOX,
+        tag=tag,
+        api_key=os.getenv("BINANCE_API_KEY", ""),
+        secret=os.getenv("BINANCE_API_SECRET", ""),
+    )
 
 def fetch_ohlcv(limit=300):
-    client = ex()
-    data = client.fetch_ohlcv(SYMBOL, timeframe=TIMEFRAME, limit=limit)
-    df = pd.DataFrame(data, columns=["ts", "open", "high", "low", "close", "volume"])
-    df["ts"] = pd.to_datetime(df["ts"], unit="ms", utc=True).dt.tz_convert(TZ)
-    return df
+    with metrics.timer("fetch_ohlcv"):
+        return _fetch_ohlcv(limit)
+
+def _fetch_ohlcv(limit):
+    data = kline_stream.candles(limit) if kline_stream is not None else None
+    if data is None:
+        client = ex()
+        if candle_store is not None:
+            # Solo descarga velas nuevas; el resto sale del caché local
+            data = candle_store.sync(client, EXCHANGE, SYMBOL, TIMEFRAME, limit=limit)
+        else:
+            data = client.fetch_ohlcv(SYMBOL, timeframe=TIMEFRAME, limit=limit)
+        if kline_stream is not None:
+            kline_stream.seed(data)
+    # ts queda en epoch ms (int64); la zona horaria se aplica solo al mostrar
+    return ohlcv_frame(data)
+
+def local_ts(ts_ms: int) -> pd.Timestamp:
+    """Epoch ms -> Timestamp en TZ (logs, ts de posiciones)"""
+    return pd.Timestamp(ts_ms, unit="ms", tz="UTC").tz_convert(TZ)
+
+def wait_next():
+    """Espera al cierre de la próxima vela (stream) o LOOP_SECONDS (polling REST)"""
+    if kline_stream is not None and kline_stream.healthy():
+        kline_stream.wait_for_close(timeout=LOOP_SECONDS)
+    else:
+        time.sleep(LOOP_SECONDS)
 
 def main():
-    logger.info("florencia-ai iniciado | {} {} | PAPER={}", SYMBOL, TIMEFRAME, PAPER)
+    logger.info("florencia-ai iniciado | {} {} | PAPER={} | datos={}", SYMBOL, TIMEFRAME, PAPER,
+                "ws" if kline_stream is not None else "rest")
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    start_heartbeat()  # modelo cargado y prefijo en caché antes de la primera vela
+    tf_ms = ccxt.Exchange.parse_timeframe(TIMEFRAME) * 1000
     last_signal_ts = None
     last_closed_ts = None
+    pending = None  # (ts de la vela analizada, Future del reporte)
 
     client = ex()
     is_deriv = EXCHANGE.lower() in ("binanceusdm", "binancecoinm")
@@ -54,113 +117,118 @@ def main():
         symbol=SYMBOL,
         is_derivatives=is_deriv,
         max_open_positions=MAX_OPEN_POS,
-        min_confidence=MIN_CONFIDENCE
+        min_confidence=MIN_CONFIDENCE,
+        exit_mode=EXIT_MODE,
+        book=PositionBook(archive_path=POSITION_ARCHIVE or None)
     )
+    trade_tracker.attach(engine)
+    if state_journal is not None:
+        # Tras un reinicio: retoma órdenes/posiciones vivas y el throttle de señales
+        state_journal.attach(engine)
+        engine.recover(state_journal.positions(SYMBOL), pd.Timestamp.now(tz=TZ).isoformat())
+        last_signal_ts = state_journal.last_signal(f"{SYMBOL} {TIMEFRAME}")
+    if PRICE_WATCH and EXIT_MODE == "bracket":
+        logger.info("PRICE_WATCH ignorado: con EXIT_MODE=bracket el exchange ejecuta SL/TP")
+    elif PRICE_WATCH:
+        # TP/SL al tick; poll() sigue cerrando por vela si el stream se cae (cierre idempotente)
+        try:
+            PriceWatcher(engine, EXCHANGE, sandbox=SANDBOX, channel=PRICE_WATCH_CHANNEL,
+                         client=ex("price-watcher")).start()
+        except (RuntimeError, ValueError) as e:
+            logger.warning("PRICE_WATCH no disponible ({}); TP/SL solo por vela", e)
+    # Pivots incrementales: O(K) por vela nueva en vez de re-escanear las ~299 velas.
+    # maxlen=64 cubre de sobra la ventana de 30 velas (máx 2 pivots por vela).
+    pivot_tracker = IncrementalPivotTracker(K=2, maxlen=64)
+    net_calls_mark = client_pool.calls
 
     while True:
         try:
             df = fetch_ohlcv(300)
             if len(df) < 60:
-                time.sleep(LOOP_SECONDS)
                 continue
 
             work_df = df.iloc[:-1]
             if work_df.empty:
-                time.sleep(LOOP_SECONDS)
                 continue
 
             curr_closed_ts = work_df["ts"].iloc[-1]
-            if last_closed_ts is not None and curr_closed_ts == last_closed_ts:
-                time.sleep(LOOP_SECONDS)
-                continue
-            last_closed_ts = curr_closed_ts
-
-            # ====== CONTEXTO COMPACTO: FORZAR DECISIONES RÁPIDAS ======
-            tail = work_df.tail(30)  # 30 velas = 2.5 horas (suficiente para detectar estructura)
-            first_ts = tail["ts"].iloc[0].isoformat()
-
-            all_pivots = fractal_pivot_candidates(work_df, K=2)
-            pivots = []
-            for p in all_pivots:
-                ts = p.get("ts")
-                if ts and ts >= first_ts:
-                    pivots.append({
-                        "type": p.get("type"),
-                        "ts": ts[:16],
-                        "price": round(float(p.get("price", 0.0)), 2)
-                    })
-            pivots = pivots[-14:]  # máx 14 pivots (suficiente para detectar tendencia)
-
-            def _r(x): return round(float(x), 2)
-            candles = [
-                [r.ts.isoformat(timespec="minutes"), _r(r.open), _r(r.high), _r(r.low), _r(r.close)]
-                for _, r in tail.iterrows()
-            ]
-            # ================================
-
-            report = detect_structure_with_llm(candles, pivots, K=2)
-
-            # Actualiza posiciones con la ÚLTIMA vela cerrada (usa poll, no mark_to_market)
-            last_row = tail.iloc[-1]
-            engine.poll({
-                "ts": last_row.ts.isoformat(),
-                "open": float(last_row.open),
-                "high": float(last_row.high),
-                "low": float(last_row.low),
-                "close": float(last_row.close)
-            })
-
-            if report.choch.detected and report.validity_checks.broke_on_close and report.choch.leg:
-                if report.confidence < MIN_CONFIDENCE:
-                    logger.info("Señal descartada por baja confianza: {:.2f} < {:.2f}",
-                                report.confidence, MIN_CONFIDENCE)
-                else:
-                    leg = report.choch.leg
-                    direction = report.choch.direction
-
-                    if direction == "BULLISH":
-                        entry = leg.low_price + 0.618 * (leg.high_price - leg.low_price)
-                        stop = leg.low_price
-                        tp = leg.high_price
-                        swing_ok = (report.post_choch_swing.exists and report.post_choch_swing.type == "HL")
-                        side = "LONG"
-                    elif direction == "BEARISH":
-                        entry = leg.high_price - 0.618 * (leg.high_price - leg.low_price)
-                        stop = leg.high_price
-                        tp = leg.low_price
-                        swing_ok = (report.post_choch_swing.exists and report.post_choch_swing.type == "LH")
-                        side = "SHORT"
+            new_candle = last_closed_ts is None or curr_closed_ts != last_closed_ts
+            if new_candle:
+                last_closed_ts = curr_closed_ts
+
+                # Contexto compacto: últimas 30 velas + pivots dentro de esa ventana
+                with metrics.timer("pivots"):
+                    pivot_tracker.sync(work_df)
+                with metrics.timer("payload"):
+                    candles, pivots = llm_payload(work_df, pivot_tracker, tail=30, max_pivots=14, tz=TZ)
+
+                # Un reporte aún en curso de una vela anterior ya no sirve
+                if pending is not None and not pending[1].done():
+                    if pending[1].cancel():
+                        metrics.inc("structure_dropped_total", reason="superseded")
+                        logger.warning("Reporte de la vela {} sin terminar: se descarta", local_ts(pending[0]))
                     else:
-                        swing_ok = False
+                        # Ya está corriendo (cancel() no lo detiene): no se encola otro detrás,
+                        # llegaría tarde. Esta vela queda sin análisis.
+                        metrics.inc("structure_dropped_total", reason="busy")
+                        logger.warning("Oráculo ocupado con la vela {}: la vela {} queda sin análisis",
+                                       local_ts(pending[0]), local_ts(curr_closed_ts))
+                if pending is None or pending[1].done():
+                    pending = (curr_closed_ts, oracle_pool.submit(detect_structure, candles, pivots, 2))
+                    metrics.inc("structure_jobs_total")
+
+                # Actualiza posiciones con la ÚLTIMA vela cerrada sin esperar al LLM
+                last_row = work_df.iloc[-1]
+                with metrics.timer("poll"):
+                    engine.poll({
+                        "ts": local_ts(last_row.ts).isoformat(),
+                        "open": float(last_row.open),
+                        "high": float(last_row.high),
+                        "low": float(last_row.low),
+                        "close": float(last_row.close)
+                    })
+                if trade_tracker.should_log_stats():
+                    trade_tracker.log_session_stats(*trade_tracker.get_price_info(work_df)[:2])
+                logger.info("PnL realizado (exchange-managed aprox): {:.2f}", engine.total_realized_pnl())
+                logger.info("Requests al exchange desde la vela anterior: {}", client_pool.calls - net_calls_mark)
+                net_calls_mark = client_pool.calls
 
-                    if not swing_ok:
-                        logger.info("ChoCH {} detectado, post-ChoCH swing NO confirmado.", direction)
-                    else:
-                        if last_signal_ts == report.choch.break_close_ts:
-                            logger.info("Throttle: ya actuamos para esta señal ({})", last_signal_ts)
-                        else:
-                            if engine.can_open():
-                                last_signal_ts = report.choch.break_close_ts
-                                pos = engine.open(side, entry, stop, tp, DEFAULT_SIZE, last_signal_ts)
-                                msg = (
-                                    f"🚀 florencia-ai {side} | {SYMBOL} {TIMEFRAME}\n"
-                                    f"ENTRY:{entry:.2f}  SL:{stop:.2f}  TP:{tp:.2f}\n"
-                                    f"size:{DEFAULT_SIZE}  conf:{report.confidence:.2f}"
-                                )
-                                telegram(msg)
-                            else:
-                                logger.info("Cap de posiciones alcanzado ({}). No se abre nueva.",
-                                            MAX_OPEN_POS)
-            else:
-                logger.info("Sin ChoCH válido | trend={} | conf={:.2f}",
-                            report.trend, report.confidence)
-
-            logger.info("PnL realizado (exchange-managed aprox): {:.2f}", engine.total_realized_pnl())
+            if pending is None:
+                continue
+
+            # Espera el reporte hasta el deadline solo en la vela en que se pidió;
+            # en iteraciones posteriores solo se revisa si ya terminó.
+            report_ts, future = pending
+            if report_ts != last_closed_ts and not future.done():
+                continue  # análisis de una vela anterior aún corriendo: no se espera por él
+            try:
+                report = future.result(timeout=STRUCTURE_DEADLINE if new_candle else 0)
+            except FutureTimeout:
+                if new_candle:
+                    metrics.inc("structure_deadline_missed_total")
+                    logger.warning("Reporte de estructura excede deadline ({}s); se revisa en la próxima iteración",
+                                   STRUCTURE_DEADLINE)
+                continue
+            finally:
+                if future.done():
+                    pending = None
+
+            if report_ts != last_closed_ts:
+                metrics.inc("structure_dropped_total", reason="stale")
+                logger.info("Reporte tardío de la vela {} descartado (ya cerró {})",
+                            local_ts(report_ts), local_ts(last_closed_ts))
+                continue
+
+            metrics.observe("stage_seconds", time.time() - (report_ts + tf_ms) / 1000.0,
+                            stage="close_to_detection")
+            last_signal_ts = handle_report(report, engine, last_signal_ts, f"{SYMBOL} {TIMEFRAME}",
+                                           MIN_CONFIDENCE, DEFAULT_SIZE, journal=state_journal,
+                                           tracker=trade_tracker, notify=telegram)
 
         except Exception as e:
             logger.exception(f"Loop error: {e}")
         finally:
-            time.sleep(LOOP_SECONDS)
+            wait_next()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,220 @@
+# app/metrics.py
+# In-process metrics with a Prometheus text endpoint (stdlib only, no client library).
+# - Histograms: per-stage latency of the hot path, labelled by stage, e.g.
+#     fetch_ohlcv, pivots, payload, prompt_build, llm_request, json_validation,
+#     poll, close_to_detection (candle close -> usable report)
+#   plus Ollama's own timings (prompt_eval / eval / load / total), prompt tokens
+#   actually evaluated (drops once the static prefix is cached) and every
+#   exchange HTTP round-trip by method (POST/DELETE are order round-trips).
+# - Counters: LLM requests, parse outcomes (ok / repaired / failed), fallbacks,
+#   cache hits/misses, structure jobs submitted / deadline misses / dropped.
+# - Derived ratios (fallback, parse failure, repair, cache hit, deadline miss)
+#   are rendered as gauges so the loop's deadline budget can be read at a
+#   glance from /metrics.
+#
+#   with metrics.timer("fetch_ohlcv"): ...
+#   metrics.observe("stage_seconds", 0.12, stage="poll")
+#   metrics.inc("llm_fallback_total")
+#   metrics.serve(9108)   -> http://host:9108/metrics
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+PREFIX = "florencia_"
+# Segundos: de una request al exchange (~50 ms) al deadline del LLM (45 s)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45, 90)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Histograma acumulativo estilo Prometheus, con series por labels"""
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}   # labels -> [counts por bucket, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {PREFIX}{self.name} {self.help}", f"# TYPE {PREFIX}{self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, total, n in series:
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                le_label = 'le="%g"' % le
+                out.append(f"{PREFIX}{self.name}_bucket{_labels(key, le_label)} {acc}")
+            inf_label = 'le="+Inf"'
+            out.append(f"{PREFIX}{self.name}_bucket{_labels(key, inf_label)} {n}")
+            out.append(f"{PREFIX}{self.name}_sum{_labels(key)} {total:.6f}")
+            out.append(f"{PREFIX}{self.name}_count{_labels(key)} {n}")
+        return out
+
+
+class Counter:
+    """Contador monótono con series por labels"""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels) -> float:
+        """Valor de una serie; sin labels, la suma de todas"""
+        with self._lock:
+            if labels:
+                return self._values.get(tuple(sorted(labels.items())), 0)
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {PREFIX}{self.name} {self.help}", f"# TYPE {PREFIX}{self.name} counter"]
+        with self._lock:
+            out += [f"{PREFIX}{self.name}{_labels(k)} {v:g}" for k, v in self._values.items()]
+        return out
+
+
+class Registry:
+    """Métricas del proceso; histogramas y contadores se crean al primer uso"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help: str = "", buckets=LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = Histogram(name, help or name, buckets)
+        return m
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = Counter(name, help or name)
+        return m
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]):
+        """Gauge calculado al momento del scrape"""
+        self._gauges[name] = (help, fn)
+
+    # ---------- Atajos para el hot path ----------
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name).observe(value, **labels)
+
+    def inc(self, name: str, n: float = 1, **labels):
+        self.counter(name).inc(n, **labels)
+
+    @contextmanager
+    def timer(self, stage: str, name: str = "stage_seconds"):
+        """Mide el bloque en el histograma `name` con label stage"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name).observe(time.perf_counter() - t0, stage=stage)
+
+    # ---------- Exposición ----------
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines += m.render()
+        for name, (help, fn) in list(self._gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines += [f"# HELP {PREFIX}{name} {help}", f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+        """Expone GET /metrics en un hilo daemon"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.warning("metrics: no se pudo abrir {}:{} ({})", host, port, e)
+            return None
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logger.info("metrics en http://{}:{}/metrics", host, port)
+        return server
+
+
+def _ratio(num: Callable[[], float], den: Callable[[], float]) -> Callable[[], float]:
+    return lambda: (num() / den()) if den() else 0.0
+
+
+metrics = Registry()
+
+metrics.histogram("stage_seconds", "Latencia por etapa del loop (s)")
+metrics.histogram("ollama_seconds", "Tiempos reportados por Ollama (s): prompt_eval, eval, load, total")
+metrics.histogram("exchange_request_seconds", "Round-trip HTTP al exchange por método (s)")
+metrics.histogram("ollama_prompt_tokens", "Tokens de prompt evaluados por request (sin el prefijo cacheado)",
+                  buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+_llm = metrics.counter("llm_requests_total", "Requests al LLM (sin contar hits de caché)")
+_timeouts = metrics.counter("llm_timeouts_total", "Requests al LLM cortados por timeout (conexión o lectura)")
+_fallback = metrics.counter("llm_fallback_total", "Respuestas del LLM inválidas que usaron el fallback Python")
+_parse = metrics.counter("llm_parse_total", "Respuestas del LLM por resultado del parseo (ok/repaired/failed)")
+_cache = metrics.counter("llm_cache_total", "Consultas a la caché del LLM por resultado (hit/miss)")
+_submitted = metrics.counter("structure_jobs_total", "Análisis de estructura encolados (uno por vela cerrada)")
+_missed = metrics.counter("structure_deadline_missed_total", "Análisis que no llegaron dentro del deadline")
+metrics.counter("structure_dropped_total", "Análisis descartados (cancelados, tardíos o vencidos en cola)")
+metrics.counter("hybrid_verdict_total", "ChoCH del motor de reglas confirmados / vetados por el LLM (STRUCTURE_ENGINE=hybrid)")
+metrics.counter("hybrid_llm_unavailable_total", "ChoCH del motor de reglas sin respuesta del LLM, por política (HYBRID_ON_LLM_FAILURE)")
+
+metrics.gauge("llm_fallback_ratio", "llm_fallback_total / llm_requests_total", _ratio(_fallback.value, _llm.value))
+metrics.gauge("llm_parse_failure_ratio", "respuestas irrecuperables / respuestas parseadas",
+              _ratio(lambda: _parse.value(result="failed"), _parse.value))
+metrics.gauge("llm_repair_ratio", "respuestas rescatadas por el parser tolerante / respuestas parseadas",
+              _ratio(lambda: _parse.value(result="repaired"), _parse.value))
+metrics.gauge("llm_cache_hit_ratio", "hits / (hits + misses) de la caché del LLM",
+              _ratio(lambda: _cache.value(result="hit"), _cache.value))
+metrics.gauge("structure_deadline_miss_ratio", "structure_deadline_missed_total / structure_jobs_total",
+              _ratio(_missed.value, _submitted.value))
@@ -0,0 +1,120 @@
+# app/notifier.py
+# Non-blocking Telegram notifications.
+# - send() only appends to a bounded deque and signals a worker thread
+#   (a few microseconds on the trading loop, never a network call).
+# - The worker coalesces everything queued within `coalesce` seconds into one
+#   message (split at Telegram's 4096-char limit), keeps at least `min_interval`
+#   seconds between posts, honours 429 retry_after, and reuses one keep-alive
+#   requests.Session.
+# - If the API is down and the queue fills, the oldest messages are dropped
+#   (counted in `dropped` and in metrics); failures are logged, not swallowed.
+#
+# utils.telegram() delegates here.
+
+import threading
+import time
+from collections import deque
+from typing import Optional
+import requests
+from loguru import logger
+from metrics import metrics
+
+TELEGRAM_MAX_CHARS = 4096
+
+
+class Notifier:
+    """Cola de notificaciones con un hilo de envío, coalescencia y rate limit"""
+
+    def __init__(self, bot: str, chat: str, max_queue: int = 200, coalesce: float = 0.5,
+                 min_interval: float = 1.0, timeout: float = 10.0,
+                 base_url: str = "https://api.telegram.org"):
+        self.url = f"{base_url}/bot{bot}/sendMessage"
+        self.chat = chat
+        self.coalesce = coalesce
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.sent = 0
+        self.dropped = 0
+        self._queue: deque = deque(maxlen=max_queue)
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._last_post = 0.0
+        threading.Thread(target=self._worker, name="notifier", daemon=True).start()
+
+    def send(self, text: str):
+        """Encola un mensaje (no bloquea)"""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+            metrics.inc("notifications_total", result="dropped")
+        self._queue.append(text)
+        self._idle.clear()
+        self._wake.set()
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Espera a que la cola se vacíe (tests / apagado)"""
+        return self._idle.wait(timeout)
+
+    # ---------- Worker ----------
+    def _worker(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.coalesce)  # junta la ráfaga en curso
+            batch = []
+            while self._queue:
+                batch.append(self._queue.popleft())
+            for chunk in self._chunks(batch):
+                self._post(chunk)
+            if not self._queue:
+                self._idle.set()
+
+    @staticmethod
+    def _chunks(batch):
+        """Une mensajes con línea en blanco respetando el límite de Telegram"""
+        current = ""
+        for text in batch:
+            text = text[:TELEGRAM_MAX_CHARS]
+            if current and len(current) + 2 + len(text) > TELEGRAM_MAX_CHARS:
+                yield current
+                current = text
+            else:
+                current = f"{current}\n\n{text}" if current else text
+        if current:
+            yield current
+
+    def _post(self, text: str, attempts: int = 3):
+        for _ in range(attempts):
+            wait = self._last_post + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_post = time.monotonic()
+            try:
+                r = self.session.post(self.url, json={"chat_id": self.chat, "text": text}, timeout=self.timeout)
+                if r.status_code == 429:
+                    retry = float((r.json().get("parameters") or {}).get("retry_after", 1))
+                    logger.warning("Telegram rate limit: reintento en {}s", retry)
+                    time.sleep(retry)
+                    continue
+                r.raise_for_status()
+                self.sent += 1
+                metrics.inc("notifications_total", result="sent")
+                return
+            except Exception as e:
+                logger.warning("Telegram error: {}", str(e)[:160])
+        metrics.inc("notifications_total", result="failed")
+
+
+_notifier: Optional[Notifier] = None
+_lock = threading.Lock()
+
+
+def get_notifier(bot: str, chat: str) -> Notifier:
+    """Notifier compartido del proceso (el hilo arranca en el primer uso)"""
+    global _notifier
+    if _notifier is None:
+        with _lock:
+            if _notifier is None:
+                _notifier = Notifier(bot, chat)
+    return _notifier
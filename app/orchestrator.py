@@ -0,0 +1,272 @@
+# app/orchestrator.py
+# Multi-symbol / multi-timeframe runner: one process, N streams.
+#   STREAMS="BTC/USDT:5m,ETH/USDT:5m,SOL/USDT:15m"   (default: SYMBOL:TIMEFRAME)
+#
+# - One CandleStore shared by every stream. Candle deltas are fetched with one
+#   request per stream (the exchange has no multi-symbol kline endpoint), run
+#   concurrently on a small I/O thread pool; ccxt clients are not thread-safe,
+#   so each fetch thread uses its own pooled client. Orders go through the main
+#   thread's client. Clients are taken from the pool every loop, so the pool's
+#   markets TTL refresh applies.
+# - One ExchangeEngine, pivot tracker and signal throttle per stream.
+# - Structure analysis goes through a single StructureScheduler in front of the
+#   model: at most LLM_CONCURRENCY requests in flight, earliest deadline first
+#   (a bar's deadline is the close of the next bar), expired jobs are dropped.
+# - Position polling never waits behind the scheduler (same contract as main.py).
+#
+#     python -m orchestrator
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+import ccxt
+import pandas as pd
+from loguru import logger
+from dotenv import load_dotenv
+from candle_store import CandleStore
+from execution import ExchangeEngine
+from position_book import PositionBook
+from state_journal import StateJournal
+from metrics import metrics
+from exchange_pool import pool as client_pool
+from strategy import handle_report
+from structure_oracle import detect_structure, start_heartbeat
+from utils import IncrementalPivotTracker, llm_payload, ohlcv_frame, telegram
+
+load_dotenv()
+TZ = os.getenv("TZ", "America/Santiago")
+EXCHANGE = os.getenv("EXCHANGE", "binance")
+STREAMS = os.getenv("STREAMS", f"{os.getenv('SYMBOL', 'BTC/USDT')}:{os.getenv('TIMEFRAME', '5m')}")
+LOOP_SECONDS = int(os.getenv("LOOP_SECONDS", "60"))
+MIN_CONFIDENCE = float(os.getenv("MIN_CONFIDENCE", "0.60"))
+DEFAULT_SIZE = float(os.getenv("DEFAULT_SIZE", "0.001"))
+MAX_OPEN_POS = int(os.getenv("MAX_OPEN_POS", "1"))
+EXIT_MODE = os.getenv("EXIT_MODE", "market").lower()
+CANDLE_DB = os.getenv("CANDLE_DB", "./data/candles.db")
+STATE_JOURNAL = os.getenv("STATE_JOURNAL", "./data/state.jsonl")
+POSITION_ARCHIVE = os.getenv("POSITION_ARCHIVE", "./data/closed_positions.csv")  # un CSV por stream
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "1"))
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+SANDBOX = (EXCHANGE.lower() in ("binance", "binanceusdm")
+           and os.getenv("BINANCE_TESTNET", "false").lower() == "true")
+
+os.makedirs("./logs", exist_ok=True)
+logger.add("./logs/run.log", rotation="10 MB", retention=5)
+
+
+class StructureScheduler:
+    """Cola de prioridad (deadline más cercano primero) con concurrencia limitada frente al LLM"""
+
+    def __init__(self, fn: Callable, concurrency: int = 1):
+        self.fn = fn
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self.dropped = 0
+        for i in range(max(1, concurrency)):
+            threading.Thread(target=self._worker, name=f"structure-{i}", daemon=True).start()
+
+    def submit(self, deadline: float, *args) -> Future:
+        """Encola fn(*args); deadline en epoch segundos (time.time())"""
+        fut: Future = Future()
+        with self._cv:
+            heapq.heappush(self._heap, (deadline, next(self._seq), fut, args))
+            self._cv.notify()
+        return fut
+
+    def pending(self) -> int:
+        with self._cv:
+            return len(self._heap)
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                deadline, _, fut, args = heapq.heappop(self._heap)
+            if not fut.set_running_or_notify_cancel():
+                continue  # cancelado por una vela más nueva
+            if time.time() > deadline:
+                self.dropped += 1
+                metrics.inc("structure_dropped_total", reason="expired")
+                metrics.inc("structure_deadline_missed_total")
+                fut.set_exception(TimeoutError("deadline vencido antes de llegar al LLM"))
+                continue
+            try:
+                fut.set_result(self.fn(*args))
+            except Exception as e:
+                fut.set_exception(e)
+
+
+@dataclass
+class SymbolStream:
+    """Estado por símbolo/timeframe"""
+    symbol: str
+    timeframe: str
+    engine: ExchangeEngine
+    tf_ms: int
+    tracker: IncrementalPivotTracker = field(default_factory=lambda: IncrementalPivotTracker(K=2, maxlen=64))
+    last_closed_ts: Optional[int] = None        # epoch ms de la última vela cerrada
+    last_signal_ts: Optional[str] = None
+    pending: Optional[tuple] = None  # (ts vela, Future)
+    journal: Optional[StateJournal] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.symbol} {self.timeframe}"
+
+    def on_frame(self, df: pd.DataFrame, scheduler: StructureScheduler):
+        """Vela nueva: encola el análisis y actualiza posiciones sin esperar al LLM"""
+        if len(df) < 60:
+            return
+        work_df = df.iloc[:-1]
+        curr = work_df["ts"].iloc[-1]
+        if self.last_closed_ts is not None and curr == self.last_closed_ts:
+            return
+        self.last_closed_ts = curr
+
+        with metrics.timer("pivots"):
+            self.tracker.sync(work_df)
+        with metrics.timer("payload"):
+            candles, pivots = llm_payload(work_df, self.tracker, tail=30, max_pivots=14, tz=TZ)
+        if self.pending is not None and not self.pending[1].done():
+            self.pending[1].cancel()
+            metrics.inc("structure_dropped_total", reason="superseded")
+        deadline = (curr + 2 * self.tf_ms) / 1000.0  # cierre de la próxima vela
+        self.pending = (curr, scheduler.submit(deadline, candles, pivots, 2))
+        metrics.inc("structure_jobs_total")
+
+        last_row = work_df.iloc[-1]
+        with metrics.timer("poll"):
+            self.engine.poll({
+                "ts": pd.Timestamp(int(last_row.ts), unit="ms", tz="UTC").tz_convert(TZ).isoformat(),
+                "open": float(last_row.open),
+                "high": float(last_row.high),
+                "low": float(last_row.low),
+                "close": float(last_row.close)
+            })
+
+    def collect(self):
+        """Procesa el reporte si ya terminó (descarta los de velas anteriores)"""
+        if self.pending is None or not self.pending[1].done():
+            return
+        report_ts, fut = self.pending
+        self.pending = None
+        if fut.cancelled():
+            return
+        try:
+            report = fut.result()
+        except Exception as e:
+            logger.warning("[{}] reporte no disponible: {}", self.name, str(e)[:160])
+            return
+        if report_ts != self.last_closed_ts:
+            metrics.inc("structure_dropped_total", reason="stale")
+            logger.info("[{}] reporte tardío de la vela {} descartado", self.name, report_ts)
+            return
+        metrics.observe("stage_seconds", time.time() - (report_ts + self.tf_ms) / 1000.0, stage="close_to_detection")
+
+        self.last_signal_ts = handle_report(report, self.engine, self.last_signal_ts, self.name,
+                                            MIN_CONFIDENCE, DEFAULT_SIZE, journal=self.journal,
+                                            notify=telegram)
+
+
+def parse_streams(spec: str) -> List[tuple]:
+    out = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            symbol, _, tf = item.rpartition(":")
+            out.append((symbol, tf))
+    return out
+
+
+def archive_path(symbol: str, timeframe: str) -> Optional[str]:
+    """CSV de posiciones cerradas del stream (closed_positions.csv -> closed_positions_BTCUSDT_5m.csv)"""
+    if not POSITION_ARCHIVE:
+        return None
+    root, ext = os.path.splitext(POSITION_ARCHIVE)
+    return f"{root}_{symbol.replace('/', '').replace(':', '')}_{timeframe}{ext or '.csv'}"
+
+
+def ex(tag: str = ""):
+    """Cliente del pool; tag="" para el hilo principal (órdenes), el nombre del hilo para los fetch"""
+    return client_pool.get(EXCHANGE, sandbox=SANDBOX, tag=tag,
+                           api_key=os.getenv("BINANCE_API_KEY", ""),
+                           secret=os.getenv("BINANCE_API_SECRET", ""))
+
+
+def main():
+    client = ex()
+    store = CandleStore(CANDLE_DB) if CANDLE_DB else None
+    is_deriv = EXCHANGE.lower() in ("binanceusdm", "binancecoinm")
+    streams = [
+        SymbolStream(symbol=s, timeframe=tf, tf_ms=ccxt.Exchange.parse_timeframe(tf) * 1000,
+                     engine=ExchangeEngine(exchange=client, symbol=s, is_derivatives=is_deriv,
+                                           max_open_positions=MAX_OPEN_POS, min_confidence=MIN_CONFIDENCE,
+                                           exit_mode=EXIT_MODE,
+                                           book=PositionBook(archive_path=archive_path(s, tf))))
+        for s, tf in parse_streams(STREAMS)
+    ]
+    journal = StateJournal(STATE_JOURNAL) if STATE_JOURNAL else None
+    if journal is not None:
+        now = pd.Timestamp.now(tz=TZ).isoformat()
+        for st in streams:
+            st.journal = journal
+            journal.attach(st.engine, key=st.name)
+            st.engine.recover(journal.positions(st.name), now)
+            st.last_signal_ts = journal.last_signal(st.name)
+    scheduler = StructureScheduler(detect_structure, concurrency=LLM_CONCURRENCY)
+    fetchers = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="fetch")
+    logger.info("orchestrator iniciado | {} streams | LLM concurrencia={}", len(streams), LLM_CONCURRENCY)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    start_heartbeat()  # un solo prefijo estático para todos los streams
+
+    def fetch(st: SymbolStream) -> pd.DataFrame:
+        with metrics.timer("fetch_ohlcv"):
+            return _fetch(st)
+
+    def _fetch(st: SymbolStream) -> pd.DataFrame:
+        client = ex(threading.current_thread().name)
+        if store is not None:
+            data = store.sync(client, EXCHANGE, st.symbol, st.timeframe, limit=300)
+        else:
+            data = client.fetch_ohlcv(st.symbol, timeframe=st.timeframe, limit=300)
+        # ts en epoch ms; la zona horaria se aplica solo al formatear el payload / logs
+        return ohlcv_frame(data)
+
+    while True:
+        started = time.monotonic()
+        ex()  # refresca markets del cliente de órdenes si vencieron (TTL del pool)
+        futures = {st.name: fetchers.submit(fetch, st) for st in streams}
+        for st in streams:
+            try:
+                st.on_frame(futures[st.name].result(), scheduler)
+            except Exception as e:
+                logger.exception(f"[{st.name}] error: {e}")
+
+        # Hasta el próximo fetch: procesar reportes a medida que llegan
+        while True:
+            for st in streams:
+                try:
+                    st.collect()
+                except Exception as e:
+                    logger.exception(f"[{st.name}] error: {e}")
+            remaining = LOOP_SECONDS - (time.monotonic() - started)
+            waiting = [st.pending[1] for st in streams if st.pending is not None]
+            if remaining <= 0:
+                break
+            if waiting:
+                wait(waiting, timeout=remaining, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# app/position_book.py
+# Position storage for ExchangeEngine.
+# - Live positions (PENDING_ENTRY / OPEN) are indexed by status and by order id
+#   (entry, stop and take-profit orders), so can_open / poll / reconciliation
+#   only touch what is live.
+# - Counts per status and realized PnL are running aggregates updated on each
+#   transition: total_realized_pnl() and get_stats() are O(1).
+# - Closed positions leave the live indexes: they are appended to an optional
+#   CSV archive on disk and kept in memory only as compact slotted records
+#   (the last `keep_closed`; None keeps all, e.g. for backtest reports).
+
+import csv
+import os
+import threading
+from collections import Counter, deque
+from dataclasses import astuple, dataclass, fields
+from typing import Deque, Dict, Optional
+from loguru import logger
+
+LIVE_STATUSES = ("PENDING_ENTRY", "OPEN")
+
+
+@dataclass(slots=True)
+class ClosedPosition:
+    """Registro compacto de una posición cerrada"""
+    side: str
+    entry: float
+    stop: float
+    tp: float
+    size: float
+    opened_ts: str
+    closed_ts: Optional[str]
+    close_price: Optional[float]
+    status: str
+    pnl: float
+    entry_order_id: Optional[str]
+
+
+_CLOSED_FIELDS = [f.name for f in fields(ClosedPosition)]
+
+
+class PositionBook:
+    """Posiciones vivas indexadas por estado y por id de orden, con agregados incrementales"""
+
+    def __init__(self, archive_path: Optional[str] = None, keep_closed: Optional[int] = 1000):
+        self._by_status: Dict[str, Dict[int, object]] = {s: {} for s in LIVE_STATUSES}
+        self._by_order: Dict[str, object] = {}
+        self._status: Dict[int, str] = {}        # id(position) -> último estado visto
+        self.counts: Counter = Counter()
+        self.realized_pnl = 0.0
+        self.closed: Deque[ClosedPosition] = deque(maxlen=keep_closed)
+        self.archive_path = archive_path
+        self._lock = threading.RLock()
+        if archive_path and os.path.dirname(archive_path):
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+    def __len__(self):
+        return len(self._status)
+
+    # ---------- Consultas ----------
+    def with_status(self, status: str) -> list:
+        """Snapshot de las posiciones vivas en `status` (orden de alta)"""
+        with self._lock:
+            return list(self._by_status.get(status, {}).values())
+
+    def live(self) -> list:
+        with self._lock:
+            return [p for s in LIVE_STATUSES for p in self._by_status[s].values()]
+
+    def live_count(self) -> int:
+        return len(self._status)
+
+    def by_order(self, order_id) -> Optional[object]:
+        return self._by_order.get(str(order_id))
+
+    # ---------- Transiciones ----------
+    def add(self, p) -> bool:
+        """Registra una posición nueva (o recuperada); False si su orden de entrada ya está en el libro"""
+        with self._lock:
+            if p.entry_order_id is not None and str(p.entry_order_id) in self._by_order:
+                return False
+            if id(p) in self._status:
+                return False
+            self._status[id(p)] = None
+            self._apply(p)
+            return True
+
+    def update(self, p):
+        """Reindexa `p` tras un cambio de estado u órdenes; archiva si se cerró"""
+        with self._lock:
+            if id(p) not in self._status:
+                return
+            self._apply(p)
+
+    def _apply(self, p):
+        prev = self._status[id(p)]
+        if prev in self._by_status:
+            self._by_status[prev].pop(id(p), None)
+        if prev is not None:
+            self.counts[prev] -= 1
+        self.counts[p.status] += 1
+
+        if p.status in LIVE_STATUSES:
+            self._status[id(p)] = p.status
+            self._by_status[p.status][id(p)] = p
+            for oid in (p.entry_order_id, p.sl_order_id, p.tp_order_id):
+                if oid is not None:
+                    self._by_order[str(oid)] = p
+            return
+
+        # Cerrada: sale de los índices vivos
+        del self._status[id(p)]
+        for oid in [k for k, v in self._by_order.items() if v is p]:
+            del self._by_order[oid]
+        self.realized_pnl += p.pnl
+        rec = ClosedPosition(p.side, p.entry, p.stop, p.tp, p.size, p.opened_ts, p.closed_ts,
+                             p.close_price, p.status, p.pnl, p.entry_order_id)
+        self.closed.append(rec)
+        if self.archive_path:
+            self._archive(rec)
+
+    def _archive(self, rec: ClosedPosition):
+        try:
+            new = not os.path.exists(self.archive_path)
+            with open(self.archive_path, "a", newline="", encoding="utf-8") as fh:
+                w = csv.writer(fh)
+                if new:
+                    w.writerow(_CLOSED_FIELDS)
+                w.writerow(astuple(rec))
+        except OSError as e:
+            logger.warning("PositionBook: no se pudo archivar ({})", e)
@@ -0,0 +1,191 @@
+# app/price_watcher.py
+# Intrabar TP/SL monitoring from a live price stream.
+# - Subscribes to <symbol>@aggTrade (last trade price) or <symbol>@bookTicker
+#   (mid price) and checks every OPEN position's stop / take-profit per tick.
+# - Triggers live in two sorted lists (TriggerBook):
+#     below: fire when price <= level   (LONG stop, SHORT take-profit)
+#     above: fire when price >= level   (LONG take-profit, SHORT stop)
+#   so a tick costs O(log n) bisects plus the triggers it actually fires.
+# - Fired triggers are taken out of the book and the close goes through
+#   ExchangeEngine.close_position(), which is idempotent under the engine lock:
+#   the candle-based poll() can never close the same position a second time.
+#   If the close fails (exchange / network error) and the position is still
+#   OPEN, its triggers are re-armed after a per-position backoff (retry_base
+#   seconds, doubling up to retry_max); after max_attempts failures the watcher
+#   gives up on that position and the candle-based poll() closes it.
+# - Orders go through `client`, a ccxt client used only by the watcher thread
+#   (ccxt clients are not thread-safe; see exchange_pool.py).
+# - Fill stamps use the same TZ as the rest of the engine (TZ env var).
+# - Positions are (un)registered through ExchangeEngine.listeners.
+#
+# Requires the optional `websocket-client` package (same as kline_stream.py).
+
+import bisect
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+from loguru import logger
+from execution import ExchangeEngine, Position
+from kline_stream import WS_URLS, websocket
+
+TZ = os.getenv("TZ", "America/Santiago")
+
+
+class TriggerBook:
+    """Niveles de disparo ordenados por precio"""
+
+    def __init__(self):
+        self._below: List[tuple] = []   # (level, seq, pos, reason) ascendente
+        self._above: List[tuple] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._below) + len(self._above)
+
+    def add(self, p: Position):
+        with self._lock:
+            if p.side == "LONG":
+                bisect.insort(self._below, (p.stop, next(self._seq), p, "SL"))
+                bisect.insort(self._above, (p.tp, next(self._seq), p, "TP"))
+            else:
+                bisect.insort(self._above, (p.stop, next(self._seq), p, "SL"))
+                bisect.insort(self._below, (p.tp, next(self._seq), p, "TP"))
+
+    def remove(self, p: Position):
+        with self._lock:
+            self._below = [t for t in self._below if t[2] is not p]
+            self._above = [t for t in self._above if t[2] is not p]
+
+    def on_price(self, price: float) -> List[Tuple[Position, str, float]]:
+        """Extrae los triggers cruzados por `price` (SL primero si una posición dispara ambos)"""
+        with self._lock:
+            i = bisect.bisect_left(self._below, (price,))
+            fired = self._below[i:]
+            del self._below[i:]
+            j = bisect.bisect_right(self._above, (price, float("inf")))
+            fired += self._above[:j]
+            del self._above[:j]
+
+        out: Dict[int, Tuple[Position, str, float]] = {}
+        for level, _, p, reason in fired:
+            if id(p) not in out or reason == "SL":
+                out[id(p)] = (p, reason, level)
+        return list(out.values())
+
+
+class PriceWatcher:
+    """Cierra posiciones OPEN apenas el precio toca su SL/TP, sin esperar al cierre de vela"""
+
+    def __init__(self, engine: ExchangeEngine, exchange: str, sandbox: bool = False,
+                 channel: str = "aggTrade", url: Optional[str] = None, client=None,
+                 retry_base: float = 2.0, retry_max: float = 60.0, max_attempts: int = 5):
+        if websocket is None:
+            raise RuntimeError("PriceWatcher requiere el paquete 'websocket-client'")
+        self.engine = engine
+        self.client = client               # None = engine.exchange (solo si ningún otro hilo lo usa)
+        self.channel = channel
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self._failures: Dict[int, int] = {}                      # id(pos) -> cierres fallidos seguidos
+        self._rearm_at: Dict[int, Tuple[Position, float]] = {}   # id(pos) -> (pos, re-armar en monotonic)
+        base = url or WS_URLS.get((exchange.lower(), sandbox))
+        if base is None:
+            raise ValueError(f"PriceWatcher: exchange no soportado: {exchange}")
+        self.url = base if url else f"{base}/{engine.symbol.replace('/', '').lower()}@{channel}"
+        self.book = TriggerBook()
+        self.last_price: Optional[float] = None
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._ws = None
+
+        engine.listeners.append(self._on_transition)
+        for p in engine.book.with_status("OPEN"):
+            self.book.add(p)
+
+    def _on_transition(self, p: Position):
+        if p.status == "OPEN":
+            self.book.remove(p)  # una posición OPEN puede publicarse más de una vez (bracket)
+            if id(p) not in self._rearm_at and self._failures.get(id(p), 0) < self.max_attempts:
+                self.book.add(p)  # en backoff se re-arma en _rearm_due(); agotada, queda a poll()
+        elif p.status.startswith("CLOSED"):
+            self.book.remove(p)
+            self._failures.pop(id(p), None)
+            self._rearm_at.pop(id(p), None)
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        threading.Thread(target=self._run, name="price-watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._ws is not None:
+            self._ws.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._ws = websocket.WebSocketApp(self.url, on_message=self._on_message)
+            try:
+                self._ws.run_forever(ping_interval=20, ping_timeout=10)
+            except Exception as e:
+                logger.warning("PriceWatcher error: {}", str(e)[:160])
+            if not self._stop.is_set():
+                logger.warning("PriceWatcher desconectado, reintentando en 5s (TP/SL sigue por vela)")
+                self._stop.wait(5)
+
+    # ---------- Ticks ----------
+    def _on_message(self, _ws, message: str):
+        try:
+            d = json.loads(message)
+            d = d.get("data", d)
+            price = (float(d["b"]) + float(d["a"])) / 2 if self.channel == "bookTicker" else float(d["p"])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.on_price(price)
+
+    def on_price(self, price: float, ts: Optional[str] = None):
+        """Evalúa un tick; cierra (una sola vez) las posiciones cuyo SL/TP fue tocado"""
+        self.last_price = price
+        self.ticks += 1
+        if self._rearm_at:
+            self._rearm_due()
+        for p, reason, level in self.book.on_price(price):
+            stamp = ts or pd.Timestamp.now(tz=TZ).isoformat(timespec="seconds")
+            try:
+                closed = self.engine.close_position(p, reason, level, stamp, client=self.client)
+            except Exception as e:
+                logger.error("PriceWatcher: error cerrando {} {}: {}", p.side, reason, str(e)[:160])
+                closed = False
+            if closed:
+                self._failures.pop(id(p), None)
+                logger.info("PriceWatcher: {} {} cerrado intravela @ {:.2f}", p.side, reason, price)
+            elif p.status == "OPEN":
+                self._backoff(p, reason)
+
+    def _backoff(self, p: Position, reason: str):
+        """Cierre fallido: saca la posición del libro y programa el re-armado (o la deja a poll())"""
+        self.book.remove(p)
+        failures = self._failures[id(p)] = self._failures.get(id(p), 0) + 1
+        if failures >= self.max_attempts:
+            logger.error("PriceWatcher: {} fallos cerrando {} {}; queda al cierre por vela",
+                         failures, p.side, reason)
+            return
+        wait = min(self.retry_max, self.retry_base * 2 ** (failures - 1))
+        self._rearm_at[id(p)] = (p, time.monotonic() + wait)
+        logger.warning("PriceWatcher: cierre {} no confirmado ({} fallos), re-armado en {:.0f}s",
+                       reason, failures, wait)
+
+    def _rearm_due(self):
+        now = time.monotonic()
+        for key, (p, at) in list(self._rearm_at.items()):
+            if at <= now:
+                del self._rearm_at[key]
+                if p.status == "OPEN":
+                    self.book.remove(p)
+                    self.book.add(p)
@@ -0,0 +1,198 @@
+# app/prompt_codec.py
+# Pluggable encoders for the candle/pivot payload sent to the LLM.
+# - "json":    the original json.dumps payload (ISO minute timestamps, 2-decimal prices).
+# - "compact": token-lean text. Bars are referenced by index (no timestamps),
+#              prices are integer offsets from a base in units of 0.01, and
+#              pivots point at bar indices. The model answers in the same
+#              index/offset terms and decode() maps them back to the
+#              timestamps/prices StructureReport expects. Every price field
+#              in the answer is an offset (no guessing absolute vs offset);
+#              an offset outside the window's range is rejected as invalid.
+#
+# Token counts: `python prompt_codec.py http://ollama:11434 llama3.2:3b-instruct-q4_0`
+# measures each encoding with the model's own prompt_eval_count. Without an Ollama
+# URL it falls back to estimate_tokens(), a character-class heuristic (words,
+# 1-3 digit groups, punctuation) that is only a rough guide, not the tokenizer.
+
+import json
+import re
+from typing import Dict, List, Tuple
+
+TS_FIELDS = (("choch", "break_close_ts"), ("post_choch_swing", "ts"))
+PRICE_FIELDS = (("choch", "broken_level_price"), ("post_choch_swing", "price"))
+LEG_FIELDS = (("high_ts", "high_price"), ("low_ts", "low_price"))
+
+
+class JsonEncoder:
+    """Payload original: json.dumps de velas y pivots con timestamps ISO"""
+    name = "json"
+    instructions = ""
+
+    def encode(self, candles: List[List], pivots: List[Dict], K: int = 2) -> Tuple[str, dict]:
+        payload = {
+            "tf": "5m",
+            "params": {"K": K},
+            "candles": candles,              # [["ISO", o,h,l,c], ...]
+            "pivot_candidates": pivots
+        }
+        return json.dumps(payload), {}
+
+    def decode(self, data: dict, ctx: dict) -> dict:
+        return data
+
+
+class CompactEncoder:
+    """Payload compacto: índices de vela y precios como enteros relativos a una base"""
+    name = "compact"
+    unit = 0.01
+    instructions = (
+        "Data format: bars 'i:o,h,l,c' are integer offsets, price = base + v*unit. "
+        "Pivots are 'H@i:v' / 'L@i:v'. In your JSON answer every *_ts/ts field is the bar "
+        "index i (integer) and every *_price/price field is the integer offset v, never an absolute price."
+    )
+
+    def encode(self, candles: List[List], pivots: List[Dict], K: int = 2) -> Tuple[str, dict]:
+        lows = [c[3] for c in candles] or [0.0]
+        base = round(min(lows), 2)
+        u = self.unit
+
+        def off(p):
+            return int(round((float(p) - base) / u))
+
+        bar_of = {str(c[0])[:16]: i for i, c in enumerate(candles)}
+        bars = " ".join(f"{i}:{off(c[1])},{off(c[2])},{off(c[3])},{off(c[4])}" for i, c in enumerate(candles))
+        pivs = " ".join(
+            f"{p['type']}@{bar_of[str(p['ts'])[:16]]}:{off(p['price'])}"
+            for p in pivots if str(p.get("ts", ""))[:16] in bar_of
+        )
+        highs = [c[2] for c in candles] or [base]
+        text = f"tf=5m K={K} base={base} unit={u}\nbars {bars}\npivots {pivs}"
+        ctx = {"ts": [c[0] for c in candles], "base": base,
+               "max_off": off(max(highs)) if candles else 0}
+        return text, ctx
+
+    # ---------- Decode ----------
+    def _ts(self, v, ctx):
+        if isinstance(v, bool) or v is None:
+            return v
+        if isinstance(v, (int, float)) or (isinstance(v, str) and v.strip().lstrip("-").isdigit()):
+            i = int(v)
+            ts = ctx["ts"]
+            if ts and -len(ts) <= i < len(ts):
+                return ts[i]
+        return v
+
+    def _price(self, v, ctx):
+        if isinstance(v, bool) or v is None:
+            return v
+        try:
+            f = float(v)
+        except (TypeError, ValueError):
+            return v
+        # Siempre es offset: uno fuera del rango de la ventana (p.ej. un precio absoluto) es inválido
+        max_off = ctx["max_off"]
+        tol = max(2, max_off // 10)
+        if not -tol <= f <= max_off + tol:
+            raise ValueError(f"offset de precio {v} fuera de la ventana [0, {max_off}]")
+        return round(ctx["base"] + f * self.unit, 2)
+
+    def decode(self, data: dict, ctx: dict) -> dict:
+        if not isinstance(data, dict):
+            return data
+        for section, key in TS_FIELDS:
+            if isinstance(data.get(section), dict) and key in data[section]:
+                data[section][key] = self._ts(data[section][key], ctx)
+        for section, key in PRICE_FIELDS:
+            if isinstance(data.get(section), dict) and key in data[section]:
+                data[section][key] = self._price(data[section][key], ctx)
+        leg = (data.get("choch") or {}).get("leg") if isinstance(data.get("choch"), dict) else None
+        if isinstance(leg, dict):
+            for ts_key, price_key in LEG_FIELDS:
+                if ts_key in leg:
+                    leg[ts_key] = self._ts(leg[ts_key], ctx)
+                if price_key in leg:
+                    leg[price_key] = self._price(leg[price_key], ctx)
+        swings = data.get("last_swings")
+        if isinstance(swings, list):
+            for s in swings:
+                if isinstance(s, dict):
+                    if "ts" in s:
+                        s["ts"] = self._ts(s["ts"], ctx)
+                    if "price" in s:
+                        s["price"] = self._price(s["price"], ctx)
+        return data
+
+
+ENCODERS = {"json": JsonEncoder, "compact": CompactEncoder}
+
+
+def get_encoder(name: str):
+    try:
+        return ENCODERS[name.lower()]()
+    except KeyError:
+        raise ValueError(f"PROMPT_ENCODING desconocido: {name} (usa: {', '.join(ENCODERS)})")
+
+
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|\s+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Heurística de tokens estilo Llama 3 (palabras, grupos de hasta 3 dígitos, puntuación); no es el tokenizer"""
+    return sum(1 for t in _TOKEN_RE.findall(text) if not t.isspace() or "\n" in t)
+
+
+def compare_encodings(candles: List[List], pivots: List[Dict], K: int = 2) -> Dict[str, int]:
+    """Tokens estimados (heurística) del payload con cada encoder"""
+    return {name: estimate_tokens(cls().encode(candles, pivots, K)[0]) for name, cls in ENCODERS.items()}
+
+
+def measure_encodings(candles: List[List], pivots: List[Dict], url: str, model: str,
+                      K: int = 2) -> Dict[str, int]:
+    """
+    Tokens del payload según el tokenizer del modelo (prompt_eval_count de Ollama).
+    raw=True evita el chat template; keep_alive=0 descarga el modelo tras cada
+    request para que el caché de prefijo no reduzca la cuenta.
+    """
+    import requests
+
+    out = {}
+    for name, cls in ENCODERS.items():
+        text = cls().encode(candles, pivots, K)[0]
+        r = requests.post(f"{url.rstrip('/')}/api/generate", timeout=300, json={
+            "model": model, "prompt": text, "raw": True, "stream": False,
+            "keep_alive": 0, "options": {"num_predict": 1},
+        })
+        r.raise_for_status()
+        out[name] = r.json()["prompt_eval_count"]
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+    import numpy as np
+    import pandas as pd
+    from utils import fractal_pivot_candidates
+
+    rng = np.random.default_rng(7)
+    n = 300
+    close = 60000 + np.cumsum(rng.normal(0, 25, n))
+    open_ = np.r_[close[0], close[:-1]]
+    df = pd.DataFrame({
+        "ts": pd.date_range("2025-10-24", periods=n, freq="5min", tz="America/Santiago"),
+        "open": open_,
+        "high": np.maximum(open_, close) + rng.random(n) * 15,
+        "low": np.minimum(open_, close) - rng.random(n) * 15,
+        "close": close,
+    })
+    tail = df.tail(30)
+    first_ts = tail["ts"].iloc[0].isoformat()
+    piv = [{"type": p["type"], "ts": p["ts"][:16], "price": round(p["price"], 2)}
+           for p in fractal_pivot_candidates(df) if p["ts"] >= first_ts][-14:]
+    cds = [[r.ts.isoformat(timespec="minutes"), round(r.open, 2), round(r.high, 2), round(r.low, 2), round(r.close, 2)]
+           for r in tail.itertuples()]
+    if len(sys.argv) > 2:
+        counts, kind = measure_encodings(cds, piv, sys.argv[1], sys.argv[2]), f"tokens ({sys.argv[2]})"
+    else:
+        counts, kind = compare_encodings(cds, piv), "tokens (heuristic estimate, not the model tokenizer)"
+    for name, tokens in counts.items():
+        print(f"{name:8s} {tokens} {kind} ({tokens / counts['json']:.0%} of json)")
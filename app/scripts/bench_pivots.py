@@ -0,0 +1,77 @@
+# app/scripts/bench_pivots.py
+# Equivalence check + benchmark of utils.fractal_pivot_candidates (vectorized)
+# against the original per-row pandas loop, on synthetic random walks.
+# Exits non-zero if any output differs.
+#
+#     cd app && python -m scripts.bench_pivots --sizes 300 5000 20000 --ks 0 1 2 3 4 5
+
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+from utils import fractal_pivot_candidates
+
+
+def loop_pivot_candidates(df: pd.DataFrame, K: int = 2):
+    """Implementación original (referencia): loop por fila con .iloc"""
+    cands = []
+    for i in range(K, len(df)-K):
+        high = df["high"].iloc[i]; low = df["low"].iloc[i]
+        if (df["high"].iloc[i-K:i] < high).all() and (df["high"].iloc[i+1:i+1+K] < high).all():
+            cands.append({"type":"H","ts": df["ts"].iloc[i].isoformat(), "price": float(high)})
+        if (df["low"].iloc[i-K:i] > low).all() and (df["low"].iloc[i+1:i+1+K] > low).all():
+            cands.append({"type":"L","ts": df["ts"].iloc[i].isoformat(), "price": float(low)})
+    return cands
+
+
+def random_walk(n: int, seed: int = 0) -> pd.DataFrame:
+    """OHLC sintético; precios redondeados para forzar empates (comparación estricta)"""
+    rng = np.random.default_rng(seed)
+    close = np.round(30000 + np.cumsum(rng.normal(0, 20, n)), 0)
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({
+        "ts": pd.date_range("2024-01-01", periods=n, freq="5min", tz="America/Santiago"),
+        "open": open_,
+        "high": np.maximum(open_, close) + np.round(rng.random(n) * 10, 0),
+        "low": np.minimum(open_, close) - np.round(rng.random(n) * 10, 0),
+        "close": close,
+    })
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="fractal pivots: loop vs vectorizado")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[300, 5000, 20000])
+    ap.add_argument("--ks", type=int, nargs="+", default=[0, 1, 2, 3, 4, 5])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    ok = True
+    print(f"{'n':>7} {'K':>2} {'pivots':>7} {'loop_s':>9} {'vec_s':>9} {'speedup':>8}")
+    for n in args.sizes:
+        df = random_walk(n, seed=n)
+        df.loc[n // 2, "high"] = np.nan  # NaN: ambos deben tratarlo igual
+        for K in args.ks:
+            ref = loop_pivot_candidates(df, K)
+            vec = fractal_pivot_candidates(df, K)
+            same = repr(ref) == repr(vec)  # repr: nan == nan
+            ok &= same
+            t_loop = _best(lambda: loop_pivot_candidates(df, K), 1 if n > 5000 else args.repeat)
+            t_vec = _best(lambda: fractal_pivot_candidates(df, K), args.repeat)
+            print(f"{n:>7} {K:>2} {len(vec):>7} {t_loop:>9.4f} {t_vec:>9.4f} {t_loop / t_vec:>7.0f}x"
+                  + ("" if same else "  DIFIERE"))
+    print("salida idéntica" if ok else "ERROR: salida distinta")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# app/scripts/check_kline_stream.py
+# Runnable check of kline_stream.KlineStream against the local replay server:
+#   1. closed bars arrive and wait_for_close() wakes up on each one
+#   2. the server drops the connection -> the stream reconnects and resumes
+#   3. a bar is skipped -> candles() returns None (REST fallback) until seed()
+#      fills the gap, after which the history is contiguous again
+# Exits non-zero on the first failed check. Takes ~10s (5s reconnect delay).
+#
+#     cd app && python -m scripts.check_kline_stream
+
+import sys
+import time
+from loguru import logger
+from kline_stream import KlineStream
+from scripts.kline_replay import KlineReplayServer, synthetic_rows
+
+TF_MS = 300_000
+
+
+def _check(cond: bool, what: str):
+    print(f"{'OK  ' if cond else 'FAIL'} {what}")
+    if not cond:
+        sys.exit(1)
+
+
+def _contiguous(rows) -> bool:
+    return all(b[0] - a[0] == TF_MS for a, b in zip(rows, rows[1:]))
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    rows = synthetic_rows(60)
+    seeded = 20                      # REST: velas 0..19 cerradas + la 20 en formación
+    gap_ts = rows[32][0]
+    server = KlineReplayServer(rows[seeded:], interval=0.05, drop_after=6, skip={gap_ts}).start()
+    stream = KlineStream("binance", "BTC/USDT", "5m", url=server.url).start()
+    stream.seed(rows[:seeded + 1])
+
+    # 1. velas cerradas en vivo
+    _check(stream.wait_for_close(5), "wait_for_close() despierta con la primera vela cerrada")
+    got = stream.candles(300)
+    _check(got is not None and _contiguous(got), "candles() contiguo tras el seed REST")
+
+    # 2. corte del servidor tras 6 velas -> reconexión
+    deadline = time.monotonic() + 15
+    while server.connections < 2 and time.monotonic() < deadline:
+        time.sleep(0.1)
+    _check(server.connections >= 2, f"reconexión tras el corte ({server.connections} conexiones)")
+
+    # 3. vela salteada -> None hasta re-sembrar desde REST
+    deadline = time.monotonic() + 10
+    while gap_ts + TF_MS not in server.sent_closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    _check(stream.candles(300) is None, "salto detectado: candles() pide fallback REST")
+    last = server.sent_closed[-1]
+    rest = [r for r in rows if r[0] <= last + TF_MS]   # snapshot REST: incluye la vela perdida
+    stream.seed(rest)
+    got = stream.candles(300)
+    _check(got is not None and _contiguous(got) and any(r[0] == gap_ts for r in got),
+           "seed() rellena el hueco y el historial vuelve a ser contiguo")
+
+    stream.stop()
+    server.stop()
+    print("kline_stream: todos los checks OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# app/scripts/check_llm_hedge.py
+# Runnable check of the hedged / voted LLM path (llm_hedge.py through
+# structure_oracle.detect_structure_with_llm) against latency-injecting Ollama
+# stubs (scripts/ollama_stub.py):
+#   1. hedge: a slow primary is hedged after LLM_HEDGE_DELAY, the fast backend
+#      wins and the slow request is aborted (connection closed)
+#   2. failover: a backend returning garbage starts the next one immediately
+#   3. all backends failing ends in the Python fallback, not an exception
+#   4. vote: N seeded samples, the majority decision wins
+# Exits non-zero on the first failed check.
+#
+#     cd app && python -m scripts.check_llm_hedge
+
+import os
+import sys
+import time
+
+HEDGE_DELAY = 0.5
+os.environ.update(LLM_CACHE_DB="", LLM_STREAM="false", LLM_HEDGE_DELAY=str(HEDGE_DELAY),
+                  STRUCTURE_ENGINE="llm", LLM_TEMPERATURE="0.7")
+
+from loguru import logger  # noqa: E402
+import structure_oracle as so  # noqa: E402
+from llm_hedge import Backend  # noqa: E402
+from scripts.ollama_stub import REPORT, OllamaStub  # noqa: E402
+
+CANDLES = [[1_700_000_000_000 + i * 300_000, 100.0, 101.0, 99.0, 100.0, 1.0] for i in range(30)]
+
+
+def _check(cond: bool, what: str):
+    print(f"{'OK  ' if cond else 'FAIL'} {what}")
+    if not cond:
+        sys.exit(1)
+
+
+def _run(backends, vote: int = 0):
+    so.LLM_BACKENDS = backends
+    so.LLM_VOTE = vote
+    so.hedge_latency = so.LatencyWindow(HEDGE_DELAY)
+    t0 = time.monotonic()
+    report = so.detect_structure_with_llm(CANDLES, [], 2)
+    return report, time.monotonic() - t0
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    slow = OllamaStub(delay=3.0)
+    fast = OllamaStub(delay=0.2, response={**REPORT, "trend": "DOWN"})
+    bad = OllamaStub(delay=0.05, response="not json at all")
+
+    # 1. hedge tras el delay; el perdedor se corta
+    report, took = _run([Backend(slow.url, "slow"), Backend(fast.url, "fast")])
+    _check(report.trend == "DOWN" and took < HEDGE_DELAY + 1.0,
+           f"hedge: gana el backend rápido en {took:.2f}s (primario 3.0s, delay {HEDGE_DELAY}s)")
+    deadline = time.monotonic() + 2
+    while not slow.events("aborted") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    _check(bool(slow.events("aborted")) and not slow.events("done"),
+           "hedge: la request perdedora se cancela (Ollama deja de generar)")
+
+    # 2. failover inmediato ante una respuesta inválida
+    report, took = _run([Backend(bad.url, "bad"), Backend(fast.url, "fast")])
+    _check(report.trend == "DOWN" and took < HEDGE_DELAY,
+           f"failover: respuesta inválida -> siguiente backend sin esperar el delay ({took:.2f}s)")
+
+    # 3. todos fallan -> fallback Python
+    report, _ = _run([Backend(bad.url, "bad"), Backend(bad.url, "bad2")])
+    _check(report.trend in ("UP", "DOWN"), "todos los backends fallan: fallback Python, sin excepción")
+
+    # 4. votación: semillas 1, 2, 4 -> UP; 0, 3 -> DOWN
+    voter = OllamaStub(delay=0.1, response=lambda req: {
+        **REPORT, "trend": "UP" if req["options"]["seed"] % 3 else "DOWN"})
+    report, _ = _run([Backend(voter.url, "voter")], vote=5)
+    seeds = sorted(e[3] for e in voter.events("request"))
+    _check(seeds == [0, 1, 2, 3, 4], f"vote: 5 muestras con semillas distintas {seeds}")
+    _check(report.trend == "UP" and "vote 3/" in (report.validity_checks.notes or ""),
+           f"vote: gana la mayoría ({report.validity_checks.notes})")
+    print("llm hedge: todos los checks OK")
+
+
+if __name__ == "__main__":
+    main()
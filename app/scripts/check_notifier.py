@@ -0,0 +1,104 @@
+# app/scripts/check_notifier.py
+# Runnable check of notifier.Notifier against a local Telegram Bot API stub
+# (stdlib HTTP server on /bot<token>/sendMessage):
+#   1. send() never touches the network (enqueue cost)
+#   2. a burst is coalesced into one post, split at the 4096-char limit
+#   3. a 429 with retry_after is honoured and the message is not lost
+#   4. a failing API is counted as failed, and a full queue drops the oldest
+# Exits non-zero on the first failed check.
+#
+#     cd app && python -m scripts.check_notifier
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+from notifier import TELEGRAM_MAX_CHARS, Notifier
+
+
+class TelegramStub:
+    """Stub de sendMessage: registra los posts; `script` fija los códigos de respuesta en orden"""
+
+    def __init__(self):
+        self.posts = []          # (monotonic, status, text)
+        self.script = []         # códigos HTTP a devolver antes de volver a 200
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = stub.script.pop(0) if stub.script else 200
+                stub.posts.append((time.monotonic(), status, body.get("text", "")))
+                if status == 429:
+                    out = {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}
+                else:
+                    out = {"ok": status == 200, "result": {"message_id": len(stub.posts)}}
+                data = json.dumps(out).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def _check(cond: bool, what: str):
+    print(f"{'OK  ' if cond else 'FAIL'} {what}")
+    if not cond:
+        sys.exit(1)
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    stub = TelegramStub()
+    n = Notifier("TOKEN", "42", coalesce=0.2, min_interval=0.1, timeout=2, base_url=stub.base_url)
+
+    # 1 + 2: ráfaga -> un post por cada 4096 chars
+    msgs = [f"señal {i} " + "x" * 400 for i in range(20)]
+    t0 = time.perf_counter()
+    for m in msgs:
+        n.send(m)
+    per_send = (time.perf_counter() - t0) / len(msgs)
+    _check(per_send < 1e-3, f"send() no bloquea ({per_send * 1e6:.0f} us por mensaje)")
+    _check(n.flush(10), "la cola se vacía")
+    texts = [t for _, s, t in stub.posts if s == 200]
+    _check(all(len(t) <= TELEGRAM_MAX_CHARS for t in texts) and len(texts) < len(msgs),
+           f"ráfaga de {len(msgs)} mensajes coalescida en {len(texts)} posts <= {TELEGRAM_MAX_CHARS} chars")
+    _check("\n\n".join(texts) == "\n\n".join(msgs), "sin pérdidas ni reordenamiento")
+
+    # 3: 429 -> espera retry_after y reenvía
+    stub.posts.clear()
+    stub.script = [429]
+    n.send("rate limited")
+    _check(n.flush(10), "la cola se vacía tras el 429")
+    (t429, s1, _), (t200, s2, text) = stub.posts[:2]
+    _check(s1 == 429 and s2 == 200 and text == "rate limited" and t200 - t429 >= 0.95,
+           f"429 respetado: reintento tras {t200 - t429:.2f}s (retry_after=1)")
+
+    # 4: API caída -> failed; cola llena -> se descartan los más viejos
+    stub.posts.clear()
+    stub.script = [500, 500, 500]
+    sent_before = n.sent
+    n.send("api caída")
+    _check(n.flush(10) and n.sent == sent_before and len(stub.posts) == 3,
+           "error 500: 3 intentos, contado como fallido, sin excepción")
+    small = Notifier("TOKEN", "42", max_queue=5, coalesce=0.5, base_url=stub.base_url)
+    for i in range(8):
+        small.send(f"m{i}")
+    _check(small.dropped == 3, f"cola llena: {small.dropped} mensajes más viejos descartados")
+    print("notifier: todos los checks OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# app/scripts/check_pivot_tracker.py
+# Replay check of utils.IncrementalPivotTracker against the batch detector.
+# A long random walk is replayed as the live loop sees it: sliding `window`-bar
+# frames advancing one closed candle at a time, tracker.sync(frame) on each.
+# After every step the tracker's pivots inside the frame must equal
+# fractal_pivot_candidates(frame) (ignoring the first K bars, which the batch
+# detector cannot confirm without left context). A gap longer than the window
+# is injected mid-way to exercise the reset-and-replay path.
+# Exits non-zero on the first mismatch.
+#
+#     cd app && python -m scripts.check_pivot_tracker --bars 3000 --window 300
+
+import argparse
+import sys
+import numpy as np
+from utils import IncrementalPivotTracker, fractal_pivot_candidates, ohlcv_frame
+
+TF_MS = 300_000
+
+
+def random_rows(n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    close = np.round(30000 + np.cumsum(rng.normal(0, 20, n)), 0)
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) + np.round(rng.random(n) * 10, 0)
+    low = np.minimum(open_, close) - np.round(rng.random(n) * 10, 0)
+    ts = 1_700_000_000_000 + np.arange(n) * TF_MS
+    return np.column_stack([ts, open_, high, low, close, np.ones(n)]).tolist()
+
+
+def replay(rows: list, K: int, window: int, gap_at: int) -> int:
+    """Retorna la cantidad de pasos verificados; sale del proceso si hay diferencia"""
+    tracker = IncrementalPivotTracker(K=K, maxlen=window * 2)
+    steps = 0
+    for end in range(window, len(rows) + 1):
+        if gap_at <= end < gap_at + window + 10:
+            continue  # hueco mayor que la ventana: la última vela vista desaparece -> reset
+        frame = ohlcv_frame(rows[end - window:end])
+        tracker.sync(frame)
+        start_ts = int(frame["ts"].iloc[K]) if len(frame) > K else None
+        got = [(p["type"], int(p["ts"]), float(p["price"])) for p in tracker.pivots if int(p["ts"]) >= start_ts]
+        b = fractal_pivot_candidates(frame, K, as_arrays=True)
+        want = [(t, int(ts), float(px)) for t, ts, px in zip(b["type"], b["ts_ms"], b["price"]) if ts >= start_ts]
+        if got != want:
+            print(f"FAIL K={K} vela {end}: tracker={len(got)} batch={len(want)}")
+            print("  solo tracker:", sorted(set(got) - set(want))[:5])
+            print("  solo batch:  ", sorted(set(want) - set(got))[:5])
+            sys.exit(1)
+        steps += 1
+    return steps
+
+
+def main():
+    ap = argparse.ArgumentParser(description="IncrementalPivotTracker vs fractal_pivot_candidates")
+    ap.add_argument("--bars", type=int, default=3000)
+    ap.add_argument("--window", type=int, default=300)
+    ap.add_argument("--ks", type=int, nargs="+", default=[0, 1, 2, 4])
+    args = ap.parse_args()
+    rows = random_rows(args.bars)
+    for K in args.ks:
+        steps = replay(rows, K, args.window, gap_at=args.bars // 2)
+        print(f"OK   K={K}: {steps} pasos idénticos al detector batch")
+    print("pivot tracker: todos los checks OK")
+
+
+if __name__ == "__main__":
+    main()
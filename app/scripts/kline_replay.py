@@ -0,0 +1,160 @@
+# app/scripts/kline_replay.py
+# Local Binance-style kline WebSocket server for exercising kline_stream.py
+# without the exchange. Stdlib only (minimal RFC 6455: handshake + text frames).
+# - Replays a list of ccxt rows [ts, o, h, l, c, v] as <symbol>@kline_<tf>
+#   messages: `updates` forming updates (k.x=false) followed by the closed bar.
+# - drop_after=N closes every connection after N closed bars (reconnect test).
+# - skip={ts, ...} never sends those bars (gap test).
+# - Reconnecting clients resume from the next unsent bar.
+#
+#     python -m scripts.kline_replay --port 8765 --bars 500 --interval 0.5
+
+import argparse
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+from typing import Iterable, List, Optional
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def synthetic_rows(n: int, tf_ms: int = 300_000, start_ms: int = 1_700_000_000_000,
+                   price: float = 30000.0) -> List[List]:
+    """Velas sintéticas deterministas en formato ccxt"""
+    rows = []
+    for i in range(n):
+        o = price + (i % 7) - 3
+        c = o + ((i * 37) % 11) - 5
+        rows.append([start_ms + i * tf_ms, o, max(o, c) + 2, min(o, c) - 2, c, 1.0 + i % 5])
+    return rows
+
+
+def kline_message(row: List, closed: bool, symbol: str = "BTCUSDT", tf: str = "5m", tf_ms: int = 300_000) -> str:
+    ts, o, h, l, c, v = row
+    return json.dumps({"e": "kline", "E": ts, "s": symbol, "k": {
+        "t": ts, "T": ts + tf_ms - 1, "s": symbol, "i": tf,
+        "o": str(o), "h": str(h), "l": str(l), "c": str(c), "v": str(v), "x": closed}})
+
+
+def _frame(text: str) -> bytes:
+    data = text.encode()
+    n = len(data)
+    if n < 126:
+        head = struct.pack("!BB", 0x81, n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x81, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x81, 127, n)
+    return head + data
+
+
+class KlineReplayServer:
+    """Servidor WS que reproduce velas; un hilo por conexión"""
+
+    def __init__(self, rows: List[List], port: int = 0, interval: float = 0.05, updates: int = 2,
+                 drop_after: Optional[int] = None, skip: Iterable[int] = (), tf: str = "5m"):
+        self.rows = rows
+        self.interval = interval
+        self.updates = updates
+        self.drop_after = drop_after
+        self.skip = set(skip)
+        self.tf = tf
+        self.tf_ms = rows[1][0] - rows[0][0] if len(rows) > 1 else 300_000
+        self.connections = 0
+        self.sent_closed: List[int] = []   # ts de las velas cerradas enviadas
+        self._next = 0
+        self._lock = threading.Lock()
+        self._sock = socket.create_server(("127.0.0.1", port))
+        self.port = self._sock.getsockname()[1]
+        self._stop = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    def start(self):
+        threading.Thread(target=self._accept, name="kline-replay", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._sock.close()
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn: socket.socket) -> bool:
+        req = b""
+        while b"\r\n\r\n" not in req:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return False
+            req += chunk
+        key = next((line.split(":", 1)[1].strip() for line in req.decode().split("\r\n")
+                    if line.lower().startswith("sec-websocket-key:")), None)
+        if key is None:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    def _serve(self, conn: socket.socket):
+        with conn:
+            if not self._handshake(conn):
+                return
+            with self._lock:
+                self.connections += 1
+            sent = 0
+            try:
+                while not self._stop.is_set():
+                    with self._lock:
+                        if self._next >= len(self.rows):
+                            break
+                        row = self.rows[self._next]
+                        self._next += 1
+                    if row[0] in self.skip:
+                        continue
+                    for _ in range(self.updates):
+                        conn.sendall(_frame(kline_message(row, False, tf=self.tf, tf_ms=self.tf_ms)))
+                        time.sleep(self.interval / (self.updates + 1))
+                    conn.sendall(_frame(kline_message(row, True, tf=self.tf, tf_ms=self.tf_ms)))
+                    self.sent_closed.append(row[0])
+                    sent += 1
+                    time.sleep(self.interval / (self.updates + 1))
+                    if self.drop_after and sent >= self.drop_after:
+                        return  # corte abrupto: el cliente debe reconectar
+                while not self._stop.is_set():
+                    time.sleep(0.2)  # fin del replay: conexión abierta pero muda (stream "stale")
+            except OSError:
+                return
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay local de velas por WebSocket (formato Binance)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--bars", type=int, default=500)
+    ap.add_argument("--interval", type=float, default=0.5, help="segundos por vela")
+    ap.add_argument("--drop-after", type=int, default=None)
+    args = ap.parse_args()
+    server = KlineReplayServer(synthetic_rows(args.bars), port=args.port, interval=args.interval,
+                               drop_after=args.drop_after).start()
+    print(f"replay en {server.url} ({args.bars} velas)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
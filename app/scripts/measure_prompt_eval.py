@@ -0,0 +1,121 @@
+# app/scripts/measure_prompt_eval.py
+# Before/after measurement of the Ollama request setup against a live instance.
+# The same bars are replayed in two modes, each starting from an unloaded model:
+#   before: LLM_API=generate, Ollama's default keep_alive (5m), no warm-up
+#   after:  LLM_API=chat, LLM_KEEP_ALIVE, warm_up() first (as main.py does)
+# and prompt_eval_count / prompt_eval_duration / load_duration are printed per
+# bar. Both prompts start with the same static instructions, so Ollama's prefix
+# cache applies to either; the difference is expected in load_duration, which
+# needs --idle above 300s (the 5m default unload) to show up.
+#
+#     cd app && python -m scripts.measure_prompt_eval --url http://localhost:11434 --bars 6 --idle 330
+#     cd app && python -m scripts.measure_prompt_eval --stub    # solo el flujo, contra scripts/ollama_stub
+
+import argparse
+import os
+import sys
+import time
+from statistics import mean
+
+os.environ.update(LLM_CACHE_DB="", STRUCTURE_ENGINE="llm", LLM_STREAM="false", LLM_HEARTBEAT="0")
+
+import numpy as np  # noqa: E402
+import requests  # noqa: E402
+from loguru import logger  # noqa: E402
+import structure_oracle as so  # noqa: E402
+from llm_hedge import Backend  # noqa: E402
+from utils import IncrementalPivotTracker, llm_payload, ohlcv_frame  # noqa: E402
+
+
+def bars(n_bars: int, history: int = 120):
+    """(candles, pivots) por vela, igual que el loop en vivo (ventana deslizante de velas cerradas)"""
+    rng = np.random.default_rng(7)
+    n = history + n_bars
+    close = 30000 + np.cumsum(rng.normal(0, 20, n))
+    open_ = np.r_[close[0], close[:-1]]
+    rows = np.column_stack([1_700_000_000_000 + np.arange(n) * 300_000, open_,
+                            np.maximum(open_, close) + rng.random(n) * 10,
+                            np.minimum(open_, close) - rng.random(n) * 10, close, np.ones(n)]).tolist()
+    tracker = IncrementalPivotTracker(K=2, maxlen=64)
+    for end in range(history, n):
+        work_df = ohlcv_frame(rows[end - history:end])
+        tracker.sync(work_df)
+        yield llm_payload(work_df, tracker, tail=30, max_pivots=14, tz="America/Santiago")
+
+
+MODES = {
+    "before": {"api": "generate", "keep_alive": "5m", "warm_up": False},
+    "after": {"api": "chat", "keep_alive": so.LLM_KEEP_ALIVE, "warm_up": True},
+}
+
+
+def unload(backend: Backend):
+    """keep_alive=0 descarga el modelo: cada modo arranca en frío"""
+    try:
+        requests.post(f"{backend.url}/api/generate", json={"model": backend.model, "keep_alive": 0}, timeout=30)
+    except requests.RequestException as e:
+        logger.warning("unload falló: {}", str(e)[:120])
+
+
+def measure(mode: str, n_bars: int, idle: float) -> list:
+    cfg = MODES[mode]
+    so.LLM_API = cfg["api"]
+    so.LLM_KEEP_ALIVE = cfg["keep_alive"]
+    unload(so.LLM_BACKENDS[0])
+    seen = []
+    record = so._record_ollama
+
+    def capture(body: dict):
+        seen.append(body)
+        record(body)
+
+    so._record_ollama = capture
+    try:
+        if cfg["warm_up"]:
+            so.warm_up()
+        warm = seen[-1] if seen else {}
+        seen.clear()
+        for i, (candles, pivots) in enumerate(bars(n_bars)):
+            if i and idle:
+                time.sleep(idle)
+            so.detect_structure_with_llm(candles, pivots, 2)
+    finally:
+        so._record_ollama = record
+    print(f"\n{mode}: LLM_API={cfg['api']} keep_alive={cfg['keep_alive']} | warm-up: "
+          + (f"prompt_eval {warm.get('prompt_eval_count', '?')} tok, load {warm.get('load_duration', 0) / 1e9:.2f}s"
+             if cfg["warm_up"] else "no"))
+    print(f"{'vela':>4} {'prompt_tok':>10} {'prompt_eval_s':>13} {'load_s':>7} {'total_s':>8}")
+    for i, b in enumerate(seen):
+        print(f"{i:>4} {b.get('prompt_eval_count', 0):>10} {b.get('prompt_eval_duration', 0) / 1e9:>13.3f} "
+              f"{b.get('load_duration', 0) / 1e9:>7.2f} {b.get('total_duration', 0) / 1e9:>8.2f}")
+    return seen
+
+
+def main():
+    ap = argparse.ArgumentParser(description="prompt_eval / load por vela: configuración anterior vs actual")
+    ap.add_argument("--url", default=os.getenv("LLM_URL", "http://localhost:11434"))
+    ap.add_argument("--model", default=so.LLM_MODEL)
+    ap.add_argument("--bars", type=int, default=6)
+    ap.add_argument("--idle", type=float, default=0.0, help="segundos entre velas (330 = velas de 5m)")
+    ap.add_argument("--stub", action="store_true", help="usar scripts/ollama_stub (sin modelo)")
+    args = ap.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    url = args.url
+    if args.stub:
+        from scripts.ollama_stub import OllamaStub
+        url = OllamaStub(delay=0.05).url
+    so.LLM_BACKENDS = [Backend(url.rstrip("/"), args.model)]
+
+    results = {mode: measure(mode, args.bars, args.idle) for mode in MODES}
+    print(f"\nmedia por vela ({args.model} @ {url}, idle {args.idle:.0f}s):")
+    for mode, seen in results.items():
+        if seen:
+            print(f"  {mode:>6}: prompt_eval {mean(b.get('prompt_eval_count', 0) for b in seen):.0f} tok, "
+                  f"{mean(b.get('prompt_eval_duration', 0) for b in seen) / 1e9:.3f}s, "
+                  f"load {mean(b.get('load_duration', 0) for b in seen) / 1e9:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
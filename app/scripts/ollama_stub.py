@@ -0,0 +1,170 @@
+# app/scripts/ollama_stub.py
+# Local Ollama stand-in for exercising the LLM client paths without a model.
+# Stdlib HTTP server answering /api/generate and /api/chat:
+# - `delay` seconds of injected latency per request (spread across the chunks
+#   when the request streams), so hedging / timeouts can be reproduced.
+# - `response`: a StructureReport-like dict, a raw string (e.g. invalid JSON)
+#   or a callable(request) -> dict | str.
+# - Streamed requests whose client disconnects are logged as "aborted" (what
+#   Ollama does when a losing request is cancelled).
+# - prompt_eval_count models prefix caching: only the characters after the
+#   prefix shared with the previous prompt are evaluated (~4 chars per token).
+#
+#     python -m scripts.ollama_stub --port 11434 --delay 2
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Union
+
+REPORT = {
+    "trend": "UP",
+    "last_swings": [],
+    "choch": {"detected": False, "direction": None, "broken_level_type": None, "broken_level_price": None,
+              "break_close_ts": None, "leg": None},
+    "post_choch_swing": {"exists": False, "type": None, "ts": None, "price": None},
+    "validity_checks": {"broke_on_close": False, "notes": ""},
+    "confidence": 0.7,
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clientes que cortan la conexión (perdedores de la carrera) no son un error
+
+
+def _prompt_text(req: dict) -> str:
+    if "messages" in req:
+        return "".join(f"{m.get('role')}:{m.get('content')}" for m in req["messages"])
+    return req.get("prompt", "")
+
+
+class OllamaStub:
+    """Servidor HTTP que imita /api/generate y /api/chat con latencia inyectada"""
+
+    def __init__(self, port: int = 0, delay: float = 0.0,
+                 response: Union[dict, str, Callable[[dict], Union[dict, str]], None] = None,
+                 chunks: int = 20):
+        self.delay = delay
+        self.response = REPORT if response is None else response
+        self.chunks = chunks
+        self.log: List[tuple] = []       # (monotonic, evento, modelo, seed)
+        self._prev_prompt = ""
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                req = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub._handle(self, req)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name=f"ollama-stub-{self.port}", daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def events(self, kind: Optional[str] = None) -> List[tuple]:
+        with self._lock:
+            return [e for e in self.log if kind is None or e[1] == kind]
+
+    def _event(self, kind: str, req: dict):
+        with self._lock:
+            self.log.append((time.monotonic(), kind, req.get("model"), (req.get("options") or {}).get("seed")))
+
+    def _prompt_tokens(self, req: dict) -> int:
+        text = _prompt_text(req)
+        with self._lock:
+            common = 0
+            for a, b in zip(self._prev_prompt, text):
+                if a != b:
+                    break
+                common += 1
+            self._prev_prompt = text
+        return max(1, (len(text) - common) // 4)
+
+    def _final(self, req: dict, text: str, n_prompt: int) -> dict:
+        body = {"model": req.get("model"), "done": True, "prompt_eval_count": n_prompt,
+                "prompt_eval_duration": n_prompt * 2_000_000, "eval_count": max(1, len(text) // 4),
+                "eval_duration": int(self.delay * 1e9), "load_duration": 0,
+                "total_duration": int(self.delay * 1e9) + n_prompt * 2_000_000}
+        if "messages" in req:
+            body["message"] = {"role": "assistant", "content": text}
+        else:
+            body["response"] = text
+        return body
+
+    def _handle(self, h: BaseHTTPRequestHandler, req: dict):
+        self._event("request", req)
+        out = self.response(req) if callable(self.response) else self.response
+        text = out if isinstance(out, str) else json.dumps(out)
+        n_prompt = self._prompt_tokens(req)
+        if (req.get("options") or {}).get("num_predict") == 1:
+            text = ""  # warm-up / heartbeat
+
+        if not req.get("stream"):
+            time.sleep(self.delay)
+            data = json.dumps(self._final(req, text, n_prompt)).encode()
+            h.send_response(200)
+            h.send_header("Content-Type", "application/json")
+            h.send_header("Content-Length", str(len(data)))
+            h.end_headers()
+            h.wfile.write(data)
+            self._event("done", req)
+            return
+
+        h.send_response(200)
+        h.send_header("Content-Type", "application/x-ndjson")
+        h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+        step = max(1, len(text) // self.chunks)
+        try:
+            for i in range(0, len(text), step):
+                time.sleep(self.delay / self.chunks)
+                piece = {"model": req.get("model"), "done": False}
+                if "messages" in req:
+                    piece["message"] = {"role": "assistant", "content": text[i:i + step]}
+                else:
+                    piece["response"] = text[i:i + step]
+                self._chunk(h, json.dumps(piece) + "\n")
+            self._chunk(h, json.dumps(self._final(req, "", n_prompt)) + "\n")
+            h.wfile.write(b"0\r\n\r\n")
+            h.wfile.flush()
+            self._event("done", req)
+        except (BrokenPipeError, ConnectionResetError):
+            self._event("aborted", req)
+
+    @staticmethod
+    def _chunk(h: BaseHTTPRequestHandler, line: str):
+        data = line.encode()
+        h.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        h.wfile.flush()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stub local de Ollama con latencia inyectada")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--delay", type=float, default=1.0, help="segundos por request")
+    args = ap.parse_args()
+    stub = OllamaStub(port=args.port, delay=args.delay)
+    print(f"stub de Ollama en {stub.url} (delay={args.delay}s)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
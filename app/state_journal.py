@@ -0,0 +1,113 @@
+# app/state_journal.py
+# Append-only, crash-safe journal for position and signal state.
+# - Every position transition (ExchangeEngine.listeners) and every signal the
+#   throttle acts on is appended as one JSON line: a single write + flush
+#   (+ fsync) on the hot path, no read-modify-write.
+# - On startup the journal is replayed (last record per position wins), torn
+#   tail lines from a crash are skipped, and the file is compacted to the live
+#   state (open/pending positions + last signal per stream) with an atomic rename,
+#   so replay time stays bounded by what is actually open.
+# - The recovered positions go back into the engine and ExchangeEngine.recover()
+#   reconciles them against the exchange with the same bulk order snapshot poll() uses.
+#
+#   journal = StateJournal("./data/state.jsonl")
+#   journal.attach(engine)
+#   engine.recover(journal.positions(SYMBOL), ts)
+#   last_signal_ts = journal.last_signal(f"{SYMBOL} {TIMEFRAME}")
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, fields
+from typing import Dict, List, Optional
+from loguru import logger
+from execution import ExchangeEngine, Position
+
+_POSITION_FIELDS = {f.name for f in fields(Position)}
+
+
+class StateJournal:
+    """Journal JSONL de posiciones y señales con replay y compactación al iniciar"""
+
+    def __init__(self, path: str, fsync: bool = True):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._positions: Dict[str, dict] = {}   # "key|order_id" -> último registro
+        self._signals: Dict[str, str] = {}      # stream -> signal_ts
+        t0 = time.perf_counter()
+        n = self._replay()
+        self._compact()
+        self._fh = open(path, "a", encoding="utf-8")
+        logger.info("Journal {}: {} registros, {} posiciones vivas, {} streams ({:.1f} ms)",
+                    path, n, len(self._positions), len(self._signals), (time.perf_counter() - t0) * 1000)
+
+    # ---------- Recovery ----------
+    def _replay(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        n = 0
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    logger.warning("Journal: línea incompleta ignorada ({} bytes)", len(line))
+                    continue
+                n += 1
+                if rec.get("k") == "pos":
+                    key = f"{rec['key']}|{rec['entry_order_id']}"
+                    if rec.get("status", "").startswith("CLOSED"):
+                        self._positions.pop(key, None)
+                    else:
+                        self._positions[key] = rec
+                elif rec.get("k") == "signal":
+                    self._signals[rec["stream"]] = rec["ts"]
+        return n
+
+    def _compact(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            for stream, ts in self._signals.items():
+                fh.write(json.dumps({"k": "signal", "stream": stream, "ts": ts}) + "\n")
+            for rec in self._positions.values():
+                fh.write(json.dumps(rec) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+
+    def positions(self, key: str) -> List[Position]:
+        """Posiciones PENDING_ENTRY / OPEN recuperadas para `key` (símbolo o stream)"""
+        return [Position(**{k: v for k, v in rec.items() if k in _POSITION_FIELDS})
+                for rec in self._positions.values() if rec["key"] == key]
+
+    def last_signal(self, stream: str) -> Optional[str]:
+        return self._signals.get(stream)
+
+    # ---------- Hot path ----------
+    def _append(self, rec: dict):
+        line = json.dumps(rec, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+
+    def record_position(self, key: str, p: Position):
+        self._append({"k": "pos", "key": key, **asdict(p)})
+
+    def record_signal(self, stream: str, signal_ts: str):
+        self._signals[stream] = signal_ts
+        self._append({"k": "signal", "stream": stream, "ts": signal_ts})
+
+    def attach(self, engine: ExchangeEngine, key: Optional[str] = None):
+        """Registra cada transición de posición del engine en el journal (key: símbolo por defecto)"""
+        key = key or engine.symbol
+        engine.listeners.append(lambda p: self.record_position(key, p))
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
@@ -0,0 +1,85 @@
+# app/strategy.py
+# Signal -> order plan, shared by the live loop (main.py) and the replay engine (backtest.py).
+# A valid ChoCH (broken on close, with leg and the confirming post-ChoCH swing)
+# becomes a LIMIT entry at the `fib` retracement of the impulse leg:
+#   BULLISH -> LONG  entry = low  + fib * (high - low), SL = low,  TP = high
+#   BEARISH -> SHORT entry = high - fib * (high - low), SL = high, TP = low
+# handle_report() applies a plan to an ExchangeEngine (main.py, orchestrator.py
+# and the backtest): throttle per signal, open, then journal / track / notify.
+# SHORT plans are skipped on spot engines (no short selling there).
+
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+from loguru import logger
+from structure_schema import StructureReport
+
+FIB_LEVEL = 0.618
+
+
+@dataclass
+class TradePlan:
+    """Orden propuesta a partir de un reporte de estructura"""
+    side: str          # "LONG" o "SHORT"
+    entry: float
+    stop: float
+    tp: float
+    signal_ts: str     # choch.break_close_ts (clave de throttle)
+    confidence: float
+
+
+def plan_trade(report: StructureReport, min_confidence: float,
+               fib: float = FIB_LEVEL) -> Tuple[Optional[TradePlan], str]:
+    """Retorna (plan, motivo). plan es None si el reporte no genera señal operable."""
+    if not (report.choch.detected and report.validity_checks.broke_on_close and report.choch.leg):
+        return None, f"Sin ChoCH válido | trend={report.trend} | conf={report.confidence:.2f}"
+    if report.confidence < min_confidence:
+        return None, f"Señal descartada por baja confianza: {report.confidence:.2f} < {min_confidence:.2f}"
+
+    leg = report.choch.leg
+    direction = report.choch.direction
+    swing = report.post_choch_swing
+    if direction == "BULLISH" and swing.exists and swing.type == "HL":
+        plan = TradePlan("LONG", leg.low_price + fib * (leg.high_price - leg.low_price),
+                         leg.low_price, leg.high_price, report.choch.break_close_ts, report.confidence)
+    elif direction == "BEARISH" and swing.exists and swing.type == "LH":
+        plan = TradePlan("SHORT", leg.high_price - fib * (leg.high_price - leg.low_price),
+                         leg.high_price, leg.low_price, report.choch.break_close_ts, report.confidence)
+    else:
+        return None, f"ChoCH {direction} detectado, post-ChoCH swing NO confirmado."
+    return plan, "ok"
+
+
+def handle_report(report: StructureReport, engine, last_signal_ts: Optional[str], name: str,
+                  min_confidence: float, size: float, journal=None, tracker=None,
+                  notify: Optional[Callable[[str], None]] = None, fib: float = FIB_LEVEL) -> Optional[str]:
+    """
+    Aplica el reporte de estructura: abre posición si hay ChoCH válido.
+    Retorna last_signal_ts; solo avanza si el engine abrió la posición.
+    """
+    plan, reason = plan_trade(report, min_confidence, fib)
+    if plan is None:
+        logger.info("[{}] {}", name, reason)
+    elif last_signal_ts == plan.signal_ts:
+        logger.info("[{}] Throttle: ya actuamos para esta señal ({})", name, last_signal_ts)
+    elif plan.side == "SHORT" and not engine.is_derivatives:
+        logger.info("[{}] SHORT ignorado: el engine es spot ({})", name, plan.signal_ts)
+    elif engine.can_open():
+        pos = engine.open(plan.side, plan.entry, plan.stop, plan.tp, size, plan.signal_ts)
+        if pos is None:
+            # Rechazada por el engine: la señal no cuenta como actuada (se puede reintentar)
+            return last_signal_ts
+        last_signal_ts = plan.signal_ts
+        if journal is not None:
+            journal.record_signal(name, last_signal_ts)
+        if tracker is not None:
+            tracker.add_signal("BULLISH" if plan.side == "LONG" else "BEARISH",
+                               plan.entry, plan.stop, plan.tp, report.confidence, position=pos)
+        if notify is not None:
+            notify(
+                f"🚀 florencia-ai {plan.side} | {name}\n"
+                f"ENTRY:{plan.entry:.2f}  SL:{plan.stop:.2f}  TP:{plan.tp:.2f}\n"
+                f"size:{size}  conf:{report.confidence:.2f}"
+            )
+    else:
+        logger.info("[{}] Cap de posiciones alcanzado ({}). No se abre nueva.", name, engine.max_open_positions)
+    return last_signal_ts
@@ -1,15 +1,60 @@
 import os
 import json
+import time
 import requests
+from urllib3.exceptions import ReadTimeoutError
 import re
-from typing import List, Dict
+import threading
+from statistics import mean
+from typing import List, Dict, Optional
 from loguru import logger
-from structure_schema import StructureReport
+from structure_schema import Choch, PostChochSwing, StructureReport, Validity
+from structure_rules import detect_structure_with_rules
+from llm_cache import LLMCache, cache_key
+from prompt_codec import get_encoder
+from metrics import metrics
+from llm_hedge import Backend, Cancelled, LatencyWindow, parse_backends, race, vote
 from pydantic import ValidationError
 
 LLM_URL = os.getenv("LLM_URL", "http://ollama:11434")
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.2:3b-instruct-q4_0")
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.2"))
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "json").lower()  # "json" | "compact"
+LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() == "true"  # NDJSON con corte temprano
+STRUCTURE_ENGINE = os.getenv("STRUCTURE_ENGINE", "llm").lower()  # "rules" | "llm" | "hybrid"
+# hybrid sin respuesta del LLM (error o fallback Python): "veto" descarta el ChoCH de reglas,
+# "pass" lo opera sin confirmar
+HYBRID_ON_LLM_FAILURE = os.getenv("HYBRID_ON_LLM_FAILURE", "veto").lower()
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "./data/llm_cache.db")   # vacío = sin caché
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", "5000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# "url|model,url|model" en orden de preferencia; vacío = solo LLM_URL / LLM_MODEL
+LLM_BACKENDS = parse_backends(os.getenv("LLM_BACKENDS", ""), LLM_URL, LLM_MODEL)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "15"))      # seg. hasta tener historial de latencias
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))
+LLM_VOTE = int(os.getenv("LLM_VOTE", "0"))  # >1 = self-consistency con N muestras (requiere temperature > 0)
+# "chat": instrucciones fijas como mensaje system (prefijo idéntico en cada vela -> KV reutilizado
+# por Ollama, solo se evalúan las velas); "generate": prompt plano (comportamiento anterior; también
+# empieza con el mismo prefijo estático, la ganancia medible viene de keep_alive + warm-up)
+LLM_API = os.getenv("LLM_API", "chat").lower()
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")      # el default de Ollama (5m) descarga el modelo entre velas de 5m
+LLM_HEARTBEAT = float(os.getenv("LLM_HEARTBEAT", "120"))  # seg. sin requests antes de un heartbeat (0 = deshabilitado)
+# "schema": decodificación restringida al JSON Schema de StructureReport | "json": solo JSON válido
+LLM_FORMAT = os.getenv("LLM_FORMAT", "schema").lower()
+
+# Iguales en warm-up, heartbeat y análisis: cambiar num_ctx / num_thread recarga el modelo
+LLM_OPTIONS = {
+    "temperature": LLM_TEMPERATURE,
+    "num_ctx": 3072,       # 40 velas + 18 pivots + prompt = ~2500 tokens
+    "num_predict": 300,    # JSON completo con leg + swings
+    "top_p": 0.9,
+    "repeat_penalty": 1.05,
+    "num_thread": 4        # mejor rendimiento para llama3.2
+}
+
+hedge_latency = LatencyWindow(LLM_HEDGE_DELAY, q=LLM_HEDGE_QUANTILE)
+
+llm_cache = LLMCache(LLM_CACHE_DB, max_entries=LLM_CACHE_MAX, ttl=LLM_CACHE_TTL) if LLM_CACHE_DB else None
 
 SYSTEM_PROMPT = r"""Analyze 5m BTC. Return ONLY valid JSON. MANDATORY: trend must be UP or DOWN (NO SIDEWAYS ALLOWED).
 
@@ -51,48 +96,371 @@ def _extract_json(text: str) -> str:
         return cleaned[start:end+1]
     return "{}"
 
-def detect_structure_with_llm(candles: List[List], pivot_candidates: List[Dict], K: int = 2) -> StructureReport:
-    user_payload = {
-        "tf": "5m",
-        "params": {"K": K},
-        "candles": candles,              # [["ISO", o,h,l,c], ...]
-        "pivot_candidates": pivot_candidates
-    }
-
-    def _call(prompt_text: str) -> str:
-        req = {
-            "model": LLM_MODEL,
-            "prompt": prompt_text,
-            "options": {
-                "temperature": LLM_TEMPERATURE,
-                "num_ctx": 3072,       # 40 velas + 18 pivots + prompt = ~2500 tokens
-                "num_predict": 300,    # JSON completo con leg + swings
-                "top_p": 0.9,
-                "repeat_penalty": 1.05,
-                "num_thread": 4        # mejor rendimiento para llama3.2
-            },
-            "stream": False,
-            "format": "json"
-        }
-        r = requests.post(f"{LLM_URL}/api/generate", json=req, timeout=90)  # llama3.2 es rápido
-        r.raise_for_status()
-        return r.json().get("response", "{}")
+_TEMPLATE_DEFAULTS = json.loads(STRICT_TEMPLATE)
+_FORMAT = StructureReport.model_json_schema() if LLM_FORMAT == "schema" else "json"
 
-    # ---------- Attempt 1: normal strict prompt ----------
-    prompt1 = (
+
+def _static_prefix(encoder) -> str:
+    """Instrucciones fijas (idénticas byte a byte en cada vela para el mismo encoder)"""
+    return (
         SYSTEM_PROMPT
         + "\n\nReturn ONLY JSON. MUST choose UP or DOWN (never SIDEWAYS).\n"
         + STRICT_TEMPLATE
-        + "\n\nData:\n"
-        + json.dumps(user_payload)
+        + (("\n" + encoder.instructions) if encoder.instructions else "")
+    )
+
+
+def _ollama_request(backend: Backend, system: str, user: str, options: dict) -> tuple:
+    """(path, body) para /api/chat (system + user) o /api/generate (prompt plano equivalente)"""
+    common = {"model": backend.model, "options": options, "stream": False, "format": _FORMAT,
+              "keep_alive": LLM_KEEP_ALIVE}
+    if LLM_API == "chat":
+        return "/api/chat", {**common, "messages": [{"role": "system", "content": system},
+                                                    {"role": "user", "content": user}]}
+    return "/api/generate", {**common, "prompt": system + "\n\n" + user}
+
+
+def _response_text(body: dict) -> str:
+    """Texto generado en una respuesta (o chunk) de /api/generate o /api/chat"""
+    if "message" in body:
+        return (body.get("message") or {}).get("content", "")
+    return body.get("response", "")
+# choch.detected=false decide el reporte: lo que sigue no cambia la acción del bot
+_EARLY_NO_CHOCH = re.compile(r'"choch"\s*:\s*\{\s*"detected"\s*:\s*false')
+
+# Tiempos del último request en streaming (ttft / decisión), para diagnóstico
+last_call_stats: Dict[str, float] = {}
+
+_OLLAMA_DURATIONS = ("prompt_eval", "eval", "load", "total")
+
+
+def _record_ollama(body: dict):
+    """Registra los *_duration (ns) y los tokens de prompt evaluados que Ollama incluye en la respuesta final"""
+    for name in _OLLAMA_DURATIONS:
+        ns = body.get(f"{name}_duration")
+        if ns:
+            metrics.observe("ollama_seconds", ns / 1e9, phase=name)
+    # Con el prefijo en caché solo se evalúan los tokens nuevos (velas + pivots)
+    if body.get("prompt_eval_count") is not None:
+        metrics.observe("ollama_prompt_tokens", body["prompt_eval_count"])
+    logger.info("LLM {} | prompt_eval {} tok en {:.2f}s | load {:.2f}s | total {:.2f}s",
+                body.get("model", "?"), body.get("prompt_eval_count", "?"),
+                body.get("prompt_eval_duration", 0) / 1e9, body.get("load_duration", 0) / 1e9,
+                body.get("total_duration", 0) / 1e9)
+
+
+class _JsonScanner:
+    """Sigue profundidad de llaves/corchetes (respetando strings) sobre texto incremental"""
+
+    def __init__(self):
+        self.stack: List[str] = []
+        self.in_str = False
+        self.esc = False
+        self.started = False
+        self.pos = 0
+
+    def feed(self, piece: str):
+        """Procesa un fragmento; retorna el índice (exclusivo) donde cierra el objeto raíz, o None"""
+        for ch in piece:
+            self.pos += 1
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.stack.append("}" if ch == "{" else "]")
+                self.started = True
+            elif ch in "}]" and self.stack:
+                self.stack.pop()
+                if self.started and not self.stack:
+                    return self.pos
+        return None
+
+
+def _complete_json(prefix: str) -> str:
+    """Cierra un objeto JSON truncado (strings, comas colgantes, llaves y corchetes abiertos)"""
+    sc = _JsonScanner()
+    sc.feed(prefix)
+    text = prefix + ('"' if sc.in_str else "")
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    return text + "".join(reversed(sc.stack))
+
+
+def _with_defaults(data: dict, defaults: dict) -> dict:
+    """Completa claves faltantes (recursivo) con los valores del template"""
+    out = dict(defaults)
+    for k, v in data.items():
+        if isinstance(v, dict) and isinstance(defaults.get(k), dict):
+            out[k] = _with_defaults(v, defaults[k])
+        else:
+            out[k] = v
+    return out
+
+
+# Reportes completados por el bot (no salidos tal cual del modelo): no se guardan en llm_cache
+REPAIRED_NOTE = "json_repaired"
+EARLY_STOP_NOTE = "stream_early_stop"
+FALLBACK_NOTE = "python_fallback"
+_UNCACHEABLE_NOTES = (REPAIRED_NOTE, EARLY_STOP_NOTE)
+
+
+def _cacheable(report: StructureReport) -> bool:
+    notes = report.validity_checks.notes or ""
+    return not any(n in notes for n in _UNCACHEABLE_NOTES)
+
+
+_PY_LITERALS = re.compile(r"\b(None|True|False)\b")
+_PY_JSON = {"None": "null", "True": "true", "False": "false"}
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_LEG_KEYS = ("high_ts", "high_price", "low_ts", "low_price")
+
+
+def _enum(v):
+    """Normaliza un valor de enum: mayúsculas; "", "null", "none" -> None"""
+    if not isinstance(v, str):
+        return v
+    v = v.strip().upper()
+    return None if v in ("", "NULL", "NONE") else v
+
+
+def _repair_json(text: str) -> dict:
+    """
+    Parser tolerante para respuestas que no validan tal cual:
+    - objeto truncado (num_predict agotado): se cierra y, si el corte quedó a mitad
+      de un par clave/valor, se descarta ese último par
+    - comas colgantes y literales Python (None / True / False)
+    - enums con otra capitalización ("up", "Bullish", "hl")
+    - secciones nulas, legs incompletos y claves faltantes -> valores del template
+    Lanza ValueError si no hay un objeto JSON recuperable.
+    """
+    cleaned = (text or "").replace("```json", "").replace("```", "")
+    start = cleaned.find("{")
+    if start == -1:
+        raise ValueError("respuesta sin objeto JSON")
+    body = cleaned[start:]
+    end = _JsonScanner().feed(body)
+    if end is not None:
+        body = body[:end]
+    for _ in range(8):
+        candidate = body if end is not None else _complete_json(body)
+        candidate = _TRAILING_COMMA.sub(r"\1", _PY_LITERALS.sub(lambda m: _PY_JSON[m.group(1)], candidate))
+        try:
+            data = json.loads(candidate)
+            break
+        except ValueError:
+            cut = body.rfind(",")
+            if end is not None or cut <= 0:
+                raise
+            body = body[:cut]
+    else:
+        raise ValueError("JSON irreparable tras recortar 8 pares")
+    if not isinstance(data, dict):
+        raise ValueError("la respuesta no es un objeto JSON")
+    return _normalize_report(data)
+
+
+def _normalize_report(data: dict) -> dict:
+    """Enums en mayúsculas, nulos -> template; trend no se inventa (sin trend no valida)"""
+    for section in ("choch", "post_choch_swing", "validity_checks"):
+        if not isinstance(data.get(section), dict):
+            data.pop(section, None)
+    if not isinstance(data.get("last_swings"), list):
+        data.pop("last_swings", None)
+    data = _with_defaults(data, {k: v for k, v in _TEMPLATE_DEFAULTS.items() if k != "trend"})
+
+    data["trend"] = _enum(data.get("trend"))
+    choch, post, validity = data["choch"], data["post_choch_swing"], data["validity_checks"]
+    choch["direction"] = _enum(choch["direction"])
+    choch["broken_level_type"] = _enum(choch["broken_level_type"])
+    choch["detected"] = bool(choch["detected"])
+    leg = choch["leg"]
+    if not isinstance(leg, dict) or any(leg.get(k) is None for k in _LEG_KEYS):
+        choch["leg"] = None
+    post["type"] = _enum(post["type"])
+    post["exists"] = bool(post["exists"])
+    validity["broke_on_close"] = bool(validity["broke_on_close"])
+    validity["notes"] = validity["notes"] or ""
+    data["last_swings"] = [
+        {**s, "type": _enum(s.get("type"))} for s in data["last_swings"]
+        if isinstance(s, dict) and all(s.get(k) is not None for k in ("type", "ts", "price"))
+    ]
+    try:
+        data["confidence"] = min(1.0, max(0.0, float(data["confidence"] or 0.0)))
+    except (TypeError, ValueError):
+        data["confidence"] = 0.0
+    return data
+
+
+def _stream_generate(req: dict, timeout: float = 90, url: str = LLM_URL,
+                     cancel: Optional[threading.Event] = None, path: str = "/api/generate",
+                     early_stop: bool = True) -> str:
+    """
+    Llama `path` (/api/generate o /api/chat) en modo streaming y corta apenas:
+    - el objeto JSON raíz está completo, o
+    - aparece choch.detected=false (el resto no cambia la decisión; se completa con el template;
+      solo con early_stop), o
+    - `cancel` se activa (otro backend ganó la carrera): lanza Cancelled.
+    Cerrar la conexión hace que Ollama detenga la generación.
+    """
+    t0 = time.perf_counter()
+    ttft = None
+    text = ""
+    decision = "done"
+    scanner = _JsonScanner()
+    early_checked = False
+    with requests.post(f"{url}{path}", json={**req, "stream": True},
+                       stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if cancel is not None and cancel.is_set():
+                raise Cancelled(req.get("model"))
+            if not line:
+                continue
+            chunk = json.loads(line)
+            piece = _response_text(chunk)
+            if piece:
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                start = len(text)
+                text += piece
+                end = scanner.feed(piece)
+                if end is not None:
+                    text = text[:end]
+                    decision = "complete"
+                    break
+                m = None if early_checked or not early_stop else _EARLY_NO_CHOCH.search(text, max(0, start - 64))
+                if m:
+                    # Solo se corta si el modelo ya emitió trend: nunca se inventa la tendencia.
+                    # Lo parseado queda tal cual; el resto (confidence incluida) sale del template
+                    # y el reporte se marca para no ir a llm_cache.
+                    early_checked = True
+                    data = json.loads(_complete_json(text[:m.end()]))
+                    if "trend" in data:
+                        data = _with_defaults(data, _TEMPLATE_DEFAULTS)
+                        data["validity_checks"]["notes"] = f"{EARLY_STOP_NOTE}: no choch"
+                        text = json.dumps(data)
+                        decision = "early_no_choch"
+                        break
+            if chunk.get("done"):
+                _record_ollama(chunk)
+                break
+
+    elapsed = time.perf_counter() - t0
+    last_call_stats.update({"ttft": ttft if ttft is not None else elapsed, "decision": elapsed})
+    metrics.observe("stage_seconds", last_call_stats["ttft"], stage="llm_ttft")
+    logger.info("LLM stream | ttft={:.2f}s decision={:.2f}s ({})",
+                last_call_stats["ttft"], elapsed, decision)
+    return text or "{}"
+
+def _decision_key(r: StructureReport) -> tuple:
+    """Campos que deciden la acción del bot (votación de self-consistency)"""
+    return (r.trend, r.choch.detected, r.choch.direction,
+            r.post_choch_swing.exists, r.post_choch_swing.type)
+
+
+def _vote(attempt, n: int) -> StructureReport:
+    """Self-consistency: el reporte más confiable del grupo mayoritario, confianza escalada por el acuerdo"""
+    group, valid = vote(attempt, LLM_BACKENDS, n, _decision_key)
+    best = max(group, key=lambda r: r.confidence)
+    agreement = len(group) / valid
+    logger.info("LLM vote | {}/{} válidas de acuerdo ({} muestras)", len(group), valid, n)
+    validity = best.validity_checks.model_copy(
+        update={"notes": f"{best.validity_checks.notes} | vote {len(group)}/{valid}".strip(" |")}
     )
-    raw1 = _call(prompt1)
-    txt1 = _extract_json(raw1)
+    return best.model_copy(update={"confidence": round(mean(r.confidence for r in group) * agreement, 4),
+                                   "validity_checks": validity})
+
+def detect_structure_with_llm(candles: List[List], pivot_candidates: List[Dict], K: int = 2) -> StructureReport:
+    t_build = time.perf_counter()
+    encoder = get_encoder(PROMPT_ENCODING)
+    data_text, codec_ctx = encoder.encode(candles, pivot_candidates, K)
+
+    options = LLM_OPTIONS
+
+    def _call(system: str, user: str, backend: Backend = LLM_BACKENDS[0],
+              cancel: Optional[threading.Event] = None, seed: Optional[int] = None) -> str:
+        global _last_request
+        _last_request = time.monotonic()
+        path, req = _ollama_request(backend, system, user,
+                                    options if seed is None else {**options, "seed": seed})
+        metrics.inc("llm_requests_total")
+        try:
+            with metrics.timer("llm_request"):
+                if LLM_STREAM or cancel is not None:
+                    # En race/vote se usa streaming aunque LLM_STREAM=false: cerrar la conexión
+                    # es la única forma de detener al perdedor (sin corte temprano en ese caso)
+                    return _stream_generate(req, timeout=90, url=backend.url, cancel=cancel, path=path,
+                                            early_stop=LLM_STREAM)
+                r = requests.post(f"{backend.url}{path}", json=req, timeout=90)  # llama3.2 es rápido
+                r.raise_for_status()
+                body = r.json()
+        except requests.Timeout:
+            metrics.inc("llm_timeouts_total")
+            raise
+        except requests.ConnectionError as e:
+            # Timeout de lectura a mitad del stream: requests lo reporta como ConnectionError
+            if e.args and isinstance(e.args[0], ReadTimeoutError):
+                metrics.inc("llm_timeouts_total")
+            raise
+        _record_ollama(body)
+        return _response_text(body) or "{}"
+
+    # ---------- Attempt 1: normal strict prompt ----------
+    # Prefijo estático (system) + datos de la vela (user); prompt1 es el equivalente plano
+    system = _static_prefix(encoder)
+    user = "Data:\n" + data_text
+    prompt1 = system + "\n\n" + user
+    metrics.observe("stage_seconds", time.perf_counter() - t_build, stage="prompt_build")
+    key = None
+    if llm_cache is not None:
+        models = "+".join(b.model for b in LLM_BACKENDS) + (f"#vote{LLM_VOTE}" if LLM_VOTE > 1 else "")
+        key = cache_key(models, LLM_TEMPERATURE, options, prompt1,
+                        {"api": LLM_API, "format": LLM_FORMAT, "codec": encoder.name})
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return StructureReport.model_validate_json(cached)
+
+    def _attempt(backend: Backend, cancel: Optional[threading.Event] = None,
+                 seed: Optional[int] = None) -> StructureReport:
+        raw = _call(system, user, backend, cancel, seed)
+        t_valid = time.perf_counter()
+        try:
+            report = StructureReport.model_validate(encoder.decode(json.loads(_extract_json(raw)), codec_ctx))
+            outcome = "ok"
+        except (ValueError, ValidationError) as e:
+            # Una generación de 10-45s no se descarta por un campo mal formado
+            try:
+                report = StructureReport.model_validate(encoder.decode(_repair_json(raw), codec_ctx))
+            except (ValueError, ValidationError):
+                metrics.inc("llm_parse_total", result="failed")
+                raise e
+            outcome = "repaired"
+            logger.info("LLM {}: respuesta reparada ({})", backend.model, str(e).splitlines()[0][:100])
+            report.validity_checks.notes = f"{report.validity_checks.notes} | {REPAIRED_NOTE}".strip(" |")
+        metrics.inc("llm_parse_total", result=outcome)
+        metrics.observe("stage_seconds", time.perf_counter() - t_valid, stage="json_validation")
+        return report
+
     try:
-        data = json.loads(txt1)
-        return StructureReport.model_validate(data)
+        if LLM_VOTE > 1:
+            report = _vote(_attempt, LLM_VOTE)
+        elif len(LLM_BACKENDS) > 1:
+            report = race(_attempt, LLM_BACKENDS, hedge_latency)
+        else:
+            report = _attempt(LLM_BACKENDS[0])
+        if key is not None and _cacheable(report):
+            llm_cache.put(key, report.model_dump_json())
+        return report
     except (ValueError, ValidationError) as e1:
         # Fallback: calcular tendencia comparando últimos pivots
+        metrics.inc("llm_fallback_total")
         logger.warning(f"JSON parse error: {str(e1)[:100]} - usando fallback Python")
         
         # Determinar tendencia comparando pivots
@@ -131,7 +499,105 @@ def detect_structure_with_llm(candles: List[List], pivot_candidates: List[Dict],
             },
             validity_checks={
                 "broke_on_close": False,
-                "notes": f"python_fallback: {str(e1)[:100]}"
+                "notes": f"{FALLBACK_NOTE}: {str(e1)[:100]}"
             },
             confidence=0.2
         )
+
+_last_request = 0.0  # monotonic del último request al LLM (el heartbeat no compite con análisis reales)
+
+
+def warm_up(backends: Optional[List[Backend]] = None):
+    """
+    Carga cada modelo y evalúa el prefijo estático con num_predict=1: la primera vela
+    no paga load_duration y encuentra las instrucciones ya en el KV cache.
+    """
+    global _last_request
+    system = _static_prefix(get_encoder(PROMPT_ENCODING))
+    for b in backends or LLM_BACKENDS:
+        _last_request = time.monotonic()
+        path, req = _ollama_request(b, system, "Data:\n", {**LLM_OPTIONS, "num_predict": 1})
+        try:
+            r = requests.post(f"{b.url}{path}", json=req, timeout=180)
+            r.raise_for_status()
+            _record_ollama(r.json())
+        except Exception as e:
+            logger.warning("LLM warm-up {} falló: {}", b.name, str(e)[:120])
+
+
+def start_heartbeat(interval: float = LLM_HEARTBEAT):
+    """Warm-up inmediato y luego uno cada `interval` seg. sin requests (hilo daemon)"""
+    if STRUCTURE_ENGINE == "rules":
+        return
+
+    def loop():
+        warm_up()
+        while interval > 0:
+            time.sleep(max(1.0, interval - (time.monotonic() - _last_request)))
+            if time.monotonic() - _last_request >= interval:
+                metrics.inc("llm_heartbeat_total")
+                warm_up()
+
+    threading.Thread(target=loop, name="llm-heartbeat", daemon=True).start()
+
+
+def detect_structure(candles: List[List], pivot_candidates: List[Dict], K: int = 2) -> StructureReport:
+    """
+    Punto de entrada según STRUCTURE_ENGINE:
+    - rules: motor determinístico (sin LLM)
+    - llm: solo LLM
+    - hybrid: motor determinístico; el LLM solo se consulta para confirmar un ChoCH candidato.
+      Si el LLM falla o cae al fallback Python se aplica HYBRID_ON_LLM_FAILURE (veto por defecto)
+    """
+    if STRUCTURE_ENGINE == "rules":
+        return detect_structure_with_rules(candles, pivot_candidates, K=K)
+    if STRUCTURE_ENGINE != "hybrid":
+        return detect_structure_with_llm(candles, pivot_candidates, K=K)
+
+    rules = detect_structure_with_rules(candles, pivot_candidates, K=K)
+    if not rules.choch.detected:
+        return rules
+
+    try:
+        llm = detect_structure_with_llm(candles, pivot_candidates, K=K)
+        notes = llm.validity_checks.notes or ""
+        failure = notes if notes.startswith(FALLBACK_NOTE) else None
+    except Exception as e:
+        llm, failure = None, str(e)[:100]
+
+    if failure is not None:
+        # LLM no disponible: no es un veredicto, se aplica la política explícita
+        metrics.inc("hybrid_llm_unavailable_total", policy=HYBRID_ON_LLM_FAILURE)
+        if HYBRID_ON_LLM_FAILURE == "pass":
+            logger.warning(f"hybrid: LLM no disponible ({failure}) - ChoCH {rules.choch.direction} sin confirmar")
+            validity = rules.validity_checks.model_copy(
+                update={"notes": f"{rules.validity_checks.notes} | llm_unavailable: pass"}
+            )
+            return rules.model_copy(update={"validity_checks": validity})
+        logger.warning(f"hybrid: LLM no disponible ({failure}) - ChoCH {rules.choch.direction} vetado")
+        return _hybrid_veto(rules, rules.confidence, "llm_unavailable")
+
+    if llm.choch.detected and llm.choch.direction == rules.choch.direction:
+        verdict, confidence = "llm_confirmed", max(rules.confidence, llm.confidence)
+    else:
+        verdict, confidence = "llm_rejected", min(rules.confidence, llm.confidence)
+    metrics.inc("hybrid_verdict_total", verdict=verdict)
+    logger.info("hybrid: ChoCH {} {} (conf {:.2f})", rules.choch.direction, verdict, confidence)
+    if verdict == "llm_confirmed":
+        validity = rules.validity_checks.model_copy(
+            update={"notes": f"{rules.validity_checks.notes} | {verdict}"}
+        )
+        return rules.model_copy(update={"confidence": confidence, "validity_checks": validity})
+    return _hybrid_veto(rules, confidence, verdict)
+
+
+def _hybrid_veto(rules: StructureReport, confidence: float, verdict: str) -> StructureReport:
+    """Vetado: sin ChoCH ni ruptura, plan_trade no puede operar este reporte"""
+    vetoed = f"ChoCH {rules.choch.direction} @ {rules.choch.broken_level_price}"
+    return rules.model_copy(update={
+        "confidence": confidence,
+        "choch": Choch(detected=False),
+        "post_choch_swing": PostChochSwing(exists=False),
+        "validity_checks": Validity(broke_on_close=False,
+                                    notes=f"{rules.validity_checks.notes} | {verdict}: {vetoed}"),
+    })
@@ -0,0 +1,155 @@
+# app/structure_rules.py
+# Deterministic market-structure engine (no LLM).
+# Builds a full StructureReport from the same candles/pivots sent to the model:
+#   - trend: last two highs/lows (same rule as the oracle's python fallback)
+#   - last_swings: most recent pivots
+#   - ChoCH:
+#       BULLISH = a candle CLOSES above the last LH (lower high)
+#       BEARISH = a candle CLOSES below the last HL (higher low)
+#     leg: impulse that produced the break
+#       BULLISH: low = min low from the LH to the break, high = max high after that low
+#       BEARISH: high = max high from the HL to the break, low = min low after that high
+#   - post_choch_swing: first HL (bullish) / LH (bearish) pivot after the break
+# Pure Python over ~30 candles: runs in well under a millisecond.
+
+from typing import Dict, List, Optional
+from structure_schema import StructureReport
+
+MAX_SWINGS = 6
+
+
+def _minute(ts: str) -> str:
+    return (ts or "")[:16]
+
+
+def trend_from_pivots(candles: List[List], pivots: List[Dict]) -> str:
+    """Tendencia UP/DOWN comparando los dos últimos highs y lows (nunca SIDEWAYS)"""
+    highs = [p for p in pivots if p.get("type") == "H"]
+    lows = [p for p in pivots if p.get("type") == "L"]
+    if len(highs) >= 2 and len(lows) >= 2:
+        if lows[-1]["price"] < lows[-2]["price"]:
+            return "DOWN"
+        if highs[-1]["price"] > highs[-2]["price"]:
+            return "UP"
+    if len(candles) >= 10:
+        return "UP" if candles[-1][4] > candles[-10][4] else "DOWN"
+    if len(candles) >= 2:
+        return "UP" if candles[-1][4] >= candles[0][4] else "DOWN"
+    return "UP"
+
+
+def _last_level(pivots: List[Dict], ptype: str, lower: bool) -> Optional[int]:
+    """Índice del último LH (ptype=H, lower=True) o HL (ptype=L, lower=False) en pivots"""
+    prev = None
+    found = None
+    for i, p in enumerate(pivots):
+        if p.get("type") != ptype:
+            continue
+        if prev is not None:
+            if (lower and p["price"] < prev["price"]) or (not lower and p["price"] > prev["price"]):
+                found = i
+        prev = p
+    return found
+
+
+def _find_break(candles: List[List], bar_of: Dict[str, int], pivot: Dict, bullish: bool):
+    """Primera vela posterior al pivot que CIERRA más allá de su precio: (idx_pivot, idx_break)"""
+    pi = bar_of.get(_minute(pivot["ts"]))
+    if pi is None:
+        return None
+    level = pivot["price"]
+    for j in range(pi + 1, len(candles)):
+        c = candles[j][4]
+        if (bullish and c > level) or (not bullish and c < level):
+            return pi, j
+    return None
+
+
+def _choch_candidate(candles, pivots, bar_of, bullish: bool):
+    li = _last_level(pivots, "H" if bullish else "L", lower=bullish)
+    if li is None:
+        return None
+    level = pivots[li]
+    hit = _find_break(candles, bar_of, level, bullish)
+    if hit is None:
+        return None
+    pi, bj = hit
+    n = len(candles)
+    if bullish:
+        lo_i = min(range(pi, bj + 1), key=lambda j: candles[j][3])
+        hi_i = max(range(lo_i, n), key=lambda j: candles[j][2])
+    else:
+        hi_i = max(range(pi, bj + 1), key=lambda j: candles[j][2])
+        lo_i = min(range(hi_i, n), key=lambda j: candles[j][3])
+    return {"level_idx": li, "level": level, "break_idx": bj, "hi_idx": hi_i, "lo_idx": lo_i}
+
+
+def detect_structure_with_rules(candles: List[List], pivot_candidates: List[Dict], K: int = 2) -> StructureReport:
+    """StructureReport determinístico a partir de velas [[ts,o,h,l,c]] y pivots [{type,ts,price}]"""
+    pivots = [p for p in pivot_candidates if p.get("ts") and p.get("price") is not None]
+    bar_of = {_minute(c[0]): i for i, c in enumerate(candles)}
+
+    trend = trend_from_pivots(candles, pivots)
+    last_swings = [{"type": p["type"], "ts": p["ts"], "price": float(p["price"])}
+                   for p in pivots[-MAX_SWINGS:]]
+
+    bull = _choch_candidate(candles, pivots, bar_of, bullish=True)
+    bear = _choch_candidate(candles, pivots, bar_of, bullish=False)
+    cand = None
+    if bull and bear:
+        cand = ("BULLISH", bull) if bull["break_idx"] >= bear["break_idx"] else ("BEARISH", bear)
+    elif bull:
+        cand = ("BULLISH", bull)
+    elif bear:
+        cand = ("BEARISH", bear)
+
+    choch = {"detected": False, "direction": None, "broken_level_type": None,
+             "broken_level_price": None, "break_close_ts": None, "leg": None}
+    post = {"exists": False, "type": None, "ts": None, "price": None}
+    notes = "rules"
+
+    if cand is None:
+        clean = len(pivots) >= 4
+        confidence = 0.5 if clean else 0.3
+    else:
+        direction, c = cand
+        bullish = direction == "BULLISH"
+        hi, lo, brk = candles[c["hi_idx"]], candles[c["lo_idx"]], candles[c["break_idx"]]
+        choch = {
+            "detected": True,
+            "direction": direction,
+            "broken_level_type": "LH" if bullish else "HL",
+            "broken_level_price": float(c["level"]["price"]),
+            "break_close_ts": brk[0],
+            "leg": {"high_ts": hi[0], "high_price": float(hi[2]),
+                    "low_ts": lo[0], "low_price": float(lo[3])},
+        }
+        # Swing de confirmación posterior al break
+        for p in pivots[c["level_idx"] + 1:]:
+            pi = bar_of.get(_minute(p["ts"]))
+            if pi is None or pi <= c["break_idx"]:
+                continue
+            if bullish and p["type"] == "L" and p["price"] > lo[3]:
+                post = {"exists": True, "type": "HL", "ts": p["ts"], "price": float(p["price"])}
+                break
+            if not bullish and p["type"] == "H" and p["price"] < hi[2]:
+                post = {"exists": True, "type": "LH", "ts": p["ts"], "price": float(p["price"])}
+                break
+
+        # Confianza: break base + swing confirmado + cambio real de carácter
+        prior = trend_from_pivots(candles[:c["break_idx"]], pivots[:c["level_idx"] + 1])
+        confidence = 0.5
+        if post["exists"]:
+            confidence += 0.15
+        if (bullish and prior == "DOWN") or (not bullish and prior == "UP"):
+            confidence += 0.1
+        notes = f"rules: close {'above LH' if bullish else 'below HL'} {c['level']['price']}"
+
+    return StructureReport(
+        trend=trend,
+        last_swings=last_swings,
+        choch=choch,
+        post_choch_swing=post,
+        validity_checks={"broke_on_close": bool(choch["detected"]), "notes": notes},
+        confidence=round(confidence, 2),
+    )
@@ -0,0 +1,126 @@
+# app/sweep.py
+# Parallel parameter sweep over the replay engine (backtest.py).
+# - The candle history is copied once into a SharedMemory block; every worker
+#   attaches to it read-only and builds NumPy views (no DataFrame pickling).
+# - Configurations are grouped by the parameters that change the structure
+#   report (K, tail, max_pivots) so each worker reuses reports across the
+#   cheaper knobs (min_confidence, fib, max_open_pos).
+# - Results come back as a ranked pandas DataFrame.
+#
+#     python sweep.py --db ./data/candles.db --days 30
+
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from backtest import BacktestConfig, _columns, _structure_source, run_backtest
+
+COLUMNS = ("ts", "open", "high", "low", "close")
+REPORT_KEYS = ("K", "tail", "max_pivots")
+
+DEFAULT_GRID = {
+    "min_confidence": [0.5, 0.6, 0.7],
+    "K": [2, 3],
+    "tail": [20, 30, 45],
+    "fib": [0.5, 0.618, 0.705],
+    "max_open_pos": [1, 2],
+}
+
+# Estado por proceso worker
+_SHM: Optional[shared_memory.SharedMemory] = None
+_DATA: Dict[str, np.ndarray] = {}
+_STRUCTURE = None
+_REPORTS: Dict[tuple, object] = {}
+
+
+def _attach(shm_name: str, n: int, structure: str):
+    """Initializer del worker: vistas NumPy sobre la memoria compartida"""
+    global _SHM, _STRUCTURE
+    _SHM = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((len(COLUMNS), n), dtype=np.float64, buffer=_SHM.buf)
+    block.flags.writeable = False
+    _DATA.update({k: block[i] for i, k in enumerate(COLUMNS)})
+    _DATA["ts"] = block[0].astype(np.int64)  # epoch ms exacto en float64 (< 2**53)
+    _STRUCTURE = _structure_source(structure)
+
+
+def _run_one(job: dict) -> dict:
+    params, base = job["params"], job["base"]
+    cfg = BacktestConfig(**{**base, **params})
+    group = tuple(getattr(cfg, k) for k in REPORT_KEYS)
+
+    def detect(window, pivots, K):
+        key = group + (window[-1][0],)
+        rep = _REPORTS.get(key)
+        if rep is None:
+            rep = _REPORTS[key] = _STRUCTURE(window, pivots, K)
+        return rep
+
+    res = run_backtest(_DATA, structure=detect, config=cfg)
+    s = res.stats
+    return {**params,
+            "pnl": s["total_realized_pnl"], "trades": s["trades"], "win_rate": s["win_rate"],
+            "max_drawdown": s["max_drawdown"], "final_equity": s["final_equity"],
+            "elapsed_s": s["elapsed_s"]}
+
+
+def run_sweep(candles, grid: Optional[Dict[str, List]] = None, structure: str = "rules",
+              base: Optional[dict] = None, workers: Optional[int] = None,
+              rank_by: str = "pnl") -> pd.DataFrame:
+    """Corre todas las combinaciones de `grid` en un pool de procesos y retorna la tabla rankeada"""
+    grid = grid or DEFAULT_GRID
+    base = base or {}
+    keys = list(grid)
+    combos = [dict(zip(keys, vals)) for vals in itertools.product(*grid.values())]
+    # Agrupa por parámetros que cambian el reporte para reutilizarlo dentro de cada worker
+    defaults = BacktestConfig()
+    combos.sort(key=lambda p: tuple(p.get(k, base.get(k, getattr(defaults, k))) for k in REPORT_KEYS))
+
+    col = _columns(candles)
+    n = len(col["ts"])
+    workers = workers or os.cpu_count() or 1
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(COLUMNS) * n * 8))
+    try:
+        block = np.ndarray((len(COLUMNS), n), dtype=np.float64, buffer=shm.buf)
+        for i, k in enumerate(COLUMNS):
+            block[i] = col[k]
+        chunk = max(1, math.ceil(len(combos) / (workers * 4)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(shm.name, n, structure)) as pool:
+            rows = list(pool.map(_run_one, [{"params": p, "base": base} for p in combos], chunksize=chunk))
+        del block
+    finally:
+        shm.close()
+        shm.unlink()
+
+    table = pd.DataFrame(rows).sort_values(rank_by, ascending=False).reset_index(drop=True)
+    table.index = table.index + 1
+    table.index.name = "rank"
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from backtest import load_candles
+
+    ap = argparse.ArgumentParser(description="Barrido de parámetros en paralelo")
+    ap.add_argument("--db", default="./data/candles.db")
+    ap.add_argument("--exchange", default="binance")
+    ap.add_argument("--symbol", default="BTC/USDT")
+    ap.add_argument("--timeframe", default="5m")
+    ap.add_argument("--days", type=float, default=30)
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    since = int((time.time() - args.days * 86400) * 1000)
+    data = load_candles(args.db, args.exchange, args.symbol, args.timeframe, since=since)
+    t0 = time.perf_counter()
+    table = run_sweep(data, base={"symbol": args.symbol}, workers=args.workers)
+    print(table.head(args.top).to_string())
+    print(f"{len(table)} configuraciones en {time.perf_counter() - t0:.1f}s")
@@ -1,9 +1,31 @@
+# app/trade_tracker.py
+# Session statistics for signals and positions.
+# - Counters per (status, direction) are updated on add_signal /
+#   update_signal_status, so get_session_stats() never rescans the signals.
+# - Rolling windows (1h / 24h / 7d) are ring buffers of fixed time buckets with
+#   running totals: expired buckets are subtracted as time advances, queries are
+#   O(1) no matter how many signals the session (or a replay) has seen. A window
+#   covers its span plus at most one bucket of granularity.
+# - Realized PnL comes from ExchangeEngine close events (attach(engine)); a
+#   position opened for a signal (add_signal(..., position=p)) moves that signal
+#   to FILLED / CLOSED_TP / CLOSED_SL as the engine reports it.
+# - Only the last `max_signals` TradeSignal objects are kept in memory.
+#
+# `clock` (epoch seconds) can be replaced by the candle time in replays.
+
+import threading
 import time
+from collections import Counter, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Tuple
+from dataclasses import dataclass, field
 from loguru import logger
 
+WINDOW_FIELDS = ("detected", "bullish", "bearish", "filled", "invalidated", "closed_tp", "closed_sl", "pnl")
+# nombre -> (duración en segundos, cantidad de buckets)
+WINDOWS: Dict[str, Tuple[int, int]] = {"1h": (3600, 60), "24h": (86400, 96), "7d": (7 * 86400, 168)}
+CLOSED_STATUSES = ("CLOSED_TP", "CLOSED_SL")
+
 @dataclass
 class TradeSignal:
     """Representa una señal de trading detectada"""
@@ -14,6 +36,7 @@ class TradeSignal:
     take_profit: float
     confidence: float
     status: str = "DETECTED"  # DETECTED, FILLED, INVALIDATED, CLOSED_TP, CLOSED_SL
+    pnl: Optional[float] = None  # PnL realizado de la posición asociada (al cerrar)
 
 @dataclass
 class TradeStats:
@@ -22,26 +45,90 @@ class TradeStats:
     signals_bullish: int = 0
     signals_bearish: int = 0
     signals_filled: int = 0
+    signals_filled_bullish: int = 0
+    signals_filled_bearish: int = 0
     signals_invalidated: int = 0
     positions_open: int = 0
     positions_closed_tp: int = 0
     positions_closed_sl: int = 0
     realized_pnl: float = 0.0
     pending_orders: int = 0
+    windows: Dict[str, Dict[str, float]] = field(default_factory=dict)  # "1h" -> eventos en la ventana
+
+class RollingWindow:
+    """Sumas de una ventana móvil en buckets de tiempo fijos (ring buffer)"""
+
+    def __init__(self, span: float, buckets: int, fields=WINDOW_FIELDS):
+        self.width = span / buckets
+        self.n = buckets
+        self._epoch = [None] * buckets
+        self._slots = [dict.fromkeys(fields, 0) for _ in range(buckets)]
+        self.totals = dict.fromkeys(fields, 0)
+        self._head: Optional[int] = None  # último bucket alcanzado
+
+    def _advance(self, now: float) -> int:
+        """Mueve la ventana hasta `now` restando los buckets que vencen; retorna el bucket de `now`"""
+        e = int(now // self.width)
+        if self._head is None:
+            self._head = e
+            self._epoch[e % self.n] = e
+        elif e > self._head:
+            for k in range(self._head + 1, self._head + 1 + min(e - self._head, self.n)):
+                i = k % self.n
+                slot = self._slots[i]
+                for f, v in slot.items():
+                    if v:
+                        self.totals[f] -= v
+                        slot[f] = 0
+                self._epoch[i] = k
+            self._epoch[e % self.n] = e
+            self._head = e
+        return e
+
+    def add(self, now: float, **values):
+        e = self._advance(now)
+        if e <= self._head - self.n:
+            return  # evento más viejo que la ventana
+        i = e % self.n
+        if self._epoch[i] != e:
+            return
+        slot = self._slots[i]
+        for f, v in values.items():
+            slot[f] += v
+            self.totals[f] += v
+
+    def query(self, now: float) -> Dict[str, float]:
+        self._advance(now)
+        return dict(self.totals)
 
 class TradeTracker:
     """Sistema de seguimiento de trades y estadísticas"""
-    
-    def __init__(self):
+
+    def __init__(self, clock: Callable[[], float] = time.time, max_signals: int = 1000):
+        self.clock = clock
         self.session_start = datetime.now()
-        self.signals: List[TradeSignal] = []
+        self.signals: Deque[TradeSignal] = deque(maxlen=max_signals)
         self.last_stats_log = datetime.now()
         self.stats_interval = timedelta(minutes=5)  # Log cada 5 minutos
-        
-    def add_signal(self, direction: str, entry: float, stop: float, tp: float, confidence: float) -> TradeSignal:
-        """Agrega una nueva señal de trading"""
+        self.realized_pnl = 0.0
+        self.windows = {name: RollingWindow(span, n) for name, (span, n) in WINDOWS.items()}
+        self._counts: Counter = Counter()          # (status, direction) -> señales
+        self._live: Dict[int, str] = {}            # id(position) -> estado vivo en el engine
+        self._live_counts: Counter = Counter()
+        self._by_position: Dict[int, TradeSignal] = {}
+        self._lock = threading.RLock()  # los cierres pueden llegar desde el hilo de PriceWatcher
+
+    def _window_add(self, now: Optional[float] = None, **values):
+        now = self.clock() if now is None else now
+        for w in self.windows.values():
+            w.add(now, **values)
+
+    def add_signal(self, direction: str, entry: float, stop: float, tp: float, confidence: float,
+                   position=None, ts: Optional[float] = None) -> TradeSignal:
+        """Agrega una nueva señal de trading (position: la posición del engine abierta para ella)"""
+        ts = self.clock() if ts is None else ts
         signal = TradeSignal(
-            timestamp=datetime.now(),
+            timestamp=datetime.fromtimestamp(ts),
             direction=direction,
             entry_price=entry,
             stop_loss=stop,
@@ -49,78 +136,121 @@ class TradeTracker:
             confidence=confidence,
             status="DETECTED"
         )
-        self.signals.append(signal)
+        with self._lock:
+            self.signals.append(signal)
+            self._counts[("DETECTED", direction)] += 1
+            self._window_add(ts, detected=1, **{"bullish" if direction == "BULLISH" else "bearish": 1})
+            if position is not None:
+                self._by_position[id(position)] = signal
         return signal
-    
-    def update_signal_status(self, signal: TradeSignal, new_status: str):
-        """Actualiza el estado de una señal"""
-        signal.status = new_status
-    
+
+    def update_signal_status(self, signal: TradeSignal, new_status: str, pnl: Optional[float] = None):
+        """Actualiza el estado de una señal (pnl: realizado, al cerrar)"""
+        with self._lock:
+            if new_status == signal.status:
+                return
+            self._counts[(signal.status, signal.direction)] -= 1
+            self._counts[(new_status, signal.direction)] += 1
+            signal.status = new_status
+            if pnl is not None:
+                signal.pnl = pnl
+            if new_status in ("FILLED", "INVALIDATED", "CLOSED_TP", "CLOSED_SL"):
+                self._window_add(**{new_status.lower(): 1})
+
+    # ---------- Eventos del engine ----------
+    def attach(self, engine):
+        """Toma posiciones abiertas/cerradas y PnL real de las transiciones del engine"""
+        engine.listeners.append(self.on_position)
+
+    def on_position(self, p):
+        """Listener de ExchangeEngine: PENDING_ENTRY / OPEN / CLOSED_*"""
+        with self._lock:
+            key = id(p)
+            prev = self._live.pop(key, None)
+            if prev is not None:
+                self._live_counts[prev] -= 1
+            signal = self._by_position.get(key)
+
+            if p.status not in CLOSED_STATUSES:
+                self._live[key] = p.status
+                self._live_counts[p.status] += 1
+                if p.status == "OPEN" and signal is not None:
+                    self.update_signal_status(signal, "FILLED")
+                return
+
+            # Cierre (el engine lo publica una sola vez por posición)
+            self.realized_pnl += p.pnl
+            self._window_add(pnl=p.pnl)
+            signal = self._by_position.pop(key, None)
+            if signal is not None:
+                self.update_signal_status(signal, p.status, pnl=p.pnl)
+            else:
+                # Posición sin señal asociada (p.ej. recuperada del journal)
+                self._window_add(**{p.status.lower(): 1})
+                self._counts[(p.status, None)] += 1
+
+    # ---------- Estadísticas ----------
+    def _count(self, status: str, direction: Optional[str] = "*") -> int:
+        if direction != "*":
+            return self._counts[(status, direction)]
+        return sum(v for (s, _), v in self._counts.items() if s == status)
+
     def get_session_stats(self) -> TradeStats:
-        """Calcula las estadísticas de la sesión actual"""
-        stats = TradeStats()
-        
-        for signal in self.signals:
-            if signal.status == "DETECTED":
-                stats.signals_detected += 1
-                if signal.direction == "BULLISH":
-                    stats.signals_bullish += 1
-                else:
-                    stats.signals_bearish += 1
-            elif signal.status == "FILLED":
-                stats.signals_filled += 1
-            elif signal.status == "INVALIDATED":
-                stats.signals_invalidated += 1
-            elif signal.status == "CLOSED_TP":
-                stats.positions_closed_tp += 1
-            elif signal.status == "CLOSED_SL":
-                stats.positions_closed_sl += 1
-        
-        # Calcular PnL (simulado - en implementación real vendría del exchange)
-        stats.realized_pnl = self._calculate_realized_pnl()
-        
-        return stats
-    
-    def _calculate_realized_pnl(self) -> float:
-        """Calcula el PnL realizado (simulado)"""
-        # En una implementación real, esto vendría del exchange
-        # Por ahora, simulamos basado en señales cerradas
-        closed_tp = sum(1 for s in self.signals if s.status == "CLOSED_TP")
-        closed_sl = sum(1 for s in self.signals if s.status == "CLOSED_SL")
-        
-        # Simulación simple: TP = +100, SL = -50
-        return (closed_tp * 100.0) - (closed_sl * 50.0)
-    
+        """Estadísticas de la sesión actual (contadores incrementales, O(1))"""
+        now = self.clock()
+        with self._lock:
+            return self._stats(now)
+
+    def _stats(self, now: float) -> TradeStats:
+        return TradeStats(
+            signals_detected=self._count("DETECTED"),
+            signals_bullish=self._count("DETECTED", "BULLISH"),
+            signals_bearish=self._count("DETECTED", "BEARISH"),
+            signals_filled=self._count("FILLED"),
+            signals_filled_bullish=self._count("FILLED", "BULLISH"),
+            signals_filled_bearish=self._count("FILLED", "BEARISH"),
+            signals_invalidated=self._count("INVALIDATED"),
+            positions_open=self._live_counts["OPEN"],
+            positions_closed_tp=self._count("CLOSED_TP"),
+            positions_closed_sl=self._count("CLOSED_SL"),
+            realized_pnl=self.realized_pnl,
+            pending_orders=self._live_counts["PENDING_ENTRY"],
+            windows={name: w.query(now) for name, w in self.windows.items()},
+        )
+
     def should_log_stats(self) -> bool:
         """Determina si es tiempo de hacer log de estadísticas"""
         return datetime.now() - self.last_stats_log >= self.stats_interval
-    
+
     def log_session_stats(self, current_price: float, price_change: float = 0.0):
         """Hace log de las estadísticas de sesión"""
         stats = self.get_session_stats()
-        
+
         logger.info("=== Estadísticas de sesión ===")
         logger.info(f"• Señales detectadas: (BUY: {stats.signals_bullish}, SELL: {stats.signals_bearish})")
-        logger.info(f"• Señales llenadas: (BUY: {stats.signals_filled}, SELL: {stats.signals_filled})")
+        logger.info(f"• Señales llenadas: (BUY: {stats.signals_filled_bullish}, SELL: {stats.signals_filled_bearish})")
         logger.info(f"• Señales invalidadas: {stats.signals_invalidated}")
         logger.info(f"• Posiciones abiertas: {stats.positions_open}")
         logger.info(f"• Posiciones cerradas: TP {stats.positions_closed_tp}, SL {stats.positions_closed_sl}")
         logger.info(f"• PnL realizado: {stats.realized_pnl:.2f} USDT")
+        for name, w in stats.windows.items():
+            logger.info(f"• Últimas {name}: señales {w['detected']:.0f}, TP {w['closed_tp']:.0f}, "
+                        f"SL {w['closed_sl']:.0f}, PnL {w['pnl']:.2f} USDT")
         logger.info(f"• Estado actual: {stats.pending_orders} pendientes, {stats.positions_open} abiertas")
         logger.info(f"• Precio actual: {current_price:.2f} | Cambio: {price_change:.2f}%")
         logger.info("Esperando 60 segundos...")
-        
+
         self.last_stats_log = datetime.now()
-    
+
     def get_price_info(self, df) -> tuple:
         """Extrae información de precio del DataFrame"""
         if df.empty:
             return 0.0, 0.0, "N/A"
-        
+
         current_price = float(df["close"].iloc[-1])
         prev_price = float(df["close"].iloc[-2]) if len(df) > 1 else current_price
         change = ((current_price - prev_price) / prev_price * 100) if prev_price != 0 else 0.0
-        
-        last_candle_ts = df["ts"].iloc[-1].strftime("%Y-%m-%dT%H:%M:%S%z")
-        
+
+        last_candle_ts = datetime.fromtimestamp(int(df["ts"].iloc[-1]) / 1000).astimezone().strftime("%Y-%m-%dT%H:%M:%S%z")
+
         return current_price, change, last_candle_ts
@@ -1,23 +1,253 @@
-import os, requests
+import os
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from zoneinfo import ZoneInfo
+from notifier import get_notifier
 
 BOT = os.getenv("TELEGRAM_BOT_TOKEN", "7494717589:AAFyvGDvoU1ae3KUljQp6UhB1L3d9LJ_SOc")
 CHAT = os.getenv("TELEGRAM_CHAT_ID", "2128579285")
 
 def telegram(text: str):
+    """Encola el mensaje; el envío ocurre en el hilo de notifier.py (no bloquea el loop)"""
     if not BOT or not CHAT: return
-    try:
-        requests.post(f"https://api.telegram.org/bot{BOT}/sendMessage",
-                      json={"chat_id": CHAT, "text": text}, timeout=10)
-    except Exception:
-        pass
-
-def fractal_pivot_candidates(df: pd.DataFrame, K:int=2):
-    cands = []
-    for i in range(K, len(df)-K):
-        high = df["high"].iloc[i]; low = df["low"].iloc[i]
-        if (df["high"].iloc[i-K:i] < high).all() and (df["high"].iloc[i+1:i+1+K] < high).all():
-            cands.append({"type":"H","ts": df["ts"].iloc[i].isoformat(), "price": float(high)})
-        if (df["low"].iloc[i-K:i] > low).all() and (df["low"].iloc[i+1:i+1+K] > low).all():
-            cands.append({"type":"L","ts": df["ts"].iloc[i].isoformat(), "price": float(low)})
-    return cands
+    get_notifier(BOT, CHAT).send(text)
+
+OHLCV_COLUMNS = ["ts", "open", "high", "low", "close", "volume"]
+
+def ohlcv_frame(rows) -> pd.DataFrame:
+    """Filas ccxt -> DataFrame columnar: ts int64 (epoch ms), precios float64, sin zona horaria"""
+    arr = np.asarray(rows, dtype=np.float64).reshape(-1, 6)  # epoch ms < 2**53: exacto en float64
+    df = pd.DataFrame(arr, columns=OHLCV_COLUMNS)
+    df["ts"] = arr[:, 0].astype(np.int64)
+    return df
+
+def ts_to_ms(ts) -> np.ndarray:
+    """Convierte una columna de timestamps (datetime o epoch ms) a int64 epoch ms"""
+    s = pd.Series(ts) if not isinstance(ts, pd.Series) else ts
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return pd.DatetimeIndex(s).as_unit("ms").asi8
+    return s.to_numpy(dtype=np.int64)
+
+def fractal_pivots(high: np.ndarray, low: np.ndarray, K: int = 2):
+    """
+    Detección vectorizada de pivots fractales (ventana deslizante max/min).
+    Retorna (idx, is_high) ordenados por índice de vela, H antes que L en la misma vela.
+    Misma semántica que el loop original: comparación estricta contra K velas a cada lado.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    n = len(high)
+    if K < 0 or n < 2 * K + 1:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+
+    if K == 0:
+        # ventana vacía: .all() de pandas es True para todas las velas
+        is_h = np.ones(n, dtype=bool)
+        is_l = np.ones(n, dtype=bool)
+    else:
+        # win[j] = valores[j:j+K]; NaN se propaga en max/min y la comparación da False
+        h_max = sliding_window_view(high, K).max(axis=1)
+        l_min = sliding_window_view(low, K).min(axis=1)
+        ch = high[K:n - K]
+        cl = low[K:n - K]
+        with np.errstate(invalid="ignore"):
+            is_h = (h_max[:n - 2 * K] < ch) & (h_max[K + 1:] < ch)
+            is_l = (l_min[:n - 2 * K] > cl) & (l_min[K + 1:] > cl)
+
+    ih = np.flatnonzero(is_h) + K
+    il = np.flatnonzero(is_l) + K
+    idx = np.concatenate([ih, il])
+    is_high = np.concatenate([np.ones(len(ih), dtype=bool), np.zeros(len(il), dtype=bool)])
+    order = np.lexsort((~is_high, idx))
+    return idx[order], is_high[order]
+
+def fractal_pivot_candidates(df: pd.DataFrame, K:int=2, as_arrays: bool = False):
+    """
+    Pivots fractales H/L del DataFrame OHLCV.
+    - as_arrays=False: lista de dicts {"type","ts"(ISO),"price"} (formato histórico).
+    - as_arrays=True: dict columnar {"idx","type","ts_ms","price"} con arrays NumPy,
+      para filtrar por timestamp sin parsear strings.
+    """
+    high = df["high"].to_numpy(dtype=np.float64)
+    low = df["low"].to_numpy(dtype=np.float64)
+    idx, is_high = fractal_pivots(high, low, K)
+    price = np.where(is_high, high[idx], low[idx])
+
+    if as_arrays:
+        return {
+            "idx": idx,
+            "type": np.where(is_high, "H", "L"),
+            "ts_ms": ts_to_ms(df["ts"])[idx],
+            "price": price,
+        }
+
+    ts = df["ts"].iloc[idx]
+    return [
+        {"type": "H" if h else "L", "ts": t.isoformat(), "price": float(p)}
+        for h, t, p in zip(is_high.tolist(), ts, price.tolist())
+    ]
+
+class IncrementalPivotTracker:
+    """
+    Detector de pivots fractales alimentado vela a vela (solo velas CERRADAS).
+    Un pivot en la vela i se confirma cuando llegan sus K velas a la derecha,
+    con costo O(K) por vela. Produce los mismos pivots que fractal_pivot_candidates,
+    con "ts" tal como llegó (epoch ms en el loop en vivo, índice de vela en backtest).
+    Los pivots recientes se guardan en un ring buffer acotado (maxlen).
+    """
+
+    def __init__(self, K: int = 2, maxlen: int = 64):
+        self.K = K
+        self._win = deque(maxlen=2 * K + 1)   # (ts, high, low) de las últimas 2K+1 velas
+        self.pivots = deque(maxlen=maxlen)
+        self.last_ts = None
+
+    def reset(self):
+        self._win.clear()
+        self.pivots.clear()
+        self.last_ts = None
+
+    def update(self, ts, high: float, low: float) -> list:
+        """Agrega una vela cerrada; retorna los pivots confirmados por ella (0, 1 o 2)"""
+        self._win.append((ts, float(high), float(low)))
+        self.last_ts = ts
+        K = self.K
+        if len(self._win) < 2 * K + 1:
+            return []
+
+        c_ts, ch, cl = self._win[K]
+        sides = list(islice(self._win, 0, K)) + list(islice(self._win, K + 1, None))
+        new = []
+        if all(w[1] < ch for w in sides):
+            new.append({"type": "H", "ts": c_ts, "price": ch})
+        if all(w[2] > cl for w in sides):
+            new.append({"type": "L", "ts": c_ts, "price": cl})
+        self.pivots.extend(new)
+        return new
+
+    def sync(self, df: pd.DataFrame) -> list:
+        """
+        Alimenta las velas de df posteriores a la última vista.
+        Si la última vela vista ya no está en df (hueco), reinicia y reprocesa todo df.
+        """
+        ts_col = df["ts"]
+        if self.last_ts is not None:
+            newer = (ts_col > self.last_ts).to_numpy()
+            if not newer.any():
+                return []
+            if not (ts_col == self.last_ts).any():
+                self.reset()
+                newer = np.ones(len(df), dtype=bool)
+        else:
+            newer = np.ones(len(df), dtype=bool)
+
+        new = []
+        for ts, high, low in zip(ts_col[newer], df["high"].to_numpy()[newer], df["low"].to_numpy()[newer]):
+            new.extend(self.update(ts, high, low))
+        return new
+
+@lru_cache(maxsize=8192)
+def _utc_offset_min(tz: str, bucket: int) -> int:
+    """Offset UTC (minutos) de `tz` en el bloque de 15 min `bucket` (los cambios de hora caen en bordes de 15 min)"""
+    return int(datetime.fromtimestamp(bucket * 900, ZoneInfo(tz)).utcoffset().total_seconds() // 60)
+
+def _fmt_offset(minutes: int) -> str:
+    sign = "+" if minutes >= 0 else "-"
+    h, m = divmod(abs(minutes), 60)
+    return f"{sign}{h:02d}:{m:02d}"
+
+def iso_minutes(ts_ms, tz: str = "UTC") -> list:
+    """
+    Epoch ms -> isoformat(timespec="minutes") en `tz` ("2024-01-01T09:05-03:00"), vectorizado.
+    La conversión de zona horaria se hace solo aquí, al formatear.
+    """
+    ts_ms = np.asarray(ts_ms, dtype=np.int64)
+    if ts_ms.size == 0:
+        return []
+    buckets, inv = np.unique(ts_ms // 900_000, return_inverse=True)
+    offs = np.array([_utc_offset_min(tz, int(b)) for b in buckets], dtype=np.int64)
+    off = offs[inv]
+    wall = np.datetime_as_string((ts_ms + off * 60_000).astype("datetime64[ms]"), unit="m")
+    if len(offs) == 1 or (offs == offs[0]).all():  # caso común: un solo offset
+        return np.char.add(wall, _fmt_offset(int(offs[0]))).tolist()
+    return [w + _fmt_offset(int(o)) for w, o in zip(wall.tolist(), off.tolist())]
+
+def _as_ms(values) -> np.ndarray:
+    arr = np.asarray(values)
+    return arr.astype(np.int64) if arr.dtype.kind in "iu" else ts_to_ms(pd.Series(list(values)))
+
+def llm_payload(work_df, tracker: IncrementalPivotTracker, tail: int = 30, max_pivots: int = 14,
+                tz: str = "UTC"):
+    """
+    Contexto compacto para el oráculo a partir de las velas CERRADAS:
+    - candles: últimas `tail` velas [[ISO minuto, o, h, l, c], ...] (2 decimales)
+    - pivots: pivots del tracker dentro de esa ventana (máx `max_pivots`), ts recortado a minuto
+    work_df: DataFrame o dict de arrays con "ts" en epoch ms (int64) y precios float64;
+    el tracker debe alimentarse con la misma columna ts. Los timestamps se formatean en `tz`.
+    """
+    ts_col = work_df["ts"]
+    ts_raw = ts_col.to_numpy() if isinstance(ts_col, pd.Series) else np.asarray(ts_col)
+    ts_raw = ts_raw[-tail:]  # 30 velas = 2.5 horas (suficiente para detectar estructura)
+    n = len(ts_raw)
+    ohlc = np.column_stack([np.asarray(work_df[k], dtype=np.float64)[-n:]
+                            for k in ("open", "high", "low", "close")]).round(2)
+
+    # Filtro por timestamp entero (mismo tipo que alimentó al tracker, sin strings)
+    first = ts_raw[0]
+    recent = [p for p in tracker.pivots if p.get("ts") is not None and p["ts"] >= first][-max_pivots:]
+    pivots = []
+    if recent:
+        p_iso = iso_minutes(_as_ms([p["ts"] for p in recent]), tz)
+        pivots = [{"type": p.get("type"), "ts": s[:16], "price": round(float(p.get("price", 0.0)), 2)}
+                  for p, s in zip(recent, p_iso)]
+
+    candles = [[s, *row] for s, row in zip(iso_minutes(_as_ms(ts_raw), tz), ohlc.tolist())]
+    return candles, pivots
+
+
+if __name__ == "__main__":
+    # Microbenchmark del camino completo filas ccxt -> payload (300 velas, vela nueva)
+    import time
+
+    TZ = "America/Santiago"
+    rng = np.random.default_rng(7)
+    n = 300
+    close = 60000 + np.cumsum(rng.normal(0, 30, n))
+    open_ = np.r_[close[0], close[:-1]]
+    rows = np.column_stack([
+        1_712_000_000_000 + np.arange(n) * 300_000, open_,
+        np.maximum(open_, close) + rng.random(n) * 20, np.minimum(open_, close) - rng.random(n) * 20,
+        close, np.ones(n),
+    ]).tolist()
+
+    def legacy():
+        """Camino anterior: tz_convert de todo el frame, pivots ISO, iterrows + isoformat por fila"""
+        df = pd.DataFrame(rows, columns=OHLCV_COLUMNS)
+        df["ts"] = pd.to_datetime(df["ts"], unit="ms", utc=True).dt.tz_convert(TZ)
+        work = df.iloc[:-1]
+        window = work.tail(30)
+        first_ts = window["ts"].iloc[0].isoformat()
+        piv = [p for p in fractal_pivot_candidates(work, K=2) if p["ts"] >= first_ts][-14:]
+        pivots = [{"type": p["type"], "ts": p["ts"][:16], "price": round(p["price"], 2)} for p in piv]
+        candles = [[r.ts.isoformat(timespec="minutes"), round(float(r.open), 2), round(float(r.high), 2),
+                    round(float(r.low), 2), round(float(r.close), 2)] for _, r in window.iterrows()]
+        return candles, pivots
+
+    tracker = IncrementalPivotTracker(K=2, maxlen=64)
+
+    def columnar():
+        work = ohlcv_frame(rows).iloc[:-1]
+        tracker.sync(work)
+        return llm_payload(work, tracker, tail=30, max_pivots=14, tz=TZ)
+
+    assert legacy() == columnar()
+    for fn in (legacy, columnar):
+        t0 = time.perf_counter()
+        for _ in range(500):
+            fn()
+        print(f"{fn.__name__:10s} {(time.perf_counter() - t0) / 500 * 1e3:.3f} ms/vela")